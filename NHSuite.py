@@ -26,15 +26,33 @@
 """
 
 import argparse
+import csv
+import sys
+import time
 import qradarzoldaxlib
+import qradarzoldaxvalidator
+import qradarzoldaxlookup
+import qradarzoldaxconsoles
+import qradarzoldaxbackup
+import qradarzoldaxmetrics
+import qradarzoldaxfilter
+import qradarzoldaxgroups
+import qradarzoldaxoptimize
+import qradarzoldaxsqlite
+import qradarzoldaxwatch
 from qradarzoldaxclass import QRadarNetworkHierarchy
 
 # export_data and import_data helper functions to handle exporting and importing 
 
-def export_data(qradar_nh, export_file):
-    """Export data to CSV file."""
+def export_data(qradar_nh, export_file, export_filter=None):
+    """Export data to CSV file (or to a SQLite database for .db, .sqlite and .sqlite3 files)."""
     try:
-        lines_exported = qradar_nh.write_network_hierarchy_to_csv(export_file)
+        if qradarzoldaxsqlite.is_sqlite_file(export_file):
+            networks_exported = qradar_nh.write_network_hierarchy_to_sqlite(export_file, export_filter=export_filter)
+            if not networks_exported:
+                return "No data exported."
+            return f"{networks_exported} networks exported successfully in database : {export_file} !"
+        lines_exported = qradar_nh.write_network_hierarchy_to_csv(export_file, export_filter=export_filter)
         if lines_exported == 1:  # Only header was exported, meaning no data.
             return "No data exported."
         else:
@@ -42,36 +60,415 @@ def export_data(qradar_nh, export_file):
     except Exception as e:
         return f"Error during export: {e}"
 
-def import_data(qradar_nh, import_file):
+def import_data(qradar_nh, import_file, delta=False, workers=1, error_report=None):
     """Import data from CSV file."""
     try:
-        lines_imported = qradar_nh.import_csv_to_qradar(import_file)
-        if isinstance(lines_imported, int) and lines_imported > 0:
+        lines_imported = qradar_nh.import_csv_to_qradar(import_file, delta=delta, workers=workers, error_report=error_report)
+        if isinstance(lines_imported, bool) or not isinstance(lines_imported, int):
+            return "Data import failed."
+        elif lines_imported == 0 and delta:
+            return "No change, nothing imported."
+        elif lines_imported > 0:
             return f"{lines_imported} lines imported successfully!"
         else:
             return "Data import failed."
     except Exception as e:
         return f"Error during import: {e}"
 
+def validate_data(validate_file, workers=1, error_report=None, report_limit=None):
+    """Validate a CSV file without contacting QRadar."""
+    try:
+        report = qradarzoldaxvalidator.ValidationReport(validate_file)
+        start = time.perf_counter()
+        QRadarNetworkHierarchy.validate_import_file(validate_file, report, workers)
+        elapsed = time.perf_counter() - start
+        report.print_report(qradarzoldaxvalidator.DEFAULT_REPORT_LIMIT if report_limit is None else report_limit)
+        if error_report:
+            report.write_json(error_report)
+            print(f"Validation report written in file : {error_report}")
+        if report.has_errors:
+            return "Validation failed, the file would not be imported."
+        return f"Validation successful in {elapsed:.2f}s, the file can be imported."
+    except Exception as e:
+        return f"Error during validation: {e}"
+
+def backup_data(qradar_nh):
+    """Back up the current network hierarchy to the safety folder."""
+    try:
+        if qradar_nh.backup_current_hierarchy(label="manual"):
+            if qradar_nh.backup_snapshot:
+                return f"{qradar_nh.backup_lines} lines backed up successfully in snapshot : {qradar_nh.backup_snapshot} !"
+            return f"{qradar_nh.backup_lines} lines backed up successfully in file : {qradar_nh.backup_filename} !"
+        return "Backup failed."
+    except Exception as e:
+        return f"Error during backup: {e}"
+
+def restore_data(qradar_nh, snapshot):
+    """Restore a snapshot of the backup store as the network hierarchy."""
+    try:
+        networks_restored = qradar_nh.restore_snapshot(snapshot)
+        if isinstance(networks_restored, bool):
+            return "Restore failed."
+        return f"{networks_restored} networks restored successfully from snapshot {snapshot} !"
+    except Exception as e:
+        return f"Error during restore: {e}"
+
+def list_backups_data(conf, hosts=None):
+    """Print the snapshots of the backup store (of the given hosts only, if any)."""
+    store = qradarzoldaxbackup.BackupStore.from_config(conf, qradarzoldaxlib.logger)
+    snapshots = [s for s in store.snapshots() if not hosts or s.get("host") in hosts]
+    if not snapshots:
+        print(f"No snapshot in {store.directory}")
+        return
+    for line in qradarzoldaxbackup.format_snapshots(snapshots):
+        print(line)
+
+def export_filter_data(args):
+    """ExportFilter of the --domain-id, --group-prefix, --country, --cidr-within and --columns options, None without them."""
+    if not (args.domain_id or args.group_prefix or args.country or args.cidr_within or args.columns):
+        return None
+    return qradarzoldaxfilter.ExportFilter(args.domain_id, args.group_prefix, args.country, args.cidr_within,
+                                           args.columns.split(",") if args.columns else None)
+
+def multi_console_data(consoles, action, args, export_filter=None):
+    """Run an action on several consoles concurrently, with per-console output files and a summary."""
+    start = time.perf_counter()
+    results = qradarzoldaxconsoles.run_consoles(consoles, action, workers=args.parallel,
+                                                export_file=args.export_file or "network_hierarchy.csv",
+                                                page_size=args.page_size, fetch_workers=args.fetch_workers,
+                                                export_filter=export_filter)
+    elapsed = round(time.perf_counter() - start, 3)
+    qradarzoldaxconsoles.print_summary(results, elapsed)
+    if args.summary_file:
+        qradarzoldaxconsoles.write_summary(results, args.summary_file, elapsed)
+
+def lookup_data(lookup_file, lookup_source=None, page_size=None, fetch_workers=None, refresh=False, conf=None):
+    """Look up the network of each IP read from a file or stdin, results as CSV on stdout."""
+    try:
+        if lookup_source:
+            source_key = qradarzoldaxlookup.csv_source_key(lookup_source)
+            entries_factory = lambda: qradarzoldaxlookup.iter_csv_networks(lookup_source)
+            max_age = None
+        else:
+            qradar_nh = QRadarNetworkHierarchy(page_size=page_size, fetch_workers=fetch_workers, conf=conf)
+            source_key = f"qradar:{qradar_nh.config['ip_QRadar']}"
+            entries_factory = qradar_nh.iter_network_hierarchy
+            max_age = float(qradar_nh.config.get('lookup_index_ttl', qradarzoldaxlookup.DEFAULT_INDEX_TTL))
+
+        index, cached = qradarzoldaxlookup.load_or_build(source_key, entries_factory, max_age=max_age, refresh=refresh)
+        if lookup_file == '-':
+            stats = qradarzoldaxlookup.run_lookups(index, sys.stdin, sys.stdout)
+        else:
+            with open(lookup_file, 'r') as input_stream:
+                stats = qradarzoldaxlookup.run_lookups(index, input_stream, sys.stdout)
+        qradarzoldaxlookup.print_stats(stats, index, cached)
+    except Exception as e:
+        print(f"Error during lookup: {e}", file=sys.stderr)
+
+def optimize_data(optimize_source, output_file, page_size=None, fetch_workers=None, workers=1, conf=None):
+    """Find the networks that can be merged or dropped, and write the optimized hierarchy to a CSV file."""
+    try:
+        if optimize_source:
+            report = qradarzoldaxvalidator.ValidationReport(optimize_source)
+            table = QRadarNetworkHierarchy.validate_import_file(optimize_source, report, workers)
+            if report.has_errors:
+                report.print_report()
+                return "Validation failed, fix the file before optimizing it."
+        else:
+            qradar_nh = QRadarNetworkHierarchy(page_size=page_size, fetch_workers=fetch_workers, conf=conf)
+            table = qradar_nh.fetch_network_hierarchy()
+            if not len(table):
+                return "No network to optimize."
+
+        with qradarzoldaxmetrics.phase("consolidate") as timer:
+            result = qradarzoldaxoptimize.optimize_table(table)
+            timer.items = len(table)
+        result.print_summary()
+        difference = qradarzoldaxoptimize.verify_mapping(result)
+        if difference:
+            qradarzoldaxlib.logger.error(f"Optimization aborted, {difference}")
+            return f"Optimization aborted, {difference}"
+
+        with open(output_file, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(qradarzoldaxvalidator.CSV_COLUMNS)
+            writer.writerows(map(QRadarNetworkHierarchy.network_to_csv_row, result.iter_api()))
+        return f"{len(result) + 1} lines written in file : {output_file} ! (including col headers), same IP-to-group mapping"
+    except Exception as e:
+        return f"Error during optimization: {e}"
+
+def tree_data(tree_source, group=None, depth=None, export_file=None, page_size=None, fetch_workers=None,
+              workers=1, conf=None):
+    """Print the group tree of the hierarchy (of QRadar or of a CSV file) with per-subtree statistics, and export a subtree."""
+    try:
+        domains = None
+        if tree_source:
+            report = qradarzoldaxvalidator.ValidationReport(tree_source)
+            table = QRadarNetworkHierarchy.validate_import_file(tree_source, report, workers)
+            if report.has_errors:
+                report.print_report()
+                return "Validation failed, fix the file before building its group tree."
+        else:
+            qradar_nh = QRadarNetworkHierarchy(page_size=page_size, fetch_workers=fetch_workers, conf=conf)
+            table = qradar_nh.fetch_network_hierarchy()
+            if not len(table):
+                return "No network in the hierarchy."
+            domains = qradar_nh.domain_index()
+
+        with qradarzoldaxmetrics.phase("group_tree") as timer:
+            tree = qradarzoldaxgroups.GroupTree.build(table)
+            timer.items = len(table)
+        node = tree.find(group or "")
+        if node is None:
+            return f"No network in group {group}."
+        print("\n".join(tree.format_tree(node, depth, domains)))
+
+        if export_file:
+            with open(export_file, 'w', newline='') as file, qradarzoldaxmetrics.phase("csv.write") as timer:
+                writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(qradarzoldaxvalidator.CSV_COLUMNS)
+                writer.writerows(map(QRadarNetworkHierarchy.network_to_csv_row, tree.iter_subtree(node)))
+                timer.items = node.networks
+            return f"{node.networks + 1} lines written in file : {export_file} ! (including col headers)"
+        return f"{node.networks} networks in {len(tree)} groups."
+    except Exception as e:
+        return f"Error during group tree: {e}"
+
+def query_data(database, export_filter=None, contains=None, sql=None):
+    """Query an exported SQLite database, results as CSV on stdout."""
+    try:
+        start = time.perf_counter()
+        connection = qradarzoldaxsqlite.connect_read_only(database)
+        try:
+            if sql:
+                columns, rows = qradarzoldaxsqlite.run_sql(connection, sql)
+            else:
+                columns, rows = qradarzoldaxsqlite.query_networks(connection, export_filter, contains)
+            writer = csv.writer(sys.stdout, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(columns)
+            count = 0
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        finally:
+            connection.close()
+        print(f"{count} rows in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
+    except Exception as e:
+        print(f"Error during query: {e}", file=sys.stderr)
+
+def serve_data(listen, interval=None, page_size=None, fetch_workers=None, conf=None):
+    """Keep the hierarchy in memory and answer lookup, export and domain requests until interrupted."""
+    # Deferred: http.server is only needed by this action
+    import qradarzoldaxservice
+    try:
+        qradar_nh = QRadarNetworkHierarchy(page_size=page_size, fetch_workers=fetch_workers, conf=conf)
+        qradarzoldaxservice.serve(qradar_nh, listen or qradarzoldaxservice.DEFAULT_LISTEN, interval)
+    except Exception as e:
+        print(f"Error during serve: {e}", file=sys.stderr)
+
+def watch_data(consoles, interval=None, page_size=None, fetch_workers=None):
+    """Poll the hierarchy of the consoles and write the changes as JSON lines on stdout, until interrupted."""
+    try:
+        qradarzoldaxwatch.watch(consoles, interval, page_size, fetch_workers)
+    except Exception as e:
+        print(f"Error during watch: {e}", file=sys.stderr)
+
+def action_name(args):
+    """Name of the action selected on the command line (label of the metrics), None for the help."""
+    for name, selected in (("validate", args.validate_only), ("list-backups", args.list_backups),
+                           ("lookup", args.lookup), ("serve", args.serve is not None), ("watch", args.watch),
+                           ("query", args.query), ("optimize", args.optimize is not None), ("tree", args.tree is not None),
+                           ("export", args.export_file), ("import", args.import_file),
+                           ("backup", args.backup), ("restore", args.restore),
+                           ("check-domain", args.check_domain), ("check-version", args.check_version)):
+        if selected:
+            return name
+    return None
+
+def report_metrics(args, action):
+    """Print the --profile table and write the --metrics-out file."""
+    if args.profile:
+        qradarzoldaxmetrics.print_profile()
+    if args.metrics_out:
+        console = ",".join(args.console) if args.console else qradarzoldaxlib.get_config().get('ip_QRadar', '')
+        try:
+            qradarzoldaxmetrics.write_metrics(args.metrics_out, labels={"action": action or "", "console": console})
+        except OSError as e:
+            qradarzoldaxlib.logger.error(f"Error writing metrics to {args.metrics_out}: {e}")
+            print(f"Error writing metrics to {args.metrics_out}: {e}", file=sys.stderr)
+
 def main():
     """Main function to handle command-line arguments and execute desired actions."""
-    qradar_nh = QRadarNetworkHierarchy()
-
     parser = argparse.ArgumentParser(description="QRadar Network Hierarchy Suite by Pascal Weber (zoldax) / Abakus Sécurité")
-    parser.add_argument('-e', '--export-file', nargs='?', const="network_hierarchy.csv", default=None, metavar="FILENAME", help="Export network hierarchy to a CSV file. If no filename is provided, it will default to 'network_hierarchy.csv'.")
+    parser.add_argument('-e', '--export-file', nargs='?', const="network_hierarchy.csv", default=None, metavar="FILENAME", help="Export network hierarchy to a CSV file, or to an indexed SQLite database if the name ends with .db, .sqlite or .sqlite3. If no filename is provided, it will default to 'network_hierarchy.csv'.")
+    parser.add_argument('--domain-id', type=int, action='append', metavar="ID", help="With -e or --query, keep the networks of this domain only (repeatable)")
+    parser.add_argument('--group-prefix', action='append', metavar="GROUP", help="With -e or --query, keep the networks of this group and its subgroups only, e.g. EMEA keeps EMEA.Paris (repeatable)")
+    parser.add_argument('--country', action='append', metavar="CC", help="With -e or --query, keep the networks of this country code only (repeatable)")
+    parser.add_argument('--cidr-within', action='append', metavar="CIDR", help="With -e or --query, keep the networks inside this IPv4 CIDR only (repeatable)")
+    parser.add_argument('--columns', type=str, default=None, metavar="COLUMNS", help="With -e or --query, comma-separated columns to output (e.g. id,name,cidr); only these fields are requested from QRadar. Not used by SQLite exports, which have every field")
     parser.add_argument('-i', '--import-file', type=str, metavar="IMPORT_FILENAME", help="Import network hierarchy from a CSV file")
     parser.add_argument('--check-domain', action='store_true', help="Fetch and display domain information from QRadar")
     parser.add_argument('--check-version', action='store_true', help="Retrieve and display QRadar current system information")
+    parser.add_argument('--backup', action='store_true', help="Back up the current network hierarchy to the safety folder")
+    parser.add_argument('--restore', type=str, default=None, metavar="SNAPSHOT", help="Replace the network hierarchy with a snapshot of the backup store (snapshot id, unique id prefix, or 'latest' of the console)")
+    parser.add_argument('--list-backups', action='store_true', help="List the snapshots of the backup store")
+    parser.add_argument('--lookup', nargs='?', const='-', default=None, metavar="IP_FILENAME", help="Find the network (group, name, cidr, domain_id, country_code) of each IP read from a file, one per line, or from stdin if no file is given. Results are written as CSV to stdout.")
+    parser.add_argument('--lookup-source', type=str, default=None, metavar="CSV_FILENAME", help="With --lookup, use an exported network hierarchy CSV instead of fetching the hierarchy from QRadar")
+    parser.add_argument('--serve', nargs='?', const='', default=None, metavar="LISTEN", help="Keep the hierarchy and the domains in memory, refreshed in the background, and answer lookup, export and domain requests over HTTP on HOST:PORT or on a Unix socket path (default: 127.0.0.1:8600)")
+    parser.add_argument('--serve-refresh', type=float, default=None, metavar="SECONDS", help="With --serve, seconds between two refreshes (config 'serve_refresh', default 300)")
+    parser.add_argument('--watch', action='store_true', help="Poll the network hierarchy of every console (or of --console) and write the added, removed and modified networks as JSON lines on stdout, until interrupted")
+    parser.add_argument('--watch-interval', type=float, default=None, metavar="SECONDS", help="With --watch, seconds between two polls of a console (config 'watch_interval', default 60)")
+    parser.add_argument('--query', type=str, default=None, metavar="DATABASE", help="Query a SQLite database exported with -e, without contacting QRadar: networks selected by --domain-id, --group-prefix, --country, --cidr-within and --contains, or --sql. Results are written as CSV to stdout.")
+    parser.add_argument('--contains', action='append', metavar="IP", help="With --query, keep the networks containing this IPv4 address, most specific first (repeatable)")
+    parser.add_argument('--sql', type=str, default=None, metavar="STATEMENT", help="With --query, run this SQL statement (read-only) on the networks and metadata tables")
+    parser.add_argument('--optimize', nargs='?', const='', default=None, metavar="CSV_FILENAME", help="Find the networks that can be merged into a supernet or dropped without changing the group, domain and country of any IP, in the hierarchy of QRadar or of a CSV file, and write the optimized hierarchy to a CSV file that -i can import")
+    parser.add_argument('--optimize-out', type=str, default="network_hierarchy_optimized.csv", metavar="FILENAME", help="With --optimize, file of the optimized hierarchy (default: network_hierarchy_optimized.csv)")
+    parser.add_argument('--tree', nargs='?', const='', default=None, metavar="CSV_FILENAME", help="Print the groups of the hierarchy of QRadar or of a CSV file as a tree, with the networks, IPv4 addresses covered, domains and countries of every subtree")
+    parser.add_argument('--tree-group', type=str, default=None, metavar="GROUP", help="With --tree, start the tree at this group, e.g. EMEA.France")
+    parser.add_argument('--tree-depth', type=int, default=None, metavar="N", help="With --tree, levels shown below the starting group (default: all)")
+    parser.add_argument('--tree-export', type=str, default=None, metavar="FILENAME", help="With --tree, write the networks of the --tree-group subtree to a CSV file that -i can import")
+    parser.add_argument('--delta', action='store_true', help="With -i, compare the CSV with the current hierarchy and skip the import when nothing changed")
+    parser.add_argument('--validate-only', type=str, metavar="CSV_FILENAME", help="Validate a network hierarchy CSV file without contacting QRadar")
+    parser.add_argument('--error-report', type=str, default=None, metavar="FILENAME", help="With -i or --validate-only, write every validation issue, and the issues grouped by column and rule with counts and sample rows, to this JSON file")
+    parser.add_argument('--report-limit', type=int, default=None, metavar="N", help="With -i or --validate-only, number of validation issues printed one by one before the summary by column and rule (config 'report_limit', default 50)")
+    parser.add_argument('--workers', type=int, default=1, metavar="N", help="Number of processes validating the CSV file of -i / --validate-only (0: one per CPU). Useful for files of several hundred thousand rows.")
+    parser.add_argument('--page-size', type=int, default=None, metavar="N", help="Fetch the network hierarchy in pages of N networks (Range header). 0 fetches it in a single request.")
+    parser.add_argument('--fetch-workers', type=int, default=None, metavar="N", help="Number of hierarchy pages fetched concurrently when --page-size is used.")
+    parser.add_argument('--no-cache', action='store_true', help="Do not use the on-disk response cache: every read goes to QRadar")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached responses and lookup indexes, and cache the fresh ones")
+    parser.add_argument('--console', action='append', metavar="NAME", help="With a \"consoles\" list in config.txt, work on this console only (name or ip_QRadar, repeatable). By default export, backup, check-domain and check-version run on all consoles.")
+    parser.add_argument('--parallel', type=int, default=None, metavar="N", help="Number of consoles processed concurrently (default: all, up to 8)")
+    parser.add_argument('--profile', action='store_true', help="Print the time spent in each phase (HTTP, decoding, validation, CSV, upload...) and the request counters to stderr at the end")
+    parser.add_argument('--metrics-out', type=str, default=None, metavar="FILENAME", help="Write the timings and counters of the run to this file: Prometheus text format if it ends with .prom (node_exporter textfile collector), JSON otherwise")
+    parser.add_argument('--summary-file', type=str, default=None, metavar="FILENAME", help="With several consoles, also write the run summary to this JSON file")
 
     args = parser.parse_args()
+    qradarzoldaxlib.configure_cache(enabled=not args.no_cache, refresh=args.refresh)
+
+    if args.profile or args.metrics_out:
+        qradarzoldaxmetrics.enable()
+    action = action_name(args)
+    try:
+        # Not named after the action: "validate" and "backup" are also inner phases, summed by name
+        with qradarzoldaxmetrics.phase("run"):
+            run(parser, args)
+    finally:
+        if qradarzoldaxmetrics.enabled():
+            report_metrics(args, action)
+
+def run(parser, args):
+    """Execute the action selected on the command line."""
+    if action_name(args) is None:
+        # Nothing to do with a console: no need to read config.txt
+        parser.print_help()
+        return
+
+    if args.validate_only:
+        print(validate_data(args.validate_only, args.workers, args.error_report, args.report_limit))
+        return
+
+    if args.optimize:
+        # From a CSV file: no console involved
+        print(optimize_data(args.optimize, args.optimize_out, workers=args.workers))
+        return
+
+    if args.tree:
+        # From a CSV file: no console involved
+        print(tree_data(args.tree, args.tree_group, args.tree_depth, args.tree_export, workers=args.workers))
+        return
+
+    if args.list_backups:
+        hosts = None
+        if args.console:
+            try:
+                consoles = qradarzoldaxconsoles.select_consoles(qradarzoldaxconsoles.console_configs(qradarzoldaxlib.get_config()), args.console)
+            except ValueError as e:
+                print(f"Error in console selection: {e}")
+                return
+            hosts = {console["ip_QRadar"] for console in consoles}
+        list_backups_data(qradarzoldaxlib.get_config(), hosts)
+        return
+
+    try:
+        export_filter = export_filter_data(args) if args.export_file or args.query else None
+    except ValueError as e:
+        print(f"Error in export filter: {e}")
+        return
+
+    if args.query:
+        # Offline: the database is the source
+        query_data(args.query, export_filter, args.contains, args.sql)
+        return
+
+    # Consoles to work on: config.txt itself, or entries of its "consoles" list
+    conf = None
+    if ('consoles' in qradarzoldaxlib.get_config() or args.console) and not (args.lookup and args.lookup_source):
+        try:
+            consoles = qradarzoldaxconsoles.select_consoles(qradarzoldaxconsoles.console_configs(qradarzoldaxlib.get_config()), args.console)
+        except ValueError as e:
+            print(f"Error in console selection: {e}")
+            return
+        if args.watch:
+            watch_data(consoles, args.watch_interval, args.page_size, args.fetch_workers)
+            return
+        if len(consoles) > 1:
+            action = ("export" if args.export_file else "backup" if args.backup else
+                      "check-domain" if args.check_domain else "check-version" if args.check_version else None)
+            if action is None:
+                if args.import_file or args.lookup or args.serve is not None or args.restore or args.optimize is not None \
+                        or args.tree is not None:
+                    print("This operation works on one console, select it with --console NAME.")
+                else:
+                    parser.print_help()
+                return
+            multi_console_data(consoles, action, args, export_filter)
+            return
+        conf = consoles[0]
+
+    if args.lookup:
+        lookup_data(args.lookup, args.lookup_source, args.page_size, args.fetch_workers,
+                    refresh=args.refresh or args.no_cache, conf=conf)
+        return
+
+    if args.watch:
+        watch_data(qradarzoldaxconsoles.console_configs(qradarzoldaxlib.get_config()), args.watch_interval,
+                   args.page_size, args.fetch_workers)
+        return
+
+    if args.serve is not None:
+        serve_data(args.serve, args.serve_refresh, args.page_size, args.fetch_workers, conf=conf)
+        return
+
+    if args.optimize is not None:
+        print("Please wait... optimizing data.")
+        print(optimize_data(None, args.optimize_out, args.page_size, args.fetch_workers, conf=conf))
+        return
+
+    if args.tree is not None:
+        print(tree_data(None, args.tree_group, args.tree_depth, args.tree_export, args.page_size, args.fetch_workers,
+                        conf=conf))
+        return
+
+    qradar_nh = QRadarNetworkHierarchy(page_size=args.page_size, fetch_workers=args.fetch_workers, conf=conf)
 
     if args.export_file:
         print("Please wait... exporting data.")
-        print(export_data(qradar_nh, args.export_file))
+        print(export_data(qradar_nh, args.export_file, export_filter))
 
     elif args.import_file:
         print("Please wait... importing data.")
-        print(import_data(qradar_nh, args.import_file))
+        if args.report_limit is not None:
+            qradar_nh.report_limit = args.report_limit
+        print(import_data(qradar_nh, args.import_file, delta=args.delta, workers=args.workers,
+                          error_report=args.error_report))
+
+    elif args.backup:
+        print("Please wait... backing up data.")
+        print(backup_data(qradar_nh))
+
+    elif args.restore:
+        print("Please wait... restoring data.")
+        print(restore_data(qradar_nh, args.restore))
 
     elif args.check_domain:
         try:
@@ -81,7 +478,7 @@ def main():
 
     elif args.check_version:
         try:
-            qradarzoldaxlib.print_qradar_version()
+            qradarzoldaxlib.print_qradar_version(conf)
         except Exception as e:
             print(f"Error checking version: {e}")
 
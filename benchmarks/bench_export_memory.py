@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+   bench_export_memory.py
+
+   Description: Measures the peak memory (RSS) of the Network Hierarchy CSV export
+   for growing hierarchy sizes. The local mock console (mock_qradar.py) streams a
+   synthetic /api/config/network_hierarchy/networks response, and each export runs
+   in its own process so its peak RSS can be reported independently.
+
+   Usage:
+   python3 benchmarks/bench_export_memory.py                      # 10k, 100k, 1M networks
+   python3 benchmarks/bench_export_memory.py --sizes 10000 50000
+   python3 benchmarks/bench_export_memory.py --mode legacy        # json.loads of the full body, for comparison
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+sys.path.insert(0, BENCH_DIR)
+from mock_qradar import MockQRadar
+
+
+def run_child(size: int, port: int, mode: str) -> None:
+    """Export `size` networks from the local server and print a JSON result line."""
+    workdir = tempfile.mkdtemp(prefix="nhsuite-bench-")
+    with open(os.path.join(workdir, "config.txt"), "w") as config_file:
+        json.dump({"ip_QRadar": f"127.0.0.1:{port}", "auth": "benchmark", "verify_ssl": "False"}, config_file)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    import qradarzoldaxlib
+    from qradarzoldaxclass import QRadarNetworkHierarchy
+
+    # Measure the download path, not the response cache
+    qradarzoldaxlib.configure_cache(enabled=False)
+    nh = QRadarNetworkHierarchy()
+    nh.base_url = f"http://127.0.0.1:{port}"
+    output = os.path.join(workdir, "export.csv")
+
+    start = time.perf_counter()
+    if mode == "legacy":
+        # Previous behavior: decode the whole body, then write
+        hierarchy = qradarzoldaxlib.get_transport().request(f"{nh.base_url}/api/config/network_hierarchy/networks").json()
+        nh.iter_network_hierarchy = lambda *args, **kwargs: iter(hierarchy)
+    lines = nh.write_network_hierarchy_to_csv(output)
+    elapsed = time.perf_counter() - start
+
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"mode": mode, "networks": size, "lines": lines, "seconds": round(elapsed, 3),
+                      "networks_per_second": round(size / elapsed) if elapsed else None,
+                      "peak_rss_mib": round(peak_kib / 1024, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of the Network Hierarchy CSV export by hierarchy size")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, metavar="N", help="Hierarchy sizes to export")
+    parser.add_argument('--mode', choices=["stream", "legacy"], default="stream", help="Export pipeline to measure")
+    parser.add_argument('--child', type=int, nargs=2, metavar=("SIZE", "PORT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.mode)
+        return
+
+    with MockQRadar() as mock:
+        print(f"{'networks':>10} {'seconds':>9} {'net/s':>10} {'peak RSS MiB':>13}")
+        for size in args.sizes:
+            mock.reset(size)
+            result = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", args.mode, "--child", str(size), str(mock.server.server_address[1])],
+                                    check=True, stdout=subprocess.PIPE, universal_newlines=True)
+            data = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{data['networks']:>10} {data['seconds']:>9} {data['networks_per_second']:>10} {data['peak_rss_mib']:>13}")
+
+
+if __name__ == "__main__":
+    main()
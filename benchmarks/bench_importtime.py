@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""
+   bench_importtime.py
+
+   Description: Startup benchmark of NHSuite. Each target is run several times in
+   a fresh interpreter with "python -X importtime", from an empty directory (no
+   config.txt), and the median import time of its modules and the median wall
+   time of the process are reported. The run fails if a module that must stay
+   deferred (requests, urllib3) is imported by a target that does not talk to
+   QRadar. Results are written as JSON, and can be compared with a previous run
+   to catch regressions.
+
+   Targets:
+   - qradarzoldaxlib:   import qradarzoldaxlib
+   - qradarzoldaxclass: import qradarzoldaxclass
+   - NHSuite:           import NHSuite
+   - cli-help:          NHSuite.py --help
+
+   Usage:
+   python3 benchmarks/bench_importtime.py
+   python3 benchmarks/bench_importtime.py --runs 20 --output startup.json
+   python3 benchmarks/bench_importtime.py --output new.json --compare startup.json --tolerance 0.2
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# Target -> command line arguments of the interpreter
+TARGETS = {
+    "qradarzoldaxlib": ["-c", "import qradarzoldaxlib"],
+    "qradarzoldaxclass": ["-c", "import qradarzoldaxclass"],
+    "NHSuite": ["-c", "import NHSuite"],
+    "cli-help": [os.path.join(REPO_DIR, "NHSuite.py"), "--help"],
+}
+# Modules only needed to talk to QRadar, imported on the first request
+DEFERRED_MODULES = ("requests", "urllib3")
+# Metrics compared with the baseline (higher is worse)
+COMPARED_METRICS = ("import_ms", "wall_ms")
+
+
+def parse_importtime(stderr: str) -> list:
+    """(module, cumulative import time in microseconds, nesting level) of each line of the -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        fields = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        entries.append((name.strip(), int(fields[1]), (len(name) - len(name.lstrip()) - 1) // 2))
+    return entries
+
+
+def run_once(command: list, workdir: str) -> tuple:
+    """Run the interpreter once: (wall seconds, importtime entries)."""
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime"] + command, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} exited with status {completed.returncode}:\n{completed.stderr[-2000:]}")
+    return elapsed, parse_importtime(completed.stderr)
+
+
+def measure(target: str, runs: int, workdir: str, startup_modules: set) -> dict:
+    """
+    Median import and wall time of a target over `runs` runs (after one warm-up run that writes the .pyc files).
+
+    The import time is the sum of the top-level imports that the interpreter does not make on its own.
+    """
+    run_once(TARGETS[target], workdir)
+    walls, imports, imported = [], [], set()
+    for _ in range(runs):
+        elapsed, entries = run_once(TARGETS[target], workdir)
+        walls.append(elapsed)
+        imports.append(sum(cumulative for name, cumulative, level in entries
+                           if level == 0 and name not in startup_modules))
+        imported.update(name for name, _, _ in entries)
+    return {
+        "target": target,
+        "runs": runs,
+        "import_ms": round(statistics.median(imports) / 1000, 2),
+        "wall_ms": round(statistics.median(walls) * 1000, 2),
+        "modules": len(imported - startup_modules),
+        "deferred_imported": sorted(name for name in imported if name in DEFERRED_MODULES),
+    }
+
+
+def compare(results: list, baseline_file: str, tolerance: float) -> list:
+    """
+    Compare results with a previous results file.
+
+    :return: List of regression messages (metric more than `tolerance` above the baseline).
+    """
+    with open(baseline_file) as file:
+        baseline = {r["target"]: r for r in json.load(file)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["target"])
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if old and new and new > old * (1 + tolerance):
+                regressions.append(f"{result['target']}: {metric} {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NHSuite startup (import time) benchmark")
+    parser.add_argument('--targets', nargs='+', choices=list(TARGETS), default=list(TARGETS), help="Targets to run")
+    parser.add_argument('--runs', type=int, default=10, metavar="N", help="Runs per target, the median is reported")
+    parser.add_argument('--output', metavar="FILENAME", help="Write the results to this JSON file")
+    parser.add_argument('--compare', metavar="FILENAME", help="Previous results file to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before a regression is reported (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nhsuite-importtime-")
+    try:
+        # Python itself, for reference: the startup cost of NHSuite is wall_ms minus interpreter_ms
+        walls, startup_modules = [], set()
+        for _ in range(args.runs):
+            elapsed, entries = run_once(["-c", "pass"], workdir)
+            walls.append(elapsed)
+            startup_modules.update(name for name, _, _ in entries)
+        interpreter = statistics.median(walls) * 1000
+        results = []
+        print(f"{'target':<18} {'import ms':>10} {'wall ms':>9} {'modules':>8}  deferred modules imported")
+        for target in args.targets:
+            result = measure(target, args.runs, workdir, startup_modules)
+            results.append(result)
+            print(f"{target:<18} {result['import_ms']:>10} {result['wall_ms']:>9} {result['modules']:>8}  "
+                  f"{', '.join(result['deferred_imported']) or '-'}")
+        print(f"{'python -c pass':<18} {'':>10} {interpreter:>9.2f}")
+        # Nothing (error.log, cache) may be written by a run without a config.txt
+        stray = sorted(os.listdir(workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    document = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "runs": args.runs,
+            "interpreter_ms": round(interpreter, 2),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    failures = [f"{result['target']} imports {', '.join(result['deferred_imported'])}"
+                for result in results if result["deferred_imported"]]
+    if stray:
+        failures.append(f"files created without a config.txt: {', '.join(stray)}")
+    if args.compare:
+        failures.extend(compare(results, args.compare, args.tolerance))
+    for message in failures:
+        print(f"REGRESSION {message}")
+    if failures:
+        sys.exit(1)
+    if args.compare:
+        print(f"No regression above {args.tolerance * 100:.0f}% compared with {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
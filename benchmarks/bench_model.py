@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+   bench_model.py
+
+   Description: Memory and time of the in-memory representations of a Network
+   Hierarchy: a list of API dicts (what json decoding gives), a list of Network
+   objects (__slots__) and a NetworkTable (columns). For each size, every model
+   runs in its own process: the hierarchy is decoded from a streamed JSON body
+   (as fetched from QRadar) into the model, then read back as API dicts (as for
+   a PUT body) and swept by address range (as for the import checks).
+
+   Usage:
+   python3 benchmarks/bench_model.py                      # 100k and 1M networks
+   python3 benchmarks/bench_model.py --sizes 10000 100000 --output model.json
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_qradar import synthetic_network
+
+MODELS = ["dicts", "networks", "table"]
+DEFAULT_SIZES = [100000, 1000000]
+
+
+def resident_mib() -> float:
+    """Current resident memory of the process (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(model: str, size: int) -> dict:
+    """Build, read back and sweep one model in this process and return its measurements."""
+    sys.path.insert(0, REPO_DIR)
+    import qradarzoldaxlib
+    from qradarzoldaxnetindex import iter_parents, network_range, sorted_ranges
+    from qradarzoldaxnetwork import Network, NetworkTable
+
+    def decoded():
+        # Same path as a streamed fetch: JSON body chunks decoded incrementally
+        body = qradarzoldaxlib.encode_json_array(synthetic_network(index) for index in range(1, size + 1))
+        return qradarzoldaxlib.iter_json_array(body)
+
+    gc.collect()
+    before = resident_mib()
+    start = time.perf_counter()
+    if model == "dicts":
+        hierarchy = list(decoded())
+    elif model == "networks":
+        hierarchy = [Network.from_api(entry) for entry in decoded()]
+    else:
+        hierarchy = NetworkTable.from_api(decoded())
+    build = time.perf_counter() - start
+    retained = resident_mib() - before
+
+    start = time.perf_counter()
+    entries = hierarchy.iter_api() if model == "table" else \
+        (network.to_api() for network in hierarchy) if model == "networks" else iter(hierarchy)
+    for _ in entries:
+        pass
+    read_back = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if model == "table":
+        ranges = sorted_ranges(hierarchy)
+    else:
+        # The CIDR strings are parsed to build the ranges
+        ranges = sorted((start, -end, position) for position, (start, end) in
+                        enumerate(network_range(network["cidr"]) for network in hierarchy))
+        ranges = ((start, -negative_end, position) for start, negative_end, position in ranges)
+    nested = sum(1 for _ in iter_parents(ranges))
+    sweep = time.perf_counter() - start
+
+    return {
+        "model": model,
+        "networks": size,
+        "build_seconds": round(build, 3),
+        "read_back_seconds": round(read_back, 3),
+        "sweep_seconds": round(sweep, 3),
+        "nested": nested,
+        "retained_mib": round(retained, 1),
+        "bytes_per_network": round(retained * 2 ** 20 / size),
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and time of the Network Hierarchy models")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, metavar="N", help="Hierarchy sizes")
+    parser.add_argument('--models', nargs='+', choices=MODELS, default=MODELS, help="Models to measure")
+    parser.add_argument('--output', metavar="FILENAME", help="Write the results to this JSON file")
+    parser.add_argument('--child', nargs=2, metavar=("MODEL", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], int(args.child[1]))))
+        return
+
+    results = []
+    print(f"{'model':<9} {'networks':>9} {'build s':>8} {'read s':>7} {'sweep s':>8} {'retained MiB':>13} {'B/network':>10} {'peak MiB':>9}")
+    for size in args.sizes:
+        for model in args.models:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", model, str(size)],
+                                       check=True, stdout=subprocess.PIPE, universal_newlines=True)
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{model:<9} {size:>9} {result['build_seconds']:>8} {result['read_back_seconds']:>7} "
+                  f"{result['sweep_seconds']:>8} {result['retained_mib']:>13} {result['bytes_per_network']:>10} "
+                  f"{result['peak_rss_mib']:>9}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+"""
+   bench_suite.py
+
+   Description: Throughput, latency and memory benchmarks of NHSuite against the
+   local mock console (benchmarks/mock_qradar.py). Each scenario runs in its own
+   process on a synthetic hierarchy of each requested size, and reports its
+   duration, networks per second, per-request latency and peak RSS. Results are
+   written as JSON, and can be compared with a previous run to catch regressions.
+
+   Scenarios:
+   - export:        streamed export of the hierarchy to CSV (single GET)
+   - export-paged:  export with Range pages fetched concurrently
+   - validate:      import validation of a CSV (schema, duplicates, nesting), with --workers processes
+   - put:           staged_networks PUT of a validated hierarchy (streamed body)
+   - put-gzip:      same PUT with a gzip-encoded body (upload_compression gzip)
+   - backup:        safety backup of the live hierarchy
+   - import:        full import (validation, backup, PUT)
+   - optimize:      CIDR consolidation of a validated CSV, with the mapping check
+   - serve:         single-IP lookups against the resident service (--serve), over a kept-alive connection
+
+   Usage:
+   python3 benchmarks/bench_suite.py                                   # 1k, 10k, 100k networks
+   python3 benchmarks/bench_suite.py --sizes 1000 1000000 --latency 0.02 --output results.json
+   python3 benchmarks/bench_suite.py --output new.json --compare results.json --tolerance 0.2
+   python3 benchmarks/bench_suite.py --scenarios validate --sizes 1000000 --workers 8
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_qradar import MockQRadar, synthetic_network
+
+SCENARIOS = ["export", "export-paged", "validate", "put", "put-gzip", "backup", "import", "optimize", "serve"]
+# Lookups sent by the serve scenario
+SERVE_LOOKUPS = 5000
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Metrics compared with the baseline (higher is worse)
+COMPARED_METRICS = ("seconds", "peak_rss_mib")
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def write_synthetic_csv(filename: str, size: int):
+    """Write a valid import CSV of `size` synthetic networks."""
+    from qradarzoldaxclass import QRadarNetworkHierarchy
+    from qradarzoldaxvalidator import CSV_COLUMNS
+
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(QRadarNetworkHierarchy.network_to_csv_row(synthetic_network(index)) for index in range(1, size + 1))
+
+
+def run_child(scenario: str, size: int, address: str, page_size: int, fetch_workers: int, workers: int = 1) -> dict:
+    """Run one scenario in this process and return its measurements."""
+    workdir = tempfile.mkdtemp(prefix="nhsuite-bench-")
+    with open(os.path.join(workdir, "config.txt"), "w") as config_file:
+        json.dump({"ip_QRadar": address, "auth": "benchmark", "verify_ssl": "False", "safety": "on",
+                   "upload_compression": "gzip" if scenario == "put-gzip" else "off"}, config_file)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    import qradarzoldaxlib
+    import qradarzoldaxvalidator
+    from qradarzoldaxclass import QRadarNetworkHierarchy
+
+    # Measure the network path, not the response cache
+    qradarzoldaxlib.configure_cache(enabled=False)
+    nh = QRadarNetworkHierarchy(page_size=page_size if scenario == "export-paged" else 0, fetch_workers=fetch_workers)
+    nh.base_url = f"http://{address}"
+
+    latencies = []
+    transport = qradarzoldaxlib.get_transport(nh.config)
+    transport.session.hooks["response"].append(lambda response, *args, **kwargs: latencies.append(response.elapsed.total_seconds()))
+
+    result = {}
+    csv_filename = os.path.join(workdir, "import.csv")
+    if scenario in ("validate", "put", "put-gzip", "import", "optimize"):
+        write_synthetic_csv(csv_filename, size)
+
+    start = time.perf_counter()
+    if scenario in ("export", "export-paged"):
+        result["lines"] = nh.write_network_hierarchy_to_csv(os.path.join(workdir, "export.csv"))
+    elif scenario == "validate":
+        report = qradarzoldaxvalidator.ValidationReport(csv_filename)
+        result["networks_valid"] = len(nh.validate_import_file(csv_filename, report, workers))
+        result["issues"] = len(report.issues)
+    elif scenario in ("put", "put-gzip"):
+        networks = nh.validate_import_file(csv_filename, qradarzoldaxvalidator.ValidationReport(csv_filename))
+        start = time.perf_counter()
+        staged = qradarzoldaxlib.put_json_array(f"{nh.base_url}/api/config/network_hierarchy/staged_networks",
+                                                networks.iter_api, conf=nh.config)
+        result["ok"] = staged == len(networks)
+    elif scenario == "backup":
+        result["ok"] = nh.backup_current_hierarchy(label="bench")
+        result["lines"] = nh.backup_lines
+    elif scenario == "import":
+        result["imported"] = nh.import_csv_to_qradar(csv_filename, workers=workers)
+    elif scenario == "optimize":
+        import qradarzoldaxoptimize
+        networks = nh.validate_import_file(csv_filename, qradarzoldaxvalidator.ValidationReport(csv_filename), workers)
+        start = time.perf_counter()
+        optimized = qradarzoldaxoptimize.optimize_table(networks)
+        result["networks_after"] = len(optimized)
+        result["ok"] = qradarzoldaxoptimize.verify_mapping(optimized) is None
+    elif scenario == "serve":
+        import http.client
+        import threading
+        import qradarzoldaxservice
+        service = qradarzoldaxservice.HierarchyService(nh)
+        result["ok"] = service.refresh()
+        server = qradarzoldaxservice.make_server(service, "127.0.0.1:0")
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+        # Latency of the lookups, not of the fetch
+        latencies.clear()
+        start = time.perf_counter()
+        for lookup in range(SERVE_LOOKUPS):
+            sent = time.perf_counter()
+            synthetic = synthetic_network(lookup % size + 1)["cidr"].split("/")[0]
+            connection.request("GET", f"/lookup?ip={synthetic}")
+            connection.getresponse().read()
+            latencies.append(time.perf_counter() - sent)
+        result["lookups"] = SERVE_LOOKUPS
+        server.shutdown()
+    else:
+        raise ValueError(f"Unknown scenario {scenario}")
+    elapsed = time.perf_counter() - start
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    result.update({
+        "scenario": scenario,
+        "networks": size,
+        "seconds": round(elapsed, 3),
+        "networks_per_second": round(size / elapsed) if elapsed else None,
+        "requests": len(latencies),
+        "latency_ms": {"p50": round(percentile(latencies, 0.5) * 1000, 2),
+                       "p95": round(percentile(latencies, 0.95) * 1000, 2),
+                       "max": round(max(latencies, default=0) * 1000, 2)},
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+    return result
+
+
+def run_scenario(scenario: str, size: int, mock: MockQRadar, args) -> dict:
+    """Run a scenario in a child process (so its peak RSS is its own), keeping the fastest of --repeat runs."""
+    best = None
+    for _ in range(args.repeat):
+        # A PUT replaces the served hierarchy: start every run from the synthetic one
+        mock.reset(size)
+        command = [sys.executable, os.path.abspath(__file__), "--child", scenario, str(size), mock.address,
+                   "--page-size", str(args.page_size), "--fetch-workers", str(args.fetch_workers),
+                   "--workers", str(args.workers)]
+        completed = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        # Request bodies as sent on the wire (compressed or not)
+        result["bytes_sent"] = mock.bytes_received
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def compare(results: list, baseline_file: str, tolerance: float) -> list:
+    """
+    Compare results with a previous results file.
+
+    :return: List of regression messages (metric more than `tolerance` above the baseline).
+    """
+    with open(baseline_file) as file:
+        baseline = {(r["scenario"], r["networks"]): r for r in json.load(file)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["scenario"], result["networks"]))
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), result.get(metric)
+            if old and new and new > old * (1 + tolerance):
+                regressions.append(f"{result['scenario']} {result['networks']}: {metric} {old} -> {new} "
+                                   f"(+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NHSuite benchmarks against a local mock QRadar console")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, metavar="N", help="Hierarchy sizes")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS, help="Scenarios to run")
+    parser.add_argument('--latency', type=float, default=0.0, metavar="SECONDS", help="Latency added by the mock to every request")
+    parser.add_argument('--page-size', type=int, default=1000, metavar="N", help="Page size of the export-paged scenario")
+    parser.add_argument('--fetch-workers', type=int, default=4, metavar="N", help="Concurrent pages of the export-paged scenario")
+    parser.add_argument('--workers', type=int, default=1, metavar="N", help="Validation processes of the validate and import scenarios (0: one per CPU)")
+    parser.add_argument('--repeat', type=int, default=1, metavar="N", help="Runs per scenario, the fastest is kept")
+    parser.add_argument('--output', metavar="FILENAME", help="Write the results to this JSON file")
+    parser.add_argument('--compare', metavar="FILENAME", help="Previous results file to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown / memory growth before a regression is reported (0.2 = 20%%)")
+    parser.add_argument('--child', nargs=3, metavar=("SCENARIO", "SIZE", "ADDRESS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], int(args.child[1]), args.child[2], args.page_size, args.fetch_workers,
+                                   args.workers)))
+        return
+
+    results = []
+    print(f"{'scenario':<13} {'networks':>9} {'seconds':>9} {'net/s':>10} {'requests':>9} {'p50 ms':>8} {'p95 ms':>8} {'peak MiB':>9}")
+    with MockQRadar(latency=args.latency) as mock:
+        for size in args.sizes:
+            for scenario in args.scenarios:
+                result = run_scenario(scenario, size, mock, args)
+                results.append(result)
+                latency = result["latency_ms"]
+                print(f"{scenario:<13} {size:>9} {result['seconds']:>9} {result['networks_per_second'] or 0:>10} "
+                      f"{result['requests']:>9} {latency['p50']:>8} {latency['p95']:>8} {result['peak_rss_mib']:>9}")
+
+    document = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": args.latency,
+            "page_size": args.page_size,
+            "fetch_workers": args.fetch_workers,
+            "workers": args.workers,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression above {args.tolerance * 100:.0f}% compared with {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
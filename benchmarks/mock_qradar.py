@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+"""
+   mock_qradar.py
+
+   Description: Local stand-in for the QRadar API endpoints used by NHSuite, for
+   benchmarks and offline tests. It serves a synthetic Network Hierarchy of any
+   size (generated on the fly, so 1M networks cost no server memory), supports
+   the Range header and the filter and fields parameters on the networks
+   endpoint, accepts staged_networks PUTs, and answers the domains and
+   system/about endpoints, with a configurable latency.
+
+   Usage:
+   python3 benchmarks/mock_qradar.py --networks 100000                    # http://127.0.0.1:8443
+   python3 benchmarks/mock_qradar.py --networks 1000000 --latency 0.05 \\
+       --certfile cert.pem --keyfile key.pem                             # HTTPS, usable by NHSuite.py
+
+   A self-signed certificate for --certfile/--keyfile can be created with:
+   openssl req -x509 -newkey rsa:2048 -nodes -days 30 -subj /CN=127.0.0.1 -keyout key.pem -out cert.pem
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import argparse
+import gzip
+import json
+import re
+import ssl
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlsplit
+
+NETWORKS_PATH = "/api/config/network_hierarchy/networks"
+STAGED_PATH = "/api/config/network_hierarchy/staged_networks"
+DOMAINS_PATH = "/api/config/domain_management/domains"
+ABOUT_PATH = "/api/system/about"
+
+RANGE_PATTERN = re.compile(r'^items=(\d+)-(\d+)$')
+# Tokens of the filter subset understood by the mock: comparisons, in, LIKE, and, or, parentheses
+FILTER_KEYWORDS = ("and", "or", "in", "like")
+FILTER_TOKEN = re.compile(r'\s*(?:(?P<string>"[^"]*")|(?P<number>-?\d+)|(?P<word>[A-Za-z_]+)|(?P<symbol>!=|[=(),]))')
+# Networks serialized per write of a streamed response
+STREAM_BATCH = 1000
+# Domains used by the synthetic networks, all served by the domains endpoint by default
+SYNTHETIC_DOMAINS = 8
+
+SYSTEM_INFO = {
+    "release_name": "7.5.0 UpdatePackage 6",
+    "build_version": "2021.6.6.20230519190832",
+    "fips_enabled": False,
+    "external_version": "7.5.0",
+}
+
+
+def synthetic_network(index: int) -> dict:
+    """Build one realistic network entry of the synthetic hierarchy (unique /32 per index)."""
+    return {
+        "id": index,
+        "group": f"EMEA.Site{index % 200}",
+        "name": f"Net_{index}",
+        "cidr": f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{(index & 255)}/32",
+        "description": f"Synthetic network {index}",
+        "domain_id": index % SYNTHETIC_DOMAINS,
+        "location": {"type": "Point", "coordinates": [2.3522, 48.8566]},
+        "country_code": "FR",
+    }
+
+
+def _like(pattern: str) -> Callable[[str], bool]:
+    regex = re.compile("^" + "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern) + "$", re.S)
+    return lambda value: isinstance(value, str) and regex.match(value) is not None
+
+
+def parse_filter(expression: str) -> Callable[[dict], bool]:
+    """
+    Compile the subset of the QRadar filter syntax used by NHSuite into a predicate.
+
+    :param expression: e.g. 'domain_id in (1, 2) and (group = "EMEA" or group LIKE "EMEA.%")'.
+    :raises ValueError: If the expression is outside the subset.
+    """
+    tokens, position = [], 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = FILTER_TOKEN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError(f"unexpected character at {position}")
+        kind, value = match.lastgroup, match.group(match.lastgroup)
+        if kind in ("string", "number"):
+            value = json.loads(value)
+        elif kind == "word" and value.lower() in FILTER_KEYWORDS:
+            value = value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    tokens.append(("end", None))
+    index = [0]
+
+    def take(expected=None):
+        kind, value = tokens[index[0]]
+        if expected is not None and value != expected:
+            raise ValueError(f"expected {expected!r}, got {value!r}")
+        index[0] += 1
+        return kind, value
+
+    def literal():
+        kind, value = take()
+        if kind not in ("string", "number"):
+            raise ValueError(f"expected a value, got {value!r}")
+        return value
+
+    def comparison():
+        if tokens[index[0]][1] == "(":
+            take("(")
+            predicate = disjunction()
+            take(")")
+            return predicate
+        kind, field = take()
+        if kind != "word":
+            raise ValueError(f"expected a field, got {field!r}")
+        _, operator = take()
+        if operator in ("=", "!="):
+            value = literal()
+            return (lambda n: n.get(field) == value) if operator == "=" else (lambda n: n.get(field) != value)
+        if operator == "in":
+            take("(")
+            values = [literal()]
+            while tokens[index[0]][1] == ",":
+                take(",")
+                values.append(literal())
+            take(")")
+            return lambda n: n.get(field) in values
+        if operator == "like":
+            match = _like(literal())
+            return lambda n: match(n.get(field))
+        raise ValueError(f"unsupported operator {operator!r}")
+
+    def conjunction():
+        predicates = [comparison()]
+        while tokens[index[0]][1] == "and":
+            take("and")
+            predicates.append(comparison())
+        return lambda n: all(p(n) for p in predicates)
+
+    def disjunction():
+        predicates = [conjunction()]
+        while tokens[index[0]][1] == "or":
+            take("or")
+            predicates.append(conjunction())
+        return lambda n: any(p(n) for p in predicates)
+
+    predicate = disjunction()
+    if tokens[index[0]][0] != "end":
+        raise ValueError(f"unexpected {tokens[index[0]][1]!r}")
+    return predicate
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # A client aborting an upload resets the connection, the mock has nothing to report
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockQRadarHandler(BaseHTTPRequestHandler):
+    """Request handler; the state lives in the MockQRadar of the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self) -> "MockQRadar":
+        return self.server.mock
+
+    def _send_json(self, status: int, body, extra_headers: Optional[dict] = None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _authorized(self) -> bool:
+        if self.headers.get("SEC"):
+            return True
+        self._send_json(401, {"http_response": {"code": 401, "message": "Unauthorized"}})
+        return False
+
+    def do_GET(self):
+        mock = self.mock
+        path = self.path.split("?", 1)[0]
+        mock.count(path)
+        if not self._authorized():
+            return
+        if mock.latency:
+            time.sleep(mock.latency)
+
+        if path == NETWORKS_PATH:
+            return self._get_networks()
+        if path == DOMAINS_PATH:
+            return self._send_json(200, [{"id": i, "name": "" if i == 0 else f"Domain{i}", "description": f"Domain {i}"}
+                                         for i in range(mock.domains)])
+        if path == ABOUT_PATH:
+            return self._send_json(200, SYSTEM_INFO)
+        self._send_json(404, {"http_response": {"code": 404, "message": "Not Found"}})
+
+    def _get_networks(self):
+        mock = self.mock
+        query = parse_qs(urlsplit(self.path).query)
+        expression, fields = query.get("filter", [None])[0], query.get("fields", [None])[0]
+        if (expression or fields) and not mock.filters:
+            return self._send_json(422, {"http_response": {"code": 422, "message": "Invalid filter or fields"}})
+        try:
+            predicate = parse_filter(expression) if expression else None
+        except ValueError as e:
+            return self._send_json(422, {"http_response": {"code": 422, "message": f"Invalid filter: {e}"}})
+        fields = fields.split(",") if fields else None
+
+        def select(networks: list) -> list:
+            networks = list(filter(predicate, networks)) if predicate else networks
+            return [{field: n[field] for field in fields if field in n} for n in networks] if fields else networks
+
+        if predicate:
+            # The Range of a filtered list applies to the matching networks
+            matching = select(mock.networks_slice(0, mock.total()))
+            networks_slice, total = lambda start, stop: matching[start:stop], len(matching)
+        else:
+            networks_slice, total = lambda start, stop: select(mock.networks_slice(start, stop)), mock.total()
+        range_header = self.headers.get("Range")
+        if range_header:
+            match = RANGE_PATTERN.match(range_header.strip())
+            if not match:
+                return self._send_json(416, {"http_response": {"code": 416, "message": "Invalid Range"}})
+            start, end = int(match.group(1)), min(int(match.group(2)), total - 1)
+            page = networks_slice(start, end + 1)
+            last = start + len(page) - 1 if page else start
+            return self._send_json(200, page, {"Content-Range": f"items {start}-{last}/{total}"})
+
+        # Whole hierarchy: streamed with chunked encoding, generated batch by batch
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._write_chunk(b"[")
+        written = False
+        for start in range(0, total, STREAM_BATCH):
+            batch = ",".join(map(json.dumps, networks_slice(start, min(start + STREAM_BATCH, total))))
+            if batch:
+                self._write_chunk(((", " if written else "") + batch).encode('utf-8'))
+                written = True
+        self._write_chunk(b"]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _read_body(self) -> bytes:
+        length = self.headers.get("Content-Length")
+        if length is not None:
+            return self.rfile.read(int(length))
+        body = bytearray()
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                raise ConnectionResetError("client closed the connection in the middle of the body")
+            size = int(line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return bytes(body)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def do_PUT(self):
+        mock = self.mock
+        path = self.path.split("?", 1)[0]
+        mock.count(path)
+        try:
+            body = self._read_body()
+        except (ConnectionError, ValueError):
+            # Aborted upload: like QRadar, nothing is staged
+            self.close_connection = True
+            return
+        mock.bytes_received += len(body)
+        if not self._authorized():
+            return
+        if path != STAGED_PATH:
+            return self._send_json(404, {"http_response": {"code": 404, "message": "Not Found"}})
+        encoding = (self.headers.get("Content-Encoding") or "identity").lower()
+        if encoding != "identity" and not mock.compressed_puts:
+            return self._send_json(415, {"http_response": {"code": 415, "message": f"Unsupported encoding {encoding}"}})
+        try:
+            if encoding == "gzip":
+                body = gzip.decompress(body)
+            elif encoding == "deflate":
+                body = zlib.decompress(body)
+            elif encoding != "identity":
+                return self._send_json(415, {"http_response": {"code": 415, "message": f"Unsupported encoding {encoding}"}})
+        except (OSError, zlib.error):
+            return self._send_json(400, {"http_response": {"code": 400, "message": "Invalid compressed body"}})
+        if mock.latency:
+            time.sleep(mock.latency)
+        if mock.store_puts:
+            mock.store(body)
+        # QRadar answers with the staged networks
+        self._send_json(200, body)
+
+
+class MockQRadar:
+    """
+    Synthetic QRadar console served from a background thread.
+
+    Attributes:
+    -----------
+    size : int
+        Number of synthetic networks served until a PUT replaces them.
+    latency : float
+        Seconds added to every request.
+    domains : int
+        Number of domains returned by the domains endpoint.
+    store_puts : bool
+        Serve the last PUT body on later GETs (otherwise the synthetic hierarchy stays).
+    compressed_puts : bool
+        Accept gzip/deflate-encoded PUT bodies (otherwise answer 415).
+    filters : bool
+        Apply the filter and fields parameters of the networks endpoint (otherwise answer 422).
+    requests : Counter
+        Requests received per path.
+    bytes_received : int
+        Total size of the received request bodies (as sent, before decompression).
+    """
+
+    def __init__(self, size: int = 1000, latency: float = 0.0, domains: int = SYNTHETIC_DOMAINS, store_puts: bool = True,
+                 host: str = "127.0.0.1", port: int = 0, certfile: Optional[str] = None, keyfile: Optional[str] = None,
+                 compressed_puts: bool = True, filters: bool = True):
+        self.size = size
+        self.latency = latency
+        self.domains = domains
+        self.store_puts = store_puts
+        self.compressed_puts = compressed_puts
+        self.filters = filters
+        self.requests = Counter()
+        self.bytes_received = 0
+        self._stored = None
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), MockQRadarHandler)
+        self.server.mock = self
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            self.scheme = "https"
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        """host:port of the server, as used for ip_QRadar."""
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    @property
+    def url(self) -> str:
+        return f"{self.scheme}://{self.address}"
+
+    def count(self, path: str):
+        with self._lock:
+            self.requests[path] += 1
+
+    def store(self, body: bytes):
+        """Keep a PUT body as the hierarchy served by later GETs."""
+        networks = json.loads(body)
+        with self._lock:
+            self._stored = networks
+
+    def total(self) -> int:
+        stored = self._stored
+        return self.size if stored is None else len(stored)
+
+    def networks_slice(self, start: int, stop: int) -> list:
+        """Networks [start, stop) of the current hierarchy."""
+        stored = self._stored
+        if stored is not None:
+            return stored[start:stop]
+        return [synthetic_network(index) for index in range(start + 1, min(stop, self.size) + 1)]
+
+    def reset(self, size: Optional[int] = None):
+        """Go back to a synthetic hierarchy (of a new size) and clear the counters."""
+        with self._lock:
+            self._stored = None
+            self.size = self.size if size is None else size
+            self.requests.clear()
+            self.bytes_received = 0
+
+    def start(self) -> "MockQRadar":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "MockQRadar":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the QRadar Network Hierarchy API")
+    parser.add_argument('--host', default="127.0.0.1", help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8443, help="Port to listen on")
+    parser.add_argument('--networks', type=int, default=1000, metavar="N", help="Size of the synthetic hierarchy")
+    parser.add_argument('--latency', type=float, default=0.0, metavar="SECONDS", help="Delay added to every request")
+    parser.add_argument('--domains', type=int, default=SYNTHETIC_DOMAINS, metavar="N", help="Number of domains")
+    parser.add_argument('--no-store', action='store_true', help="Do not serve the PUT hierarchy on later GETs")
+    parser.add_argument('--no-compressed-puts', action='store_true', help="Reject gzip/deflate-encoded PUT bodies with 415")
+    parser.add_argument('--no-filters', action='store_true', help="Reject the filter and fields parameters with 422")
+    parser.add_argument('--certfile', help="Certificate (PEM) to serve HTTPS")
+    parser.add_argument('--keyfile', help="Private key (PEM) of the certificate")
+    args = parser.parse_args()
+
+    mock = MockQRadar(args.networks, args.latency, args.domains, not args.no_store,
+                      args.host, args.port, args.certfile, args.keyfile, not args.no_compressed_puts,
+                      not args.no_filters)
+    print(f"Mock QRadar serving {args.networks} networks on {mock.url} (Ctrl+C to stop)")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
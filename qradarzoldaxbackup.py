@@ -0,0 +1,483 @@
+"""
+   qradarzoldaxbackup.py
+
+   Description: Compressed, content-addressed store of Network Hierarchy backups.
+   Each backup (snapshot) is the export CSV of the hierarchy, compressed with gzip
+   (or zstd when the zstandard module is installed) and stored under the SHA-256
+   of its content, so an unchanged hierarchy is never stored twice. Optionally a
+   snapshot is stored as a delta against the previous full snapshot of the same
+   console. Snapshots are listed in a manifest, pruned by count and age, and can
+   be streamed back row by row (e.g. straight into a staged_networks PUT).
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock is used
+    fcntl = None
+
+from qradarzoldaxvalidator import CSV_COLUMNS
+
+DEFAULT_BACKUP_DIR = "safety"
+MANIFEST_FILENAME = "snapshots.jsonl"
+OBJECTS_DIRNAME = "objects"
+LOCK_FILENAME = ".lock"
+
+COMPRESSIONS = ("gzip", "zstd")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# A delta is kept only if it is smaller than this fraction of the full snapshot
+DELTA_MAX_RATIO = 0.5
+
+# Temporary files older than this are leftovers of interrupted backups
+STALE_TMP_SECONDS = 86400
+
+_UNSAFE_ID_CHARS = re.compile(r'[^A-Za-z0-9._-]+')
+_lock = threading.Lock()
+
+
+class BackupError(Exception):
+    """Raised when a snapshot cannot be found, read or verified."""
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _open_write(path: str, compression: str):
+    """Binary file object compressing what is written to `path`."""
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb'))
+    return gzip.open(path, 'wb', compresslevel=GZIP_LEVEL)
+
+
+def _open_read(path: str):
+    """Binary file object decompressing `path` (format taken from its extension)."""
+    if path.endswith(".zst"):
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise BackupError(f"{path} is zstd-compressed, install the zstandard module to read it")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return gzip.open(path, 'rb')
+
+
+class _HashingSink:
+    """Text sink for csv.writer: encodes, hashes and writes to a binary file."""
+
+    def __init__(self, file):
+        self.file = file
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        self.digest.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+
+class BackupStore:
+    """
+    Snapshots of Network Hierarchies, stored compressed and deduplicated.
+
+    Layout of the store directory:
+    - objects/<sha256>.csv.gz|.csv.zst: full snapshot (export CSV)
+    - objects/<sha256>.delta.gz|.delta.zst: snapshot stored as copy / literal
+      operations over the records of a full snapshot (its base)
+    - snapshots.jsonl: one JSON record per snapshot (id, host, label, created,
+      digest, object, base, networks, size)
+
+    Attributes:
+    -----------
+    directory : str
+        Store directory (the former safety folder).
+    compression : str
+        "gzip" or "zstd" for new objects.
+    delta : bool
+        Store new snapshots as deltas against the latest full snapshot of the console when smaller.
+    keep : int
+        Snapshots kept per console, 0 for no limit.
+    keep_days : float
+        Age in days after which snapshots are removed, 0 for no limit.
+    """
+
+    def __init__(self, directory: str = DEFAULT_BACKUP_DIR, compression: str = "gzip", delta: bool = False,
+                 keep: int = 0, keep_days: float = 0):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"backup_compression must be one of {', '.join(COMPRESSIONS)}")
+        self.directory = directory
+        self.compression = compression
+        self.delta = delta
+        self.keep = keep
+        self.keep_days = keep_days
+        self.objects_dir = os.path.join(directory, OBJECTS_DIRNAME)
+        self.manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+
+    @classmethod
+    def from_config(cls, conf: dict, logger=None) -> "BackupStore":
+        """
+        Create the store from the options of config.txt: backup_dir, backup_compression,
+        backup_delta ("on"/"off"), backup_keep (count) and backup_keep_days.
+        zstd falls back to gzip (logged) when the zstandard module is missing.
+        """
+        compression = str(conf.get('backup_compression', 'gzip')).lower()
+        if compression == "zstd" and _zstandard() is None:
+            if logger is not None:
+                logger.error("backup_compression is zstd but the zstandard module is not installed, using gzip")
+            compression = "gzip"
+        return cls(conf.get('backup_dir', DEFAULT_BACKUP_DIR), compression,
+                   str(conf.get('backup_delta', 'off')).lower() == "on",
+                   int(conf.get('backup_keep', 0)), float(conf.get('backup_keep_days', 0)))
+
+    # Manifest
+
+    @contextmanager
+    def _locked(self):
+        """Serialize manifest and object changes between threads and processes."""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with _lock:
+            with open(os.path.join(self.directory, LOCK_FILENAME), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def snapshots(self, host: Optional[str] = None) -> List[dict]:
+        """Snapshots of the store (of one console if `host` is given), oldest first."""
+        records = []
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as manifest:
+                for line in manifest:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # line cut by a crash
+                    if host is None or record.get("host") == host:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _rewrite_manifest(self, records: List[dict]):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".manifest-")
+        with os.fdopen(fd, 'w', encoding='utf-8') as manifest:
+            for record in records:
+                manifest.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, self.manifest_path)
+
+    def resolve(self, name: str, host: Optional[str] = None) -> dict:
+        """
+        Find a snapshot by id, unique id prefix, or "latest" (of `host` if given).
+
+        :raises BackupError: If no snapshot or several snapshots match.
+        """
+        records = self.snapshots()
+        if name == "latest":
+            candidates = [r for r in records if host is None or r.get("host") == host]
+            if not candidates:
+                raise BackupError(f"No snapshot{' of ' + host if host else ''} in {self.directory}")
+            return candidates[-1]
+        exact = [r for r in records if r["id"] == name]
+        if exact:
+            return exact[-1]
+        matches = [r for r in records if r["id"].startswith(name)]
+        if len(matches) == 1:
+            return matches[0]
+        if not matches:
+            raise BackupError(f"No snapshot {name} in {self.directory} (see --list-backups)")
+        raise BackupError(f"Snapshot name {name} is ambiguous: {', '.join(r['id'] for r in matches[:5])}")
+
+    # Objects
+
+    def _object_path(self, digest: str, kind: str, compression: Optional[str] = None) -> str:
+        extension = ".zst" if (compression or self.compression) == "zstd" else ".gz"
+        return os.path.join(self.objects_dir, f"{digest}.{kind}{extension}")
+
+    def _find_object(self, digest: str) -> Optional[str]:
+        for kind in ("csv", "delta"):
+            for compression in COMPRESSIONS:
+                path = self._object_path(digest, kind, compression)
+                if os.path.exists(path):
+                    return path
+        return None
+
+    def _iter_object_records(self, path: str) -> Iterator[list]:
+        with _open_read(path) as raw:
+            yield from csv.reader(io.TextIOWrapper(raw, encoding='utf-8', newline=''))
+
+    def _iter_delta_ops(self, path: str) -> Iterator[list]:
+        with _open_read(path) as raw:
+            for line in io.TextIOWrapper(raw, encoding='utf-8'):
+                yield json.loads(line)
+
+    def save(self, host: str, label: str, rows: Iterable[tuple]) -> dict:
+        """
+        Store a snapshot of a hierarchy.
+
+        The CSV is compressed and hashed while the rows are produced, so memory use does
+        not depend on the size of the hierarchy (except when building a delta, which
+        indexes the records of the base snapshot).
+
+        :param host: Console the hierarchy comes from (ip_QRadar).
+        :param label: Reason of the snapshot (e.g. "before-import").
+        :param rows: CSV rows in CSV_COLUMNS order, without header.
+        :return: Manifest record of the snapshot, with "deduplicated" set if its content was already stored.
+        """
+        os.makedirs(self.objects_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir, prefix=".tmp-")
+        os.close(fd)
+        try:
+            networks = 0
+            with _open_write(tmp_path, self.compression) as raw:
+                sink = _HashingSink(raw)
+                writer = csv.writer(sink)
+                writer.writerow(CSV_COLUMNS)
+                for row in rows:
+                    writer.writerow(row)
+                    networks += 1
+            digest = sink.digest.hexdigest()
+
+            with self._locked():
+                path = self._find_object(digest)
+                deduplicated = path is not None
+                base = None
+                if deduplicated:
+                    base = self._base_of(digest)
+                else:
+                    path = self._object_path(digest, "csv")
+                    base_record = self._delta_base(host) if self.delta else None
+                    if base_record is not None:
+                        delta_path = self._write_delta(tmp_path, base_record)
+                        if os.path.getsize(delta_path) < DELTA_MAX_RATIO * os.path.getsize(tmp_path):
+                            os.unlink(tmp_path)
+                            tmp_path, path, base = delta_path, self._object_path(digest, "delta"), base_record["digest"]
+                        else:
+                            os.unlink(delta_path)
+                    os.replace(tmp_path, path)
+
+                timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+                record = {
+                    "id": f"{timestamp}-{_UNSAFE_ID_CHARS.sub('_', host)}-{label}",
+                    "host": host,
+                    "label": label,
+                    "created": time.time(),
+                    "digest": digest,
+                    "object": os.path.basename(path),
+                    "base": base,
+                    "networks": networks,
+                    "csv_bytes": sink.size,
+                    "size": os.path.getsize(path),
+                }
+                records = self.snapshots()
+                if any(r["id"] == record["id"] for r in records):
+                    record["id"] += f"-{digest[:8]}"
+                with open(self.manifest_path, 'a', encoding='utf-8') as manifest:
+                    manifest.write(json.dumps(record) + "\n")
+                self._prune(host)
+                self.remove_stale_temporary_files()
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        record["deduplicated"] = deduplicated
+        return record
+
+    def _base_of(self, digest: str) -> Optional[str]:
+        for record in reversed(self.snapshots()):
+            if record["digest"] == digest:
+                return record.get("base")
+        return None
+
+    def _delta_base(self, host: str) -> Optional[dict]:
+        """Latest full (non-delta) snapshot of the console, base of new deltas."""
+        for record in reversed(self.snapshots(host)):
+            if not record.get("base") and os.path.exists(os.path.join(self.objects_dir, record["object"])):
+                return record
+        return None
+
+    def _write_delta(self, new_path: str, base_record: dict) -> str:
+        """
+        Encode the snapshot at new_path as operations over the records of the base snapshot:
+        ["C", start, count] copies base records, ["R", record] adds a record.
+        """
+        index = {}
+        for position, record in enumerate(self._iter_object_records(os.path.join(self.objects_dir, base_record["object"]))):
+            index.setdefault(tuple(record), position)
+
+        fd, delta_path = tempfile.mkstemp(dir=self.objects_dir, prefix=".tmp-")
+        os.close(fd)
+        with _open_write(delta_path, self.compression) as raw:
+            out = io.TextIOWrapper(raw, encoding='utf-8')
+            run_start = run_count = None
+
+            def flush():
+                if run_count:
+                    out.write(json.dumps(["C", run_start, run_count]) + "\n")
+
+            for record in self._iter_object_records(new_path):
+                position = index.get(tuple(record))
+                if position is not None and run_count and position == run_start + run_count:
+                    run_count += 1
+                    continue
+                flush()
+                if position is None:
+                    run_start = run_count = None
+                    out.write(json.dumps(["R", record]) + "\n")
+                else:
+                    run_start, run_count = position, 1
+            flush()
+            out.flush()
+            out.detach()
+        return delta_path
+
+    def iter_records(self, record: dict) -> Iterator[list]:
+        """
+        Stream the CSV records (header first) of a snapshot, rebuilding deltas.
+
+        The content is hashed while it is read; a mismatch with the snapshot digest
+        raises BackupError after the last record, before the stream ends.
+        """
+        path = os.path.join(self.objects_dir, record["object"])
+        if not os.path.exists(path):
+            raise BackupError(f"Object {record['object']} of snapshot {record['id']} is missing")
+        sink = _HashingSink(io.BytesIO())
+        writer = csv.writer(sink)
+
+        if record.get("base"):
+            base_path = self._find_object(record["base"])
+            if base_path is None:
+                raise BackupError(f"Base object {record['base']} of snapshot {record['id']} is missing")
+            source = self._apply_delta(path, base_path)
+        else:
+            source = self._iter_object_records(path)
+
+        for csv_record in source:
+            sink.file.seek(0)
+            sink.file.truncate()
+            writer.writerow(csv_record)
+            yield csv_record
+        if sink.digest.hexdigest() != record["digest"]:
+            raise BackupError(f"Snapshot {record['id']} is corrupted (checksum mismatch)")
+
+    def _apply_delta(self, path: str, base_path: str) -> Iterator[list]:
+        """
+        Rebuild a delta snapshot while streaming the records of its base.
+
+        Copies usually follow the order of the base, which is then read once and never
+        held in memory. A first pass over the operations finds the base records copied
+        after the stream went past them (reordered or repeated records): only these are
+        kept when they are read.
+        """
+        retained, reached = set(), 0
+        for op in self._iter_delta_ops(path):
+            if op[0] == "C":
+                start, end = op[1], op[1] + op[2]
+                if start < reached:
+                    retained.update(range(start, min(end, reached)))
+                reached = max(reached, end)
+
+        base = self._iter_object_records(base_path)
+        kept, cursor, record = {}, 0, None
+        for op in self._iter_delta_ops(path):
+            if op[0] != "C":
+                yield op[1]
+                continue
+            for position in range(op[1], op[1] + op[2]):
+                if position < cursor:
+                    yield kept[position]
+                    continue
+                while cursor <= position:
+                    record = next(base, None)
+                    if record is None:
+                        raise BackupError(f"Base object {os.path.basename(base_path)} is shorter than its delta")
+                    if cursor in retained:
+                        kept[cursor] = record
+                    cursor += 1
+                yield record
+
+    # Retention
+
+    def _prune(self, host: str):
+        """Apply the retention of one console, then delete the objects no snapshot uses (lock held)."""
+        if not self.keep and not self.keep_days:
+            return
+        records = self.snapshots()
+        mine = [r for r in records if r.get("host") == host]
+        drop = set()
+        if self.keep and len(mine) > self.keep:
+            drop.update(r["id"] for r in mine[:-self.keep])
+        if self.keep_days:
+            limit = time.time() - self.keep_days * 86400
+            # The latest snapshot of a console is always kept
+            drop.update(r["id"] for r in mine[:-1] if r.get("created", 0) < limit)
+        if not drop:
+            return
+        kept = [r for r in records if r["id"] not in drop]
+        self._rewrite_manifest(kept)
+        self._collect_garbage(kept)
+
+    def _collect_garbage(self, records: List[dict]):
+        used = {r["object"] for r in records}
+        bases = {r["base"] for r in records if r.get("base")}
+        for name in os.listdir(self.objects_dir):
+            if name in used or name.startswith(".") or name.split(".", 1)[0] in bases:
+                continue
+            os.unlink(os.path.join(self.objects_dir, name))
+
+    def remove_stale_temporary_files(self, max_age: float = STALE_TMP_SECONDS):
+        """Delete temporary files left by interrupted backups (called by save)."""
+        now = time.time()
+        for name in os.listdir(self.objects_dir) if os.path.isdir(self.objects_dir) else ():
+            if not name.startswith(".tmp-"):
+                continue
+            path = os.path.join(self.objects_dir, name)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.unlink(path)
+            except OSError:
+                # Committed or removed by a concurrent backup
+                pass
+
+
+def format_snapshots(records: List[dict]) -> List[str]:
+    """Table lines describing snapshots, for --list-backups."""
+    headers = ("snapshot", "host", "label", "networks", "stored", "type")
+    rows = [(r["id"], r.get("host", ""), r.get("label", ""), str(r.get("networks", "")),
+             f"{r.get('size', 0) / 1024:.1f} KiB", "delta" if r.get("base") else "full") for r in records]
+    widths = [max(len(value) for value in column) for column in zip(headers, *rows)]
+    return ["  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in (headers, *rows)]
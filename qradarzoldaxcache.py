@@ -0,0 +1,383 @@
+"""
+   qradarzoldaxcache.py
+
+   Description: On-disk cache of QRadar GET responses.
+   Response bodies are stored as files keyed by console, URL, API Version, query,
+   Range header and API token, with a per-endpoint time to live. Streamed bodies
+   are written to the cache while they are consumed, and cached bodies are served
+   back as requests.Response objects reading from disk, so the streaming JSON
+   decoder works the same on a hit. The cache is bounded in size (least recently
+   used entries are evicted first) and writes are atomic.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import qradarzoldaxmetrics
+
+DEFAULT_CACHE_DIR = os.path.join(".nhsuite_cache", "http")
+DEFAULT_CACHE_MAX_MB = 256
+
+# Time to live in seconds of each cached endpoint; endpoints not listed are never cached
+DEFAULT_CACHE_TTLS = {
+    "/api/system/about": 86400,
+    "/api/gui_app_framework/application_definitions": 3600,
+    "/api/config/domain_management/domains": 600,
+    "/api/config/network_hierarchy/networks": 300,
+}
+
+# Response headers kept with a cached body
+STORED_HEADERS = ("Content-Type", "Content-Range", "ETag", "Last-Modified")
+
+# Request headers that change the response and are part of the cache key
+KEY_HEADERS = ("SEC", "Version", "Accept", "Range")
+
+# Temporary files older than this are leftovers of interrupted downloads
+STALE_TMP_SECONDS = 86400
+
+
+class ResponseCache:
+    """
+    Size-bounded on-disk cache of GET response bodies.
+
+    Each entry is a body file "<key>.body" and a metadata file "<key>.meta" (JSON:
+    url, creation time, size, stored headers); the metadata file is written last,
+    so an entry without it is incomplete and ignored. The modification time of
+    the body file records the last use, for LRU eviction.
+
+    Attributes:
+    -----------
+    directory : str
+        Cache directory (created with owner-only permissions).
+    max_bytes : int
+        Maximum total size of the cached bodies.
+    ttls : dict
+        Endpoint path -> time to live in seconds.
+    refresh : bool
+        Ignore cached entries (responses are still stored).
+    hits / misses / revalidated : int
+        Counters of the current process.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_MB * 1024 * 1024,
+                 ttls: Optional[dict] = None, refresh: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_CACHE_TTLS if ttls is None else ttls)
+        self.refresh = refresh
+        self.hits = self.misses = self.revalidated = 0
+        self._lock = threading.Lock()
+
+    def ttl(self, url: str) -> int:
+        """Time to live of an URL, 0 if its endpoint is not cached."""
+        return int(self.ttls.get(urlsplit(url).path.rstrip('/'), 0))
+
+    @staticmethod
+    def key(url: str, params: Optional[dict], headers: dict) -> str:
+        """
+        Cache key of a GET request: console and URL, query, and the headers that change the
+        response. The API token is part of the key (hashed) because it limits what is visible.
+        """
+        query = sorted((str(k), str(v)) for k, v in (params or {}).items())
+        key_headers = {name: str(headers.get(name, "")) for name in KEY_HEADERS}
+        material = json.dumps([url, query, key_headers], sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return base + ".body", base + ".meta"
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        _, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return meta if isinstance(meta, dict) else None
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """
+        Return the metadata of a complete entry, with its age in seconds under "age".
+        """
+        if self.refresh:
+            return None
+        body_path, _ = self._paths(key)
+        meta = self._read_meta(key)
+        try:
+            if meta is None or os.path.getsize(body_path) != meta["size"]:
+                return None
+        except (OSError, KeyError, TypeError):
+            return None
+        meta["age"] = time.time() - meta.get("created", 0)
+        return meta
+
+    def open_response(self, key: str, meta: dict) -> "requests.Response":
+        """Build a requests.Response whose body is read from the cached file."""
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        body_path, _ = self._paths(key)
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK (cache)"
+        response.url = meta["url"]
+        response.headers = CaseInsensitiveDict(meta.get("headers") or {})
+        response.raw = _CachedBody(body_path)
+        try:
+            # Records the use for LRU eviction
+            os.utime(body_path)
+        except OSError:
+            pass
+        self.hits += 1
+        qradarzoldaxmetrics.count("cache.hits")
+        return response
+
+    def touch(self, key: str, meta: dict):
+        """Mark an entry confirmed by the console (304 Not Modified) as fresh again."""
+        meta = {name: value for name, value in meta.items() if name != "age"}
+        meta["created"] = time.time()
+        self._write_meta(key, meta)
+        self.revalidated += 1
+        qradarzoldaxmetrics.count("cache.revalidated")
+
+    def validators(self, meta: dict) -> dict:
+        """Conditional request headers for an expired entry (If-None-Match / If-Modified-Since)."""
+        from requests.structures import CaseInsensitiveDict
+        headers = CaseInsensitiveDict(meta.get("headers") or {})
+        conditional = {}
+        if headers.get("ETag"):
+            conditional["If-None-Match"] = headers["ETag"]
+        if headers.get("Last-Modified"):
+            conditional["If-Modified-Since"] = headers["Last-Modified"]
+        return conditional
+
+    def _meta_for(self, response: "requests.Response", size: int) -> dict:
+        return {
+            "url": response.url,
+            "created": time.time(),
+            "size": size,
+            "headers": {name: response.headers[name] for name in STORED_HEADERS if name in response.headers},
+        }
+
+    def _write_meta(self, key: str, meta: dict):
+        _, meta_path = self._paths(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(meta, file)
+            os.replace(tmp_path, meta_path)
+        except BaseException:
+            _unlink(tmp_path)
+            raise
+
+    def _new_body_file(self):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        return os.fdopen(fd, 'wb'), tmp_path
+
+    def _commit(self, key: str, tmp_path: str, response: "requests.Response", size: int):
+        body_path, meta_path = self._paths(key)
+        _unlink(meta_path)
+        os.replace(tmp_path, body_path)
+        self._write_meta(key, self._meta_for(response, size))
+        self.evict()
+
+    def store(self, key: str, response: "requests.Response") -> "requests.Response":
+        """
+        Store a successful GET response.
+
+        A response already read (stream=False) is written at once. For a streamed
+        response, the body is written to the cache while the caller consumes it and
+        the entry is committed only if the whole body was read.
+
+        :return: The response to hand to the caller.
+        """
+        self.misses += 1
+        qradarzoldaxmetrics.count("cache.misses")
+        try:
+            file, tmp_path = self._new_body_file()
+        except OSError:
+            return response
+        if response._content_consumed:
+            try:
+                with file:
+                    file.write(response.content)
+                self._commit(key, tmp_path, response, len(response.content))
+            except OSError:
+                _unlink(tmp_path)
+            return response
+        response.raw = _TeeBody(response.raw, file, lambda size: self._commit(key, tmp_path, response, size),
+                                lambda: _unlink(tmp_path))
+        return response
+
+    def _entries(self):
+        """(last use, size, key) of every complete entry, and the stale temporary files."""
+        entries, stale = [], []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries, stale
+        now = time.time()
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith(".tmp-"):
+                if now - stat.st_mtime > STALE_TMP_SECONDS:
+                    stale.append(path)
+            elif name.endswith(".body"):
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".body")]))
+        return entries, stale
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries, stale = self._entries()
+            for path in stale:
+                _unlink(path)
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= size
+
+    def _remove(self, key: str):
+        body_path, meta_path = self._paths(key)
+        _unlink(meta_path)
+        _unlink(body_path)
+
+    def invalidate(self, url: str) -> int:
+        """
+        Drop the entries of the same console under the parent path of `url`.
+
+        Called after a successful write: a PUT to .../network_hierarchy/staged_networks
+        invalidates everything cached under .../network_hierarchy/.
+
+        :return: Number of entries removed.
+        """
+        target = urlsplit(url)
+        prefix = target.path.rsplit('/', 1)[0] + '/'
+        removed = 0
+        with self._lock:
+            for _, _, key in self._entries()[0]:
+                meta = self._read_meta(key)
+                if meta is None:
+                    continue
+                cached = urlsplit(str(meta.get("url", "")))
+                if cached.netloc == target.netloc and cached.path.startswith(prefix):
+                    self._remove(key)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            for _, _, key in self._entries()[0]:
+                self._remove(key)
+
+
+class _TeeBody:
+    """
+    Wraps a streamed urllib3 response: the decoded chunks read by requests are also
+    written to the cache file, and the entry is committed when the body ends.
+    """
+
+    def __init__(self, raw, file, on_complete, on_abort):
+        self._raw = raw
+        self._file = file
+        self._on_complete = on_complete
+        self._on_abort = on_abort
+        self._size = 0
+        self._done = False
+
+    def stream(self, amt: int = 2 ** 16, decode_content: Optional[bool] = None):
+        for chunk in self._raw.stream(amt, decode_content=True):
+            if not self._done:
+                self._file.write(chunk)
+                self._size += len(chunk)
+            yield chunk
+        self._finish(complete=True)
+
+    def _finish(self, complete: bool):
+        if self._done:
+            return
+        self._done = True
+        try:
+            self._file.close()
+            if complete:
+                self._on_complete(self._size)
+            else:
+                self._on_abort()
+        except OSError:
+            self._on_abort()
+
+    def close(self):
+        self._finish(complete=False)
+        self._raw.close()
+
+    def release_conn(self):
+        self._finish(complete=False)
+        release = getattr(self._raw, "release_conn", None)
+        if release is not None:
+            release()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class _CachedBody:
+    """
+    Body of a cache hit, read from the cached file by requests. The file is closed as
+    soon as the body has been read to the end, since the callers of make_request
+    consume the response without closing it.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+
+    def read(self, amt: Optional[int] = None, decode_content: Optional[bool] = None) -> bytes:
+        if self._file.closed:
+            return b""
+        data = self._file.read(-1 if amt is None else amt)
+        if not data or amt is None or amt < 0:
+            self._file.close()
+        return data
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
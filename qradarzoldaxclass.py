@@ -20,14 +20,35 @@
 """
 
 import csv
-import re
-import json
 import argparse
-import ipaddress
 import qradarzoldaxlib
+import qradarzoldaxvalidator
+import qradarzoldaxnetindex
+import qradarzoldaxnetwork
+import qradarzoldaxfilter
+import qradarzoldaxdomains
+import qradarzoldaxsqlite
+import qradarzoldaxparallel
+import qradarzoldaxdelta
+import qradarzoldaxbackup
+import qradarzoldaxmetrics
 import os
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Union
+from itertools import chain, islice
+from typing import Iterable, Iterator, Optional, Tuple, Union
+from qradarzoldaxvalidator import CSV_COLUMNS
+
+DEFAULT_FETCH_WORKERS = 4
+
+def _is_valid(parse, value: str) -> bool:
+    """Return True if the validator parse function accepts the value."""
+    try:
+        parse(value)
+        return True
+    except qradarzoldaxvalidator.InvalidValue:
+        return False
 
 class QRadarNetworkHierarchy:
     """
@@ -41,6 +62,20 @@ class QRadarNetworkHierarchy:
     base_url : str
         The base URL for the QRadar API.
 
+    config : dict
+        Configuration of the console (config.txt, or one entry of its "consoles" list).
+
+    backup_filename : str
+        Path of the last backup written by backup_current_hierarchy(), None before.
+    backup_snapshot : str
+        Id of the last snapshot written in the backup store, None before (or with backup_store off).
+
+    report_limit : int
+        Validation issues printed one by one before the summary by column and rule (config 'report_limit').
+
+    transport : QRadarTransport
+        Transport used for the requests, None for the shared transport of the console (see get_transport).
+
     Methods:
     --------
     valid_location_format(loc: str) -> bool:
@@ -61,81 +96,93 @@ class QRadarNetworkHierarchy:
     valid_network_name_format(name: str) -> bool:
         Validate the network name format. Allowed characters: Alphanumerics, -, _""
 
-    fetch_network_hierarchy() -> list:
-        Fetches the QRadar Network Hierarchy from the API.
+    iter_network_hierarchy(page_size: int, workers: int) -> Iterator[dict]:
+        Yields the QRadar Network Hierarchy entries, optionally page by page with Range requests.
+
+    fetch_network_hierarchy(page_size: int, workers: int) -> NetworkTable:
+        Fetches the QRadar Network Hierarchy from the API into a columnar NetworkTable.
 
-    write_network_hierarchy_to_csv(filename: str) -> int:
-        Fetches QRadar Network Hierarchy and writes it to a CSV file.
+    iter_filtered_hierarchy(export_filter, fresh) -> Iterator[dict]:
+        Yields the networks selected by an ExportFilter, filtered by QRadar when it accepts the filter.
 
-    import_csv_to_qradar(csv_filename: str) -> Union[bool, int]:
+    write_network_hierarchy_to_csv(filename: str, entries, export_filter) -> int:
+        Fetches QRadar Network Hierarchy and writes it (or the columns and networks of a filter) to a CSV file.
+
+    write_network_hierarchy_to_sqlite(filename: str, entries, export_filter) -> int:
+        Fetches QRadar Network Hierarchy and writes it to an indexed SQLite database.
+
+    import_csv_to_qradar(csv_filename: str, delta: bool, workers: int, error_report: str) -> Union[bool, int]:
         Imports data from a CSV file into QRadar using the API.
 
-    check_domain() -> None:
+    domain_index(refresh) -> Optional[DomainIndex]:
+        Fetches the domains of QRadar once, indexed by id and by name.
+
+    check_domain(file) -> Optional[list]:
         Fetches and displays domain information from QRadar.
 
-    backup_current_hierarchy() -> bool:
-        Backs up the current QRadar Network Hierarchy to a CSV file.
+    save_backup(entries, label) -> dict:
+        Backs up the current QRadar Network Hierarchy without printing, raising on failure.
+
+    backup_current_hierarchy(entries, label) -> bool:
+        Backs up the current QRadar Network Hierarchy in the backup store (or a CSV file).
+
+    restore_snapshot(name) -> Union[bool, int]:
+        Puts a snapshot of the backup store back as the QRadar Network Hierarchy.
     """
 
-    def __init__(self):
+    def __init__(self, page_size: Optional[int] = None, fetch_workers: Optional[int] = None,
+                 conf: Optional[dict] = None, transport: Optional[qradarzoldaxlib.QRadarTransport] = None):
         """
         Initialize the QRadarNetworkHierarchy object with the base URL.
+
+        :param page_size: Networks per page when fetching the hierarchy (config 'page_size', default 0 = single request).
+        :param fetch_workers: Pages fetched concurrently (config 'fetch_workers', default 4).
+        :param conf: Configuration of the console to work on, defaults to config.txt.
+        :param transport: Transport to use instead of the shared transport of the console.
         """
-        self.config = self._read_config()
+        self.config = self._read_config() if conf is None else conf
         self.base_url = f"https://{self.config['ip_QRadar']}"
+        self.page_size = int(self.config.get('page_size', 0)) if page_size is None else page_size
+        self.fetch_workers = int(self.config.get('fetch_workers', DEFAULT_FETCH_WORKERS)) if fetch_workers is None else fetch_workers
+        self.backup_filename = None
+        self.backup_snapshot = None
+        self.backup_lines = 0
+        self.report_limit = int(self.config.get('report_limit', qradarzoldaxvalidator.DEFAULT_REPORT_LIMIT))
+        self.transport = transport
+        self._domain_index = None
 
     @staticmethod
     def _read_config() -> dict:
         """
-        Reads the configuration from the config.txt file.
+        Returns the configuration of config.txt, shared with qradarzoldaxlib (read once per process).
 
         Returns:
         --------
         dict : Configuration as a dictionary.
         """
-        try:
-            with open('config.txt', 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            raise Exception("config.txt not found.")
-        except json.JSONDecodeError:
+        conf = qradarzoldaxlib.get_config()
+        if not conf:
+            if not os.path.exists(qradarzoldaxlib.CONFIG_FILE):
+                raise Exception("config.txt not found.")
             raise Exception("Failed to decode JSON from config.txt.")
+        return conf
 
     # Validation Functions
 
     @staticmethod
     def valid_location_format(loc: str) -> bool:
         """Validate if the provided string is in the correct lat,long format."""
-        pattern = r'^(-?\d+(\.\d+)?),\s*(-?\d+(\.\d+)?)$'
-        match = re.match(pattern, loc)
-        if not match:
-            return False
-        lat, _, lon, _ = match.groups()
-        lat, lon = float(lat), float(lon)
-
-        # Check latitude is between -90 and 90
-        if not (-90 <= lat <= 90):
-            return False
-
-        # Check longitude is between -180 and 180
-        if not (-180 <= lon <= 180):
-            return False
-
-        return True
-
-
-
-        #return -90 <= lat <= 90 and -180 <= lon <= 180
+        return _is_valid(qradarzoldaxvalidator.parse_location, loc)
 
     @staticmethod
     def valid_country_code_format(code: str) -> bool:
         """Validate if the provided country code is in the correct format."""
-        return bool(re.match(r"^[A-Z]{2}$", code))
+        return _is_valid(qradarzoldaxvalidator.parse_country_code, code)
 
     @staticmethod
     def valid_group_format(group: str) -> bool:
         """Validate the group format. Allowed characters: Alphanumerics, ., -, _"""
-        return bool(re.match(r'^[A-Za-z0-9\.\-_]+$', group))
+        return _is_valid(qradarzoldaxvalidator.parse_group, group)
 
     @staticmethod
     def format_location(location_str: str) -> dict:
@@ -147,218 +194,561 @@ class QRadarNetworkHierarchy:
     @staticmethod
     def valid_cidr_format(cidr: str) -> bool:
         """Validate if the provided string is in correct CIDR format."""
-        # Check basic format using regex
-        if not re.match(r"^(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/(\d{1,2})$", cidr):
-            return False
-
-        # Use ipaddress to validate the correctness of the IP address and prefix
-        try:
-            ipaddress.ip_network(cidr)
-            return True
-        except ValueError:
-            return False
+        return _is_valid(qradarzoldaxvalidator.parse_cidr, cidr)
 
     @staticmethod
     def valid_network_name_format(name: str) -> bool:
         """Validate the network name format. Allowed characters: Alphanumerics, -, _"""
-        return bool(re.match(r'^[A-Za-z0-9\-_]+$', name))
+        return _is_valid(qradarzoldaxvalidator.parse_network_name, name)
+
+    def _get_transport(self) -> qradarzoldaxlib.QRadarTransport:
+        """Transport of the requests: the injected one, or the shared transport of the console."""
+        return self.transport if self.transport is not None else qradarzoldaxlib.get_transport(self.config)
 
     # Functions for NH
 
-    def fetch_network_hierarchy(self):
-        """Fetch the QRadar Network Hierarchy."""
+    def _fetch_page(self, url: str, start: int, end: int, fresh: bool = False,
+                    params: Optional[dict] = None) -> Tuple[list, Optional[int]]:
+        """
+        Fetch one page of a QRadar list endpoint using the Range header.
+
+        :param url: Endpoint URL.
+        :param start: Index of the first item (inclusive).
+        :param end: Index of the last item (inclusive).
+        :param fresh: Bypass the response cache.
+        :param params: Query parameters (filter, fields).
+        :return: Tuple of (items on this page, total number of items or None if unknown).
+        """
+        response = self._get_transport().request(url, "GET", params=params, headers={"Range": f"items={start}-{end}"}, fresh=fresh)
+        with qradarzoldaxmetrics.phase("json.decode") as timer:
+            page = response.json()
+            timer.items = len(page) if isinstance(page, list) else 0
+        if not isinstance(page, list):
+            raise ValueError(f"Unexpected data format received: {page}")
+        return page, qradarzoldaxlib.parse_content_range(response.headers.get("Content-Range"))
+
+    def iter_network_hierarchy(self, page_size: Optional[int] = None, workers: Optional[int] = None,
+                               fresh: bool = False, params: Optional[dict] = None) -> Iterator[dict]:
+        """
+        Yield the QRadar Network Hierarchy entries one by one, in server order.
+
+        Without a page size the hierarchy is fetched with a single streamed GET and decoded
+        incrementally, so entries are yielded while the body downloads. With a page size,
+        it is fetched page by page with the "Range: items=x-y" header: the first page gives
+        the total count, then the remaining pages are fetched by a bounded pool of workers
+        and yielded in order as soon as each one is available, so at most `workers` pages
+        are held in memory.
+
+        :param page_size: Number of networks per page, 0 or None for a single request.
+        :param workers: Number of pages fetched concurrently.
+        :param fresh: Fetch from QRadar even if the hierarchy is in the response cache.
+        :param params: Query parameters of the GET, e.g. the filter and fields of an ExportFilter.
+        :raises: requests.RequestException or ValueError if a request fails.
+        """
+        return qradarzoldaxmetrics.timed(self._iter_network_hierarchy(page_size, workers, fresh, params), "fetch")
+
+    def _iter_network_hierarchy(self, page_size: Optional[int], workers: Optional[int], fresh: bool,
+                                params: Optional[dict]) -> Iterator[dict]:
         url = f"{self.base_url}/api/config/network_hierarchy/networks"
+        page_size = self.page_size if page_size is None else page_size
+        workers = max(1, self.fetch_workers if workers is None else workers)
+
+        if not page_size or page_size <= 0:
+            # Decode the body while it downloads instead of loading the whole hierarchy
+            response = self._get_transport().request(url, "GET", params=params, stream=True, fresh=fresh)
+            try:
+                chunks = qradarzoldaxmetrics.counted_bytes(response.iter_content(qradarzoldaxlib.STREAM_CHUNK_SIZE), "http.bytes_received")
+                chunks = qradarzoldaxmetrics.timed(chunks, "http.read", count_items=False)
+                yield from qradarzoldaxmetrics.timed(qradarzoldaxlib.iter_json_array(chunks), "json.decode")
+            finally:
+                response.close()
+            return
 
-        # Assume qradarzoldaxlib.make_request can potentially raise exceptions on its own
-        try:
-            hierarchy_data = qradarzoldaxlib.make_request(url, "GET")
+        first_page, total = self._fetch_page(url, 0, page_size - 1, fresh, params)
+        yield from first_page
 
-            # Check if the data is not a list, which means something unexpected happened
-            if not isinstance(hierarchy_data, list):
-                message = f"Unexpected data format received: {hierarchy_data}"
-                qradarzoldaxlib.logger.error(message)
-                raise ValueError(message)
+        if total is None:
+            # No total announced by the console: walk the pages sequentially until a short one
+            start, page = page_size, first_page
+            while len(page) == page_size:
+                page, _ = self._fetch_page(url, start, start + page_size - 1, fresh, params)
+                yield from page
+                start += page_size
+            return
 
-            return hierarchy_data
+        starts = iter(range(page_size, total, page_size))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for start in islice(starts, workers):
+                pending.append(executor.submit(self._fetch_page, url, start, start + page_size - 1, fresh, params))
+            while pending:
+                page, _ = pending.popleft().result()
+                for start in islice(starts, 1):
+                    pending.append(executor.submit(self._fetch_page, url, start, start + page_size - 1, fresh, params))
+                yield from page
+
+    def fetch_network_hierarchy(self, page_size: Optional[int] = None,
+                                workers: Optional[int] = None) -> qradarzoldaxnetwork.NetworkTable:
+        """
+        Fetch the QRadar Network Hierarchy into a NetworkTable.
+
+        Entries are added to the table as they are decoded, so the hierarchy is never
+        held as a list of API dicts.
+
+        :param page_size: Number of networks per page, 0 or None for a single request.
+        :param workers: Number of pages fetched concurrently in paginated mode.
+        :return: Table of the networks (iterate it for Network objects, iter_api() for API dicts), empty on error.
+        """
+        try:
+            return qradarzoldaxnetwork.NetworkTable.from_api(self.iter_network_hierarchy(page_size, workers))
 
         except Exception as e:
             # We can either raise the exception again or handle it gracefully
             qradarzoldaxlib.logger.error(f"Error fetching QRadar Network Hierarchy: {str(e)}")
-            return []
+            print(f"Error occurred during request: {e}")
+            return qradarzoldaxnetwork.NetworkTable()
+
+    def iter_filtered_hierarchy(self, export_filter: qradarzoldaxfilter.ExportFilter,
+                                page_size: Optional[int] = None, workers: Optional[int] = None,
+                                fresh: bool = False) -> Iterator[dict]:
+        """
+        Yield the networks selected by an export filter.
 
-    def write_network_hierarchy_to_csv(self, filename="network_hierarchy.csv"):
+        The filter and the needed fields are sent to QRadar, and every network received is
+        checked again locally. If the console rejects these parameters, the whole hierarchy
+        is fetched and filtered locally.
+
+        :param export_filter: Networks and columns to keep.
+        :param page_size: Number of networks per page, 0 or None for a single request.
+        :param workers: Number of pages fetched concurrently in paginated mode.
+        :param fresh: Fetch from QRadar even if the hierarchy is in the response cache.
+        :raises: requests.RequestException or ValueError if a request fails.
+        """
+        import requests
+        params = export_filter.query_params()
+        entries = self.iter_network_hierarchy(page_size, workers, fresh, params=params)
+        try:
+            # The first entry needs the first response: a rejected filter shows up here
+            first = next(entries, None)
+        except requests.HTTPError as e:
+            status = getattr(e.response, "status_code", None)
+            if not params or status not in qradarzoldaxfilter.FILTER_REJECTED_STATUS:
+                raise
+            qradarzoldaxlib.logger.error(f"QRadar answered {status} to the export filter ({export_filter.describe()}), "
+                                         f"fetching the whole hierarchy and filtering it locally")
+            entries = self.iter_network_hierarchy(page_size, workers, fresh)
+            first = next(entries, None)
+        if first is not None:
+            yield from export_filter.apply(chain((first,), entries))
+
+    @staticmethod
+    def network_to_csv_row(entry: Union[dict, qradarzoldaxnetwork.Network]) -> tuple:
+        """
+        Convert a network entry from the API into a CSV row, without modifying the entry.
+
+        :param entry: Network entry as returned by QRadar, or a Network.
+        :return: Tuple of values in CSV_COLUMNS order, 'N/A' for missing fields.
+        """
+        location = entry.get("location") or {}
+        coordinates = location.get("coordinates") or ()
+        location_str = 'N/A'
+        if location.get("type") == "Point" and len(coordinates) == 2:
+            location_str = f"{coordinates[1]},{coordinates[0]}"
+            ## Warning / zoldax : Have to change the order , as QRadar API give the longitude first then the latitude
+        get = entry.get
+        return (get("id", 'N/A'), get("group", 'N/A'), get("name", 'N/A'), get("cidr", 'N/A'),
+                get("description", 'N/A'), get("domain_id", 'N/A'), location_str, get("country_code", 'N/A'))
+
+    def write_network_hierarchy_to_csv(self, filename="network_hierarchy.csv",
+                                       entries: Optional[Iterable[Union[dict, qradarzoldaxnetwork.Network]]] = None,
+                                       export_filter: Optional[qradarzoldaxfilter.ExportFilter] = None):
         """
         Fetch QRadar Network Hierarchy and write it to a CSV file.
 
+        Rows are written as the networks are decoded from the response, so memory
+        use does not grow with the size of the hierarchy.
+
         :param filename: The name of the output CSV file.
+        :param entries: Networks to write (API dicts, Network objects or a NetworkTable),
+                        defaults to a fresh iter_network_hierarchy().
+        :param export_filter: Networks and columns to write, pushed down to QRadar when entries is None.
         :return: Number of lines written.
         """
-        hierarchy_data = self.fetch_network_hierarchy()
+        if export_filter is None:
+            entries = self.iter_network_hierarchy() if entries is None else entries
+        elif entries is None:
+            entries = self.iter_filtered_hierarchy(export_filter)
+        else:
+            entries = export_filter.apply(entries)
+        written = [0]
 
-        with open(filename, 'w', newline='') as file:
+        def counted(entries):
+            for entry in entries:
+                written[0] += 1
+                yield entry
+
+        with open(filename, 'w', newline='') as file, qradarzoldaxmetrics.phase("csv.write") as timer:
             writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            columns = ["id", "group", "name", "cidr", "description", "domain_id", "location", "country_code"]
-            writer.writerow(columns)
+            rows = map(self.network_to_csv_row, counted(entries))
+            if export_filter is None:
+                writer.writerow(CSV_COLUMNS)
+            else:
+                writer.writerow(export_filter.columns)
+                rows = export_filter.project(rows)
+
+            try:
+                writer.writerows(rows)
+                timer.items = written[0]
+            except Exception as e:
+                timer.items = written[0]
+                qradarzoldaxlib.logger.error(f"Error fetching QRadar Network Hierarchy: {str(e)}")
+                print(f"Error occurred during request: {e}")
+                # Nothing written yet: report an empty export as before, otherwise the file is truncated
+                if written[0]:
+                    raise
+
+            return written[0] + 1
+
+    def write_network_hierarchy_to_sqlite(self, filename="network_hierarchy.db",
+                                          entries: Optional[Iterable[Union[dict, qradarzoldaxnetwork.Network]]] = None,
+                                          export_filter: Optional[qradarzoldaxfilter.ExportFilter] = None) -> int:
+        """
+        Fetch QRadar Network Hierarchy and write it to an indexed SQLite database.
 
-            for entry in hierarchy_data:
-                location = entry.get("location", {})
-                location_str = 'N/A'
-                if location.get("type") == "Point" and len(location.get("coordinates", [])) == 2:
-                    location_str = f"{location['coordinates'][1]},{location['coordinates'][0]}"
-                    ## Warning / zoldax : Have to change the order , as QRadar API give the longitude first then the latitude
-                entry["location"] = location_str
-                data = [entry.get(key, 'N/A') for key in columns]
-                writer.writerow(data)
+        The networks are inserted as they are decoded, in a single transaction, and the
+        file is replaced only when the database is complete (see qradarzoldaxsqlite).
 
-            return len(hierarchy_data) + 1
+        :param filename: The name of the database file.
+        :param entries: Networks to write, defaults to a fresh iter_network_hierarchy().
+        :param export_filter: Networks to write (its columns are ignored: the database has every field).
+        :return: Number of networks written, 0 on error.
+        """
+        if export_filter is None:
+            entries = self.iter_network_hierarchy() if entries is None else entries
+        elif entries is None:
+            entries = self.iter_filtered_hierarchy(export_filter.with_columns(CSV_COLUMNS))
+        else:
+            entries = export_filter.apply(entries)
+
+        with qradarzoldaxmetrics.phase("sqlite.write") as timer:
+            try:
+                written = qradarzoldaxsqlite.write_database(filename, entries, {
+                    "source": self.config.get('ip_QRadar', ''),
+                    "filter": export_filter.describe() if export_filter is not None else "everything"})
+            except Exception as e:
+                qradarzoldaxlib.logger.error(f"Error exporting QRadar Network Hierarchy to {filename}: {str(e)}")
+                print(f"Error occurred during export: {e}")
+                return 0
+            timer.items = written
+            return written
 
-    def import_csv_to_qradar(self, csv_filename: str) -> Union[bool, int]:
+    @staticmethod
+    def validate_import_file(csv_filename: str, report: qradarzoldaxvalidator.ValidationReport,
+                             workers: int = 1, domains: Optional[qradarzoldaxdomains.DomainIndex] = None,
+                             unresolved: str = qradarzoldaxvalidator.WARNING) -> qradarzoldaxnetwork.NetworkTable:
+        """
+        Validate a CSV file for import without contacting QRadar.
+
+        Every row is checked against the CSV schema and stored in a NetworkTable, then
+        the valid rows are indexed by address range to detect duplicate ids, duplicate
+        CIDRs and nested CIDRs. With several workers, large files are parsed and checked
+        by chunks in a process pool (see qradarzoldaxparallel); the result and the report
+        are the same as with one.
+
+        :param csv_filename: Path of the CSV file.
+        :param report: Report collecting the issues.
+        :param workers: Worker processes for the row checks, 0 for one per CPU.
+        :param domains: Domains of the console to check domain_id against and resolve domain
+                        names with (see check_domains), None when they are not available:
+                        ids are then not checked, and domain names are not resolved.
+        :param unresolved: Severity of a domain name that cannot be resolved (see check_domains).
+        :return: Table of the valid networks, in file order.
+        """
+        workers = qradarzoldaxparallel.resolve_workers(workers)
+        with qradarzoldaxvalidator.paused_gc(), qradarzoldaxmetrics.phase("validate") as timer:
+            table, rows = qradarzoldaxparallel.validate_csv_table(csv_filename, report, workers)
+            qradarzoldaxnetindex.check_conflicts(table, rows, report)
+            qradarzoldaxdomains.check_domains(table, rows, domains, report, unresolved)
+            timer.items = report.rows_checked
+        return table
+
+    def import_csv_to_qradar(self, csv_filename: str, delta: bool = False, workers: int = 1,
+                             error_report: Optional[str] = None) -> Union[bool, int]:
         """
         Import data from the given CSV file to QRadar via the API.
+
+        The whole file is validated first (see validate_import_file); if any row has
+        an error, the report is printed and nothing is sent to QRadar. The first
+        report_limit issues are printed one by one, the others by column and rule, so a
+        systematic problem does not flood the terminal and error.log.
+
+        The PUT body is then encoded from the validated NetworkTable and streamed to
+        QRadar (gzip-encoded with upload_compression, see put_json_array), so the
+        JSON payload is never built in memory and the file is not read twice.
+
+        In delta mode the live hierarchy (fetched once, in the same pass as the safety
+        backup) is compared with the CSV: the change summary is printed and the PUT is
+        skipped when nothing changed. staged_networks replaces the whole hierarchy, so
+        when something changed the full CSV is still sent.
+
+        :param csv_filename: Path of the CSV file.
+        :param delta: Compare with the live hierarchy and skip no-op imports.
+        :param workers: Worker processes validating the file (see validate_import_file).
+        :param error_report: JSON file receiving every validation issue and the issues by column and rule.
+        :return: Number of networks imported (0 when a delta import found no change), False on failure.
         """
+        report = qradarzoldaxvalidator.ValidationReport(csv_filename)
+        # Unknown domains are rejected here rather than by QRadar after the upload
+        domains = self.domain_index()
+        if domains is None:
+            print("Could not fetch the domains of QRadar, domain_id is not checked.")
+            qradarzoldaxlib.logger.warning("Could not fetch the domains of QRadar, domain_id is not checked.")
 
-        # Expected Network Hierarchy header for the CSV file
-        expected_header = ["id", "group", "name", "cidr", "description", "domain_id", "location", "country_code"]
+        try:
+            # A name cannot be sent to QRadar: without the domains it blocks the import
+            table = self.validate_import_file(csv_filename, report, workers, domains, qradarzoldaxvalidator.ERROR)
+            network_count = len(table)
+        except FileNotFoundError:
+            qradarzoldaxlib.logger.error(f"File {csv_filename} not found.")
+            return False
+        except (csv.Error, UnicodeDecodeError) as e:
+            qradarzoldaxlib.logger.error(f"Error reading CSV file {csv_filename}: {e}")
+            return False
 
-        if 'safety' in qradarzoldaxlib.config and qradarzoldaxlib.config['safety'].lower() != "off":
-            backup_success = self.backup_current_hierarchy()
-        else:
-            print("Safety parameter is off, no backup from server")
-            qradarzoldaxlib.logger.error("Safety parameter is off, no backup from server")
+        if report.issues:
+            report.print_report(self.report_limit, logger=qradarzoldaxlib.logger)
+        if error_report:
+            try:
+                report.write_json(error_report)
+                print(f"Validation report written in file : {error_report}")
+            except OSError as e:
+                qradarzoldaxlib.logger.error(f"Error writing the validation report {error_report}: {e}")
+        if report.has_errors:
+            qradarzoldaxlib.logger.error(f"Validation of {csv_filename} failed - aborting import.")
+            return False
+        print(qradarzoldaxdomains.format_domain_counts(Counter(table.domain_ids), domains))
+
+        # The backup and the delta must reflect the console now, not a cached response
+        live_entries = self.iter_network_hierarchy(fresh=True)
+        live_index = qradarzoldaxdelta.LiveIndex() if delta else None
+        if delta:
+            live_entries = live_index.observe(live_entries)
 
-            if not backup_success:
+        if 'safety' in self.config and self.config['safety'].lower() != "off":
+            if not self.backup_current_hierarchy(live_entries):
                 qradarzoldaxlib.logger.error("Backup failed. Aborting the import process for safety.")
                 return False
-
-        url = f"{self.base_url}/api/config/network_hierarchy/staged_networks"
-        network_hierarchy_data = []
+        else:
+            print("Safety parameter is off, no backup from server")
+            qradarzoldaxlib.logger.error("Safety parameter is off, no backup from server")
+            if delta:
+                try:
+                    for _ in live_entries:
+                        pass
+                except Exception as e:
+                    qradarzoldaxlib.logger.error(f"Error fetching QRadar Network Hierarchy: {str(e)}")
+                    print(f"Error occurred during request: {e}")
 
         try:
-            with open(csv_filename, 'r', newline='', encoding='utf-8') as csv_file:
-                reader = csv.DictReader(csv_file)
-
-                # Check if the header matches the expected header
-                if reader.fieldnames != expected_header:
-                    print("Header is not correct, must be id,group,name,cidr,description,domain_id,location,country_code.")
-                    qradarzoldaxlib.logger.error("Header is not correct, must be id,group,name,cidr,description,domain_id,location,country_code.")
+            if delta:
+                if not live_index.complete:
+                    print("Could not fetch the current Network Hierarchy, delta import aborted.")
+                    qradarzoldaxlib.logger.error("Could not fetch the current Network Hierarchy, delta import aborted.")
                     return False
-
-                for row in reader:
-                    try:
-                        network_obj = {
-                            "id": int(row["id"]),
-                            "description": row["description"],
-                            "domain_id": int(row["domain_id"]),
-                        }
-
-                        name_val = row.get("name", "").strip()
-                        if not self.valid_network_name_format(row["name"]):
-                            print(f"Invalid network name {row['name']} for id {row['id']}.")
-                            print("A network name may only contain letters, numbers, '-', or '_'")
-                            qradarzoldaxlib.logger.error(f"Invalid network name {row['name']} for id {row['id']} - aborting import.")
-                            qradarzoldaxlib.logger.error("A network name may only contain letters, numbers, '-', or '_'.")
-                        else:
-                            network_obj["name"] = name_val
-
-                        if not self.valid_cidr_format(row["cidr"]):
-                            print(f"Invalid cidr {row['cidr']} for id {row['id']}.")
-                            qradarzoldaxlib.logger.error(f"Invalid cidr {row['cidr']} for id {row['id']} - abort import.")
-                        else:
-                            cidr_val = row.get("cidr", "").strip()
-                            network_obj["cidr"] = cidr_val
-
-                        if not self.valid_group_format(row["group"]):
-                            print(f"Invalid group name {row['group']} for id {row['id']} - abort import.")
-                            print("A group name may only contain letters, numbers, '.', '-', or '_'.")
-                            qradarzoldaxlib.logger.error(f"Invalid group name {row['group']} for id {row['id']} - abort import -.")
-                            qradarzoldaxlib.logger.error("A group name may only contain letters, numbers, '.', '-', or '_'.")
-                        else:
-                            group_val = row.get("group", "").strip()
-                            network_obj["group"] = group_val
-
-                        location_val = row.get("location", "").strip()
-                        if location_val and location_val != "N/A":
-                            if self.valid_location_format(location_val):
-                                formatted_location = self.format_location(location_val)
-                                network_obj["location"] = formatted_location
-                            else:
-                                print(f"Invalid location format {location_val} for id {row['id']} - import continue - but value set to null.")
-                                qradarzoldaxlib.logger.error(f"Invalid location format {location_val} for id {row['id']} - import continue - but value set to null.")
-
-                        country_code_val = row.get("country_code", "").strip()
-                        if country_code_val and country_code_val != "N/A":
-                            if self.valid_country_code_format(country_code_val):
-                                network_obj["country_code"] = country_code_val
-                            else:
-                                print(f"Invalid country code {country_code_val} for id {row['id']} - import continue - but value set to null.")
-                                qradarzoldaxlib.logger.error(f"Invalid country code {country_code_val} for id {row['id']} - import continue - but value set to null.")
-
-                        network_hierarchy_data.append(network_obj)
-
-                    except KeyError as ke:
-                        missing_column = ke.args[0]
-                        qradarzoldaxlib.logger.error(f"Missing value for column '{missing_column}' in row {reader.line_num}.")
-                        return False
-                    except ValueError as ve:  # This is to catch any int conversion errors
-                        qradarzoldaxlib.logger.error(f"Invalid value in row {reader.line_num}: {ve}")
-                        return False
-                    except Exception as e:
-                        qradarzoldaxlib.logger.error(f"Problems with the data from your file {e}")
-                        return False
-
-            response = qradarzoldaxlib.make_request(url, "PUT", params=json.dumps(network_hierarchy_data))
-            if response:
-                return len(network_hierarchy_data)
+                with qradarzoldaxmetrics.phase("delta") as timer:
+                    diff = qradarzoldaxdelta.diff_hierarchy(live_index.digests, table.iter_api())
+                    timer.items = network_count
+                diff.print_summary()
+                if not diff.has_changes:
+                    # Encoded only to be measured, chunk by chunk: the body is never held in memory
+                    payload_size = sum(map(len, qradarzoldaxlib.encode_json_array(table.iter_api())))
+                    print(f"Network Hierarchy already up to date, PUT skipped "
+                          f"({network_count} networks, {payload_size} bytes not sent).")
+                    return 0
+                print(f"Pushing the full Network Hierarchy ({network_count} networks).")
+
+            url = f"{self.base_url}/api/config/network_hierarchy/staged_networks"
+            if qradarzoldaxlib.put_json_array(url, table.iter_api, conf=self.config, transport=self.transport):
+                return network_count
             else:
                 qradarzoldaxlib.logger.error(f"Failed to import data from {csv_filename} incorrect format (no data) or incorrect data")
                 print(f"Failed to import data from {csv_filename} incorrect format (no data) or incorrect data")
                 return False
 
-        except FileNotFoundError:
-            qradarzoldaxlib.logger.error(f"File {csv_filename} not found.")
-            return False
-        except csv.Error:
-            qradarzoldaxlib.logger.error(f"Error reading CSV file {csv_filename}.")
-            return False
         except Exception as e:
             qradarzoldaxlib.logger.error(f"An unexpected error occurred: {e}")
             return False
 
-    def check_domain(self):
+    def domain_index(self, refresh: bool = False) -> Optional[qradarzoldaxdomains.DomainIndex]:
         """
-        Fetch and display the domain information from QRadar.
+        Domains of the console by id and by name, fetched once per instance.
+
+        The domains request also goes through the response cache (see qradarzoldaxcache).
+
+        :param refresh: Fetch the domains again from QRadar, bypassing the response cache.
+        :return: DomainIndex, None on error.
+        """
+        if self._domain_index is None or refresh:
+            url = f"{self.base_url}/api/config/domain_management/domains"
+            domain_data = qradarzoldaxlib.make_request(url, "GET", conf=self.config, fresh=refresh,
+                                                       transport=self.transport)
+
+            if not isinstance(domain_data, list):
+                qradarzoldaxlib.logger.error(f"Unexpected data format received: {domain_data}")
+                return None
+            self._domain_index = qradarzoldaxdomains.DomainIndex(domain_data)
+        return self._domain_index
+
+    def check_domain(self, file=None) -> Optional[list]:
         """
-        url = f"{self.base_url}/api/config/domain_management/domains"
-        domain_data = qradarzoldaxlib.make_request(url, "GET")
+        Fetch and display the domain information from QRadar.
 
-        if not isinstance(domain_data, list):
-            qradarzoldaxlib.logger.error(f"Unexpected data format received: {domain_data}")
-            return
+        :param file: Stream to print to, defaults to stdout.
+        :return: The domains, None on error.
+        """
+        index = self.domain_index()
+        if index is None:
+            return None
 
-        for domain in domain_data:
+        for domain in index.domains:
             domain_id = domain.get("id", 'N/A')
-            if domain_id == 0:
-                domain_name = "DEFAULT_DOMAIN"
-            else:
-                domain_name = domain.get("name", 'N/A') or 'N/A'
+            domain_name = index.name(domain_id) if domain_id in index else domain.get("name", 'N/A') or 'N/A'
             domain_description = domain.get("description", 'N/A') or 'N/A'
-            print(f"Domain ID: {domain_id}, Domain Name: {domain_name}, Description: {domain_description}")
+            print(f"Domain ID: {domain_id}, Domain Name: {domain_name}, Description: {domain_description}", file=file)
+        return index.domains
 
-    def backup_current_hierarchy(self) -> bool:
-        """
-        Create a backup of the current network hierarchy.
+    def save_backup(self, entries: Optional[Iterable[dict]] = None, label: str = "before-import") -> dict:
         """
-        try:
-            if not os.path.exists('safety'):
-                os.mkdir('safety')
+        Back up the current network hierarchy, without printing anything.
 
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            backup_filename = f"safety/backup-before-import-NH-{qradarzoldaxlib.config['ip_QRadar']}-{timestamp}.csv"
-            print(f"Safety parameter is on, actual Network Hierarchy backuped in {backup_filename} before import")
+        The backup is a snapshot of the backup store (compressed, and not stored again if
+        the hierarchy did not change, see qradarzoldaxbackup). With backup_store "off" in
+        config.txt, a plain CSV file is written in the safety folder instead.
 
-            self.write_network_hierarchy_to_csv(backup_filename)
-            return True
+        :param entries: Live networks to back up, defaults to a fresh fetch.
+        :param label: Reason of the backup, part of the snapshot id / file name.
+        :return: The snapshot record of the backup store with the path of its object as "file",
+                 or {"id": None, "file": path, "networks": count} for a CSV file.
+        :raises: Any error of the fetch or of the backup store: a failed backup is never a partial success.
+        """
+        if entries is None:
+            entries = self.iter_network_hierarchy(fresh=True)
+        if str(self.config.get('backup_store', 'on')).lower() == "off":
+            return self._backup_to_csv(entries, label)
+
+        store = qradarzoldaxbackup.BackupStore.from_config(self.config, qradarzoldaxlib.logger)
+        with qradarzoldaxmetrics.phase("backup") as timer:
+            snapshot = store.save(self.config['ip_QRadar'], label, map(self.network_to_csv_row, entries))
+            timer.items = snapshot["networks"]
+        self.backup_lines = snapshot["networks"] + 1
+        self.backup_snapshot = snapshot["id"]
+        self.backup_filename = os.path.join(store.objects_dir, snapshot["object"])
+        return {**snapshot, "file": self.backup_filename}
+
+    def _backup_to_csv(self, entries: Iterable[dict], label: str) -> dict:
+        """Backup as a plain CSV file in the safety folder (backup_store off)."""
+        if not os.path.exists('safety'):
+            os.mkdir('safety')
+
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        backup_filename = f"safety/backup-{label}-NH-{self.config['ip_QRadar']}-{timestamp}.csv"
+        networks = 0
+        try:
+            with open(backup_filename, 'w', newline='') as file:
+                writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(CSV_COLUMNS)
+                for row in map(self.network_to_csv_row, entries):
+                    writer.writerow(row)
+                    networks += 1
+        except BaseException:
+            # A truncated file must not pass for a backup
+            if os.path.exists(backup_filename):
+                os.remove(backup_filename)
+            raise
+        self.backup_lines = networks + 1
+        self.backup_filename = backup_filename
+        return {"id": None, "file": backup_filename, "networks": networks}
+
+    def backup_current_hierarchy(self, entries: Optional[Iterable[dict]] = None, label: str = "before-import") -> bool:
+        """
+        Create a backup of the current network hierarchy (see save_backup) and print where it is.
 
+        :param entries: Live networks to back up, defaults to a fresh fetch.
+        :param label: Reason of the backup, part of the snapshot id / file name.
+        """
+        try:
+            backup = self.save_backup(entries, label)
         except Exception as e:
             qradarzoldaxlib.logger.warning(f"Failed to create a backup due to the following error: {e}")
             return False
+
+        if backup["id"] is None:
+            where = backup["file"]
+        else:
+            detail = (f"{backup['networks']} networks, "
+                      + ("unchanged, already stored" if backup["deduplicated"] else
+                         f"{backup['size'] / 1024:.1f} KiB{' as delta' if backup['base'] else ''}"))
+            where = f"snapshot {backup['id']} ({detail})"
+        if label == "before-import":
+            print(f"Safety parameter is on, actual Network Hierarchy backuped in {where} before import")
+        else:
+            print(f"Network Hierarchy of {self.config['ip_QRadar']} backuped in {where}")
+        return True
+
+    def restore_snapshot(self, name: str) -> Union[bool, int]:
+        """
+        Put a snapshot of the backup store back as the Network Hierarchy of QRadar.
+
+        The snapshot is decompressed, converted and sent as the staged_networks PUT body
+        while it is read, so the hierarchy is never held in memory. A row that does not
+        validate or a checksum mismatch interrupts the upload, and QRadar then receives
+        no complete body. With safety on, the current hierarchy is backed up first.
+
+        :param name: Snapshot id, unique id prefix, or "latest" (of this console).
+        :return: Number of networks restored, False on failure.
+        """
+        store = qradarzoldaxbackup.BackupStore.from_config(self.config, qradarzoldaxlib.logger)
+        try:
+            snapshot = store.resolve(name, host=self.config['ip_QRadar'])
+        except qradarzoldaxbackup.BackupError as e:
+            qradarzoldaxlib.logger.error(str(e))
+            print(e)
+            return False
+        if snapshot.get("host") != self.config['ip_QRadar']:
+            print(f"Snapshot {snapshot['id']} was taken on {snapshot.get('host')}, restoring it on {self.config['ip_QRadar']}")
+
+        if 'safety' in self.config and self.config['safety'].lower() != "off":
+            if not self.backup_current_hierarchy(label="before-restore"):
+                qradarzoldaxlib.logger.error("Backup failed. Aborting the restore process for safety.")
+                return False
+        else:
+            print("Safety parameter is off, no backup from server")
+            qradarzoldaxlib.logger.error("Safety parameter is off, no backup from server")
+
+        def networks() -> Iterator[dict]:
+            report = qradarzoldaxvalidator.ValidationReport(snapshot["id"])
+            validator = qradarzoldaxvalidator.RowValidator()
+            records = store.iter_records(snapshot)
+            if not validator.check_header(next(records, None), report):
+                raise qradarzoldaxbackup.BackupError(f"Snapshot {snapshot['id']} has an unexpected header")
+            for row, fields in enumerate(records, start=2):
+                if not fields:
+                    continue
+                network_obj = validator.validate(fields, row, report)
+                if network_obj is None:
+                    raise qradarzoldaxbackup.BackupError(
+                        f"Snapshot {snapshot['id']}: {report.format_issue(report.issues[-1])}")
+                # Snapshots are taken from QRadar: a domain_id that is not an id is a damaged snapshot
+                if type(network_obj.get("domain_id", 0)) is not int:
+                    raise qradarzoldaxbackup.BackupError(
+                        f"Snapshot {snapshot['id']}: row {row}, domain_id {network_obj['domain_id']!r} is not a domain id")
+                yield network_obj
+
+        url = f"{self.base_url}/api/config/network_hierarchy/staged_networks"
+        print(f"Restoring snapshot {snapshot['id']} ({snapshot.get('networks')} networks)")
+        restored = qradarzoldaxlib.put_json_array(url, networks, conf=self.config, transport=self.transport)
+        if restored is None:
+            qradarzoldaxlib.logger.error(f"Failed to restore snapshot {snapshot['id']}")
+            print(f"Failed to restore snapshot {snapshot['id']}")
+            return False
+        return restored
@@ -0,0 +1,342 @@
+"""
+   qradarzoldaxclient.py
+
+   Description: Python client of the QRadar Network Hierarchy, for tools that
+   reuse NHSuite in-process instead of going through CSV files. Unlike
+   QRadarNetworkHierarchy, which serves the command line, the client is given
+   its configuration (config.txt is never read), prints nothing, and writes
+   nothing unless the configuration asks for it (response cache, safety
+   backup): networks and domains are yielded by generators, imports take any
+   iterable of records, and failures raise ClientError. The client owns its
+   HTTP connections and closes them when used as a context manager.
+
+   Example:
+   --------
+   >>> with QRadarClient(prod_conf) as prod, QRadarClient(lab_conf) as lab:
+   ...     result = lab.import_networks(network for network in prod.iter_networks()
+   ...                                  if network["group"].startswith("EMEA"))
+   >>> result.networks, result.sent
+   (1520, True)
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+from array import array
+from collections import namedtuple
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import qradarzoldaxlib
+import qradarzoldaxmetrics
+from qradarzoldaxbackup import BackupError
+from qradarzoldaxclass import QRadarNetworkHierarchy
+from qradarzoldaxdelta import LiveIndex, diff_hierarchy
+from qradarzoldaxdomains import DomainIndex, check_domains
+from qradarzoldaxfilter import ExportFilter
+from qradarzoldaxnetindex import check_conflicts
+from qradarzoldaxnetwork import NetworkTable
+from qradarzoldaxvalidator import CSV_COLUMNS, RowValidator, ValidationReport, paused_gc
+
+# Result of QRadarClient.import_networks():
+# networks validated, whether they were sent, the validation report, the delta (or None) and the backup (or None)
+ImportResult = namedtuple("ImportResult", ["networks", "sent", "report", "diff", "backup"])
+
+_LOCATION = CSV_COLUMNS.index("location")
+
+
+class ClientError(Exception):
+    """Raised by QRadarClient when QRadar cannot be reached, answers an error, or the client is closed."""
+
+
+class ValidationError(ClientError):
+    """Raised when the records to import have errors; `report` is the ValidationReport listing them."""
+
+    def __init__(self, report: ValidationReport):
+        super().__init__(f"validation failed, nothing sent to QRadar: {report.summary()}")
+        self.report = report
+
+
+def record_fields(record) -> List[str]:
+    """
+    Fields of a record in CSV_COLUMNS order, as the text the RowValidator checks.
+
+    A record is an API network object or a Network (location as a GeoJSON Point), a dict
+    of the CSV columns (location as "latitude,longitude"), or a sequence of values in
+    CSV_COLUMNS order. Missing values are empty.
+    """
+    if not hasattr(record, "get"):
+        return ["" if value is None else str(value) for value in record]
+    values = list(map(record.get, CSV_COLUMNS))
+    location = values[_LOCATION]
+    if isinstance(location, dict):
+        coordinates = location.get("coordinates") or ()
+        # GeoJSON order: longitude first
+        values[_LOCATION] = (f"{coordinates[1]},{coordinates[0]}"
+                             if location.get("type") == "Point" and len(coordinates) == 2 else None)
+    return [value if value.__class__ is str else "" if value is None else str(value) for value in values]
+
+
+def validate_records(records: Iterable, report: ValidationReport,
+                     domains: Optional[DomainIndex] = None) -> NetworkTable:
+    """
+    Validate records like the rows of an import file (see QRadarNetworkHierarchy.validate_import_file).
+
+    The records are checked one by one as they are consumed, so they can come from a
+    generator (another console, a database...). Issues are reported with the position
+    of the record, starting at 1.
+
+    :param records: Records to validate (see record_fields).
+    :param report: Report collecting the issues.
+    :param domains: Domains to check domain_id against and resolve names with (see check_domains),
+                    None to leave ids unchecked (domain names are then only warned about).
+    :return: Table of the valid networks, in record order.
+    """
+    validate = RowValidator().validate
+    table, rows = NetworkTable(), array('L')
+    append, add_row = table.append, rows.append
+    with paused_gc(), qradarzoldaxmetrics.phase("validate") as timer:
+        for row, record in enumerate(records, start=1):
+            network = validate(record_fields(record), row, report)
+            if network is not None:
+                add_row(row)
+                append(network)
+        check_conflicts(table, rows, report)
+        check_domains(table, rows, domains, report)
+        timer.items = report.rows_checked
+    return table
+
+
+class QRadarClient:
+    """
+    Client of the Network Hierarchy of one QRadar console.
+
+    Attributes:
+    -----------
+    config : dict
+        Configuration of the console (the keys of config.txt), with the response cache off unless it sets 'cache'.
+    transport : QRadarTransport
+        HTTP connections of the client, closed by close().
+    base_url : str
+        The base URL for the QRadar API.
+
+    Methods:
+    --------
+    iter_networks(export_filter, fresh) -> Iterator[dict]:
+        Yields the networks of the console as API network objects.
+
+    fetch_table(export_filter, fresh) -> NetworkTable:
+        Fetches the networks into a columnar NetworkTable.
+
+    iter_domains(refresh) -> Iterator[dict]:
+        Yields the domains of the console.
+
+    domain_index(refresh) -> DomainIndex:
+        Domains by id and by name, fetched once.
+
+    validate(records, check_domains) -> Tuple[NetworkTable, ValidationReport]:
+        Validates records without sending them.
+
+    import_networks(records, delta, backup) -> ImportResult:
+        Validates records and replaces the Network Hierarchy with them.
+
+    backup(entries, label) -> dict:
+        Saves the current hierarchy in the backup store.
+
+    system_info() -> dict:
+        Fetches /api/system/about.
+    """
+
+    def __init__(self, conf: dict, page_size: Optional[int] = None, fetch_workers: Optional[int] = None,
+                 base_url: Optional[str] = None):
+        """
+        Create the client; no request is sent before the first call.
+
+        :param conf: Configuration of the console: at least ip_QRadar and auth, and any other key of config.txt.
+        :param page_size: Networks per page when fetching the hierarchy (config 'page_size', default 0 = single request).
+        :param fetch_workers: Pages fetched concurrently (config 'fetch_workers', default 4).
+        :param base_url: URL of the API, defaults to https://<ip_QRadar>.
+        :raises ClientError: If ip_QRadar or auth is missing.
+        """
+        if not conf.get('ip_QRadar') or not conf.get('auth'):
+            raise ClientError("the configuration needs ip_QRadar and auth")
+        # The response cache writes files: only when the configuration asks for it
+        self.config = {"cache": "off", **conf}
+        self.transport = qradarzoldaxlib.QRadarTransport(self.config)
+        self._hierarchy = QRadarNetworkHierarchy(page_size, fetch_workers, conf=self.config, transport=self.transport)
+        if base_url:
+            self._hierarchy.base_url = base_url.rstrip('/')
+        self._domain_index = None
+        self.closed = False
+
+    @property
+    def base_url(self) -> str:
+        return self._hierarchy.base_url
+
+    def __enter__(self) -> "QRadarClient":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the connections of the client; it cannot be used afterwards."""
+        if not self.closed:
+            self.closed = True
+            self.transport.close()
+
+    def _check_open(self):
+        if self.closed:
+            raise ClientError("the client is closed")
+
+    def _get(self, path: str, fresh: bool = False):
+        """JSON answer of a GET on the API."""
+        import requests
+        self._check_open()
+        try:
+            return self.transport.request(f"{self.base_url}{path}", "GET", fresh=fresh).json()
+        except (requests.RequestException, ValueError) as e:
+            raise ClientError(f"GET {path} on {self.config['ip_QRadar']} failed: {e}") from e
+
+    def system_info(self) -> dict:
+        """Release and version of the console (/api/system/about)."""
+        return self._get("/api/system/about")
+
+    def iter_networks(self, export_filter: Optional[ExportFilter] = None, fresh: bool = False) -> Iterator[dict]:
+        """
+        Yield the networks of the console as API network objects, while the answer downloads.
+
+        :param export_filter: Networks to keep, filtered by QRadar when it accepts the filter
+                              (the columns of the filter are ignored: networks keep every field).
+        :param fresh: Fetch from QRadar even if the hierarchy is in the response cache.
+        :raises ClientError: If a request fails, possibly after some networks were yielded.
+        """
+        import requests
+        self._check_open()
+        if export_filter is None:
+            entries = self._hierarchy.iter_network_hierarchy(fresh=fresh)
+        else:
+            entries = self._hierarchy.iter_filtered_hierarchy(export_filter.with_columns(CSV_COLUMNS), fresh=fresh)
+        try:
+            yield from entries
+        except (requests.RequestException, ValueError) as e:
+            raise ClientError(f"Error fetching the Network Hierarchy of {self.config['ip_QRadar']}: {e}") from e
+
+    def fetch_table(self, export_filter: Optional[ExportFilter] = None, fresh: bool = False) -> NetworkTable:
+        """
+        Fetch the networks into a NetworkTable (iterate it for Network objects, iter_api() for API dicts).
+
+        :raises ClientError: If a request fails.
+        """
+        return NetworkTable.from_api(self.iter_networks(export_filter, fresh))
+
+    def domain_index(self, refresh: bool = False) -> DomainIndex:
+        """
+        Domains of the console by id and by name, fetched once per client.
+
+        :param refresh: Fetch the domains again from QRadar.
+        :raises ClientError: If the request fails.
+        """
+        if self._domain_index is None or refresh:
+            domains = self._get("/api/config/domain_management/domains", fresh=refresh)
+            if not isinstance(domains, list):
+                raise ClientError(f"Unexpected data format received for the domains: {domains}")
+            self._domain_index = DomainIndex(domains)
+        return self._domain_index
+
+    def iter_domains(self, refresh: bool = False) -> Iterator[dict]:
+        """Yield the domains of the console as returned by QRadar."""
+        yield from self.domain_index(refresh).domains
+
+    def validate(self, records: Iterable, check_domains: bool = True) -> Tuple[NetworkTable, ValidationReport]:
+        """
+        Validate records without sending anything (see validate_records).
+
+        :param records: API network objects, Network objects, dicts of the CSV columns or CSV rows.
+        :param check_domains: Check domain_id against the domains of the console, and resolve domain names
+                              (without them, domain names are warnings).
+        :return: (table of the valid networks, report); the report has_errors if the import would be refused.
+        :raises ClientError: If the domains cannot be fetched.
+        """
+        report = ValidationReport("records")
+        domains = self.domain_index() if check_domains else None
+        return validate_records(records, report, domains), report
+
+    def backup(self, entries: Optional[Iterable[dict]] = None, label: str = "client") -> dict:
+        """
+        Save the current hierarchy in the backup store (or a CSV file with backup_store off).
+
+        :param entries: Live networks to back up, defaults to a fresh fetch.
+        :param label: Reason of the backup, part of the snapshot id.
+        :return: The backup record (see QRadarNetworkHierarchy.save_backup).
+        :raises ClientError: If the fetch or the backup fails.
+        """
+        import requests
+        self._check_open()
+        try:
+            return self._hierarchy.save_backup(self.iter_networks(fresh=True) if entries is None else entries, label)
+        except ClientError:
+            raise
+        except (requests.RequestException, BackupError, OSError, ValueError) as e:
+            raise ClientError(f"Backup of {self.config['ip_QRadar']} failed: {e}") from e
+
+    def import_networks(self, records: Iterable, delta: bool = False, backup: Optional[bool] = None) -> ImportResult:
+        """
+        Replace the Network Hierarchy of the console with records, validated first.
+
+        Same steps as an import of a CSV file: every record is validated (domains
+        included) before anything is sent, the live hierarchy is backed up, and the
+        networks are streamed to staged_networks. In delta mode the PUT is skipped when
+        the live hierarchy already matches the records.
+
+        :param records: API network objects, Network objects, dicts of the CSV columns or CSV rows,
+                        consumed once (e.g. the generator of another client's iter_networks()).
+        :param delta: Compare with the live hierarchy and skip no-op imports.
+        :param backup: Back up the live hierarchy first, defaults to the 'safety' option of the configuration.
+        :return: ImportResult(networks, sent, report, diff, backup).
+        :raises ValidationError: If a record has an error; nothing is sent.
+        :raises ClientError: If a request or the backup fails; nothing is sent unless the PUT itself failed.
+        """
+        import requests
+        table, report = self.validate(records)
+        if report.has_errors:
+            raise ValidationError(report)
+
+        if backup is None:
+            backup = str(self.config.get('safety', 'off')).lower() != "off"
+        live_entries = self.iter_networks(fresh=True)
+        live_index = LiveIndex() if delta else None
+        if delta:
+            live_entries = live_index.observe(live_entries)
+        saved = None
+        if backup:
+            saved = self.backup(live_entries, "before-import")
+        elif delta:
+            for _ in live_entries:
+                pass
+
+        diff = None
+        if delta:
+            with qradarzoldaxmetrics.phase("delta") as timer:
+                diff = diff_hierarchy(live_index.digests, table.iter_api())
+                timer.items = len(table)
+            if not diff.has_changes:
+                return ImportResult(len(table), False, report, diff, saved)
+
+        url = f"{self.base_url}/api/config/network_hierarchy/staged_networks"
+        try:
+            qradarzoldaxlib.send_json_array(url, table.iter_api, self.transport)
+        except requests.RequestException as e:
+            raise ClientError(f"Import into {self.config['ip_QRadar']} failed: {e}") from e
+        return ImportResult(len(table), True, report, diff, saved)
@@ -0,0 +1,194 @@
+"""
+   qradarzoldaxconsoles.py
+
+   Description: Runs an operation (export, backup, check-version, check-domain)
+   on several QRadar consoles at once. config.txt may list the consoles under
+   "consoles", each entry overriding the top-level options (auth, Version,
+   verify_ssl, ...). Each console gets its own transport and output files, the
+   consoles are processed by a thread pool, and a consolidated summary is
+   printed at the end, so a run takes about as long as the slowest console.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import json
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+
+import qradarzoldaxlib
+import qradarzoldaxsqlite
+from qradarzoldaxclass import QRadarNetworkHierarchy
+from qradarzoldaxfilter import ExportFilter
+
+CONSOLE_ACTIONS = ("export", "backup", "check-version", "check-domain")
+DEFAULT_CONSOLE_WORKERS = 8
+
+# Characters kept from a console name when it is used in a file name
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^A-Za-z0-9._-]+')
+
+ConsoleResult = namedtuple("ConsoleResult", ["console", "host", "action", "ok", "detail", "output", "seconds"])
+
+
+def console_configs(conf: dict) -> List[dict]:
+    """
+    Expand a configuration into one configuration per console.
+
+    Without a "consoles" list the configuration itself is the only console. Otherwise
+    each entry of "consoles" is merged over the top-level options, and gets a "name"
+    (defaults to its ip_QRadar) used in output file names and in the summary.
+
+    :param conf: Configuration read from config.txt.
+    :return: List of console configurations, in config order.
+    :raises ValueError: If a console has no ip_QRadar or auth, or two consoles share a name.
+    """
+    entries = conf.get("consoles")
+    if not entries:
+        return [{"name": conf.get("ip_QRadar", ""), **conf}]
+    if not isinstance(entries, list):
+        raise ValueError("consoles must be a list of console objects in config.txt")
+
+    defaults = {key: value for key, value in conf.items() if key not in ("consoles", "name")}
+    consoles, names = [], set()
+    for position, entry in enumerate(entries, start=1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"console #{position} must be an object in config.txt")
+        console = {**defaults, **entry}
+        for key in ("ip_QRadar", "auth"):
+            if not console.get(key):
+                raise ValueError(f"console #{position} has no {key} in config.txt")
+        console["name"] = str(console.get("name") or console["ip_QRadar"])
+        if console["name"] in names:
+            raise ValueError(f"console name {console['name']} is used twice in config.txt")
+        names.add(console["name"])
+        consoles.append(console)
+    return consoles
+
+
+def select_consoles(consoles: List[dict], names: Optional[List[str]] = None) -> List[dict]:
+    """
+    Keep the consoles whose name or ip_QRadar is in `names` (all of them if no name is given).
+
+    :raises ValueError: If a name matches no console.
+    """
+    if not names:
+        return consoles
+    selected = []
+    for name in names:
+        matches = [console for console in consoles if name in (console["name"], console.get("ip_QRadar"))]
+        if not matches:
+            raise ValueError(f"Unknown console {name}, known consoles: {', '.join(c['name'] for c in consoles)}")
+        selected.extend(console for console in matches if console not in selected)
+    return selected
+
+
+def host_filename(filename: str, console_name: str) -> str:
+    """Per-console output file: "network_hierarchy.csv" -> "network_hierarchy-<console>.csv"."""
+    root, extension = os.path.splitext(filename)
+    return f"{root}-{_UNSAFE_FILENAME_CHARS.sub('_', console_name)}{extension}"
+
+
+def run_console(conf: dict, action: str, export_file: str = "network_hierarchy.csv",
+                page_size: Optional[int] = None, fetch_workers: Optional[int] = None,
+                export_filter: Optional[ExportFilter] = None) -> ConsoleResult:
+    """
+    Run one action on one console; errors are caught and reported in the result.
+
+    :param conf: Console configuration (see console_configs).
+    :param action: One of CONSOLE_ACTIONS.
+    :param export_file: Base name of the export file, made per-console with host_filename.
+    :param export_filter: Networks and columns of the export.
+    :return: ConsoleResult with the output file and a short detail.
+    """
+    name = conf["name"]
+    start = time.perf_counter()
+    ok, detail, output = False, "", None
+    try:
+        qradar_nh = QRadarNetworkHierarchy(page_size=page_size, fetch_workers=fetch_workers, conf=conf)
+        if action == "export":
+            output = host_filename(export_file, name)
+            if qradarzoldaxsqlite.is_sqlite_file(output):
+                networks = qradar_nh.write_network_hierarchy_to_sqlite(output, export_filter=export_filter)
+            else:
+                networks = qradar_nh.write_network_hierarchy_to_csv(output, export_filter=export_filter) - 1
+            ok = networks > 0
+            detail = f"{networks} networks" if ok else "no network exported, see error.log"
+        elif action == "backup":
+            ok = qradar_nh.backup_current_hierarchy(label="manual")
+            output = qradar_nh.backup_snapshot or qradar_nh.backup_filename
+            detail = f"{qradar_nh.backup_lines - 1} networks" if ok else "backup failed, see error.log"
+        elif action == "check-version":
+            output = host_filename("system_info.txt", name)
+            with open(output, 'w') as file:
+                system_info = qradarzoldaxlib.print_qradar_version(conf, file=file)
+            ok, detail = bool(system_info), system_info.get("release_name", "no answer")
+        elif action == "check-domain":
+            output = host_filename("domains.txt", name)
+            with open(output, 'w') as file:
+                domains = qradar_nh.check_domain(file=file)
+            ok, detail = domains is not None, f"{len(domains)} domains" if domains is not None else "no answer"
+        else:
+            raise ValueError(f"Unsupported action {action}")
+    except Exception as e:
+        qradarzoldaxlib.logger.error(f"[{name}] {action} failed: {e}")
+        detail = str(e)
+    return ConsoleResult(name, conf.get("ip_QRadar", ""), action, ok, detail, output,
+                         round(time.perf_counter() - start, 3))
+
+
+def run_consoles(consoles: List[dict], action: str, workers: Optional[int] = None, **options) -> List[ConsoleResult]:
+    """
+    Run an action on every console concurrently.
+
+    Each console uses its own transport (connection pool, retries and max_concurrency
+    limit), so a slow console does not hold back the others.
+
+    :param consoles: Console configurations.
+    :param action: One of CONSOLE_ACTIONS.
+    :param workers: Consoles processed at the same time (default: all, up to DEFAULT_CONSOLE_WORKERS).
+    :param options: export_file, page_size, fetch_workers, export_filter, passed to run_console.
+    :return: Results in the order of `consoles`.
+    """
+    workers = max(1, workers or min(len(consoles), DEFAULT_CONSOLE_WORKERS))
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_console, conf, action, **options): conf["name"] for conf in consoles}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            print(f"[{result.console}] {action} {'done' if result.ok else 'FAILED'} in {result.seconds}s: {result.detail}")
+    return [results[conf["name"]] for conf in consoles]
+
+
+def print_summary(results: List[ConsoleResult], elapsed: Optional[float] = None, file=None):
+    """Print the consolidated summary table of a multi-console run."""
+    headers = ("console", "host", "status", "seconds", "output", "detail")
+    rows = [(r.console, r.host, "ok" if r.ok else "FAILED", str(r.seconds), r.output or "-", r.detail) for r in results]
+    widths = [max(len(value) for value in column) for column in zip(headers, *rows)]
+    for row in (headers, *rows):
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip(), file=file)
+    failed = sum(1 for r in results if not r.ok)
+    total = f" in {elapsed:.3f}s" if elapsed is not None else ""
+    print(f"{len(results)} console(s), {len(results) - failed} ok, {failed} failed{total}", file=file)
+
+
+def write_summary(results: List[ConsoleResult], filename: str, elapsed: Optional[float] = None):
+    """Write the summary of a multi-console run as JSON."""
+    with open(filename, 'w') as file:
+        json.dump({"seconds": elapsed, "results": [result._asdict() for result in results]}, file, indent=2)
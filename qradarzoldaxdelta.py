@@ -0,0 +1,170 @@
+"""
+   qradarzoldaxdelta.py
+
+   Description: Change detection between two Network Hierarchies.
+   Networks from the QRadar API and from a CSV file are normalized into the same
+   canonical record and hashed; a keyed merge on the network id then gives the
+   added, removed and changed networks without keeping both hierarchies in memory.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import hashlib
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# Values meaning "no value", from the API (None) or from an exported CSV ("N/A")
+_EMPTY = (None, "", "N/A")
+
+# Decimal places kept for coordinates, so that API floats and CSV strings compare equal
+COORDINATE_PRECISION = 6
+
+
+def canonical_record(network: dict) -> tuple:
+    """
+    Normalize a network (API entry or validated CSV row) into a comparable tuple.
+
+    :param network: Network object with the Network Hierarchy fields.
+    :return: Tuple (id, group, name, cidr, description, domain_id, location, country_code)
+             where location is (longitude, latitude) or None.
+    """
+    location = network.get("location")
+    point = None
+    if isinstance(location, dict) and location.get("type") == "Point" and len(location.get("coordinates") or ()) == 2:
+        lon, lat = location["coordinates"]
+        point = (round(float(lon), COORDINATE_PRECISION), round(float(lat), COORDINATE_PRECISION))
+    description = network.get("description")
+    country_code = network.get("country_code")
+    return (
+        int(network["id"]),
+        str(network.get("group") or "").strip(),
+        str(network.get("name") or "").strip(),
+        str(network.get("cidr") or "").strip(),
+        # An exported CSV writes "N/A" for a network without description
+        "" if description in _EMPTY else str(description),
+        int(network.get("domain_id") or 0),
+        point,
+        None if country_code in _EMPTY else str(country_code).strip(),
+    )
+
+
+def record_digest(record: tuple) -> bytes:
+    """Stable 128-bit digest of a canonical record."""
+    return hashlib.blake2b(repr(record).encode('utf-8'), digest_size=16).digest()
+
+
+def network_digest(network: dict) -> bytes:
+    """Digest of a network's canonical record."""
+    return record_digest(canonical_record(network))
+
+
+def network_label(network: dict) -> str:
+    """Short description of a network for change summaries."""
+    return f"id {network.get('id')} {network.get('group')}.{network.get('name')} {network.get('cidr')}"
+
+
+class HierarchyDiff:
+    """
+    Differences between a live hierarchy and a target hierarchy, keyed by network id.
+
+    Attributes:
+    -----------
+    added : list
+        Labels of the networks only in the target.
+    removed : list
+        Labels of the networks only in the live hierarchy.
+    changed : list
+        Labels of the networks present in both with different content.
+    unchanged : int
+        Number of identical networks.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.unchanged = 0
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self) -> str:
+        """One-line change summary."""
+        return (f"{len(self.added)} added, {len(self.removed)} removed, "
+                f"{len(self.changed)} changed, {self.unchanged} unchanged")
+
+    def print_summary(self, limit: int = 10):
+        """Print the change summary with up to `limit` examples of each kind of change."""
+        print(f"Delta: {self.summary()}")
+        for sign, labels in (("+", self.added), ("-", self.removed), ("~", self.changed)):
+            for label in labels[:limit]:
+                print(f"  {sign} {label}")
+            if len(labels) > limit:
+                print(f"  {sign} ... and {len(labels) - limit} more")
+
+
+class LiveIndex:
+    """
+    Digests of the live hierarchy, indexed by network id.
+
+    observe() wraps the stream of live networks so that the digests are collected
+    while the same stream is consumed elsewhere (e.g. written to the safety backup).
+
+    Attributes:
+    -----------
+    digests : dict
+        id -> (digest, label) for every network seen.
+    complete : bool
+        True once the whole stream has been consumed without error.
+    """
+
+    def __init__(self):
+        self.digests: Dict[int, Tuple[bytes, str]] = {}
+        self.complete = False
+
+    def observe(self, networks: Iterable[dict]) -> Iterator[dict]:
+        """Yield the networks unchanged, recording the digest of each one."""
+        digests = self.digests
+        for network in networks:
+            digests[int(network["id"])] = (network_digest(network), network_label(network))
+            yield network
+        self.complete = True
+
+
+def diff_hierarchy(live: Dict[int, Tuple[bytes, str]], target: Iterable[dict],
+                   diff: Optional[HierarchyDiff] = None) -> HierarchyDiff:
+    """
+    Compare a target hierarchy with the digests of the live one.
+
+    :param live: LiveIndex.digests of the current hierarchy.
+    :param target: Network objects that would be imported.
+    :param diff: HierarchyDiff to fill (a new one if not given).
+    :return: The HierarchyDiff.
+    """
+    diff = HierarchyDiff() if diff is None else diff
+    seen = set()
+    for network in target:
+        network_id = int(network["id"])
+        seen.add(network_id)
+        current = live.get(network_id)
+        if current is None:
+            diff.added.append(network_label(network))
+        elif current[0] != network_digest(network):
+            diff.changed.append(network_label(network))
+        else:
+            diff.unchanged += 1
+    diff.removed = [label for network_id, (_, label) in live.items() if network_id not in seen]
+    return diff
@@ -0,0 +1,148 @@
+"""
+   qradarzoldaxdomains.py
+
+   Description: Index of the QRadar domains (/config/domain_management/domains)
+   by id and by name, used to check the domain_id of every network before an
+   import: unknown ids are reported as validation errors with their row, and
+   domains given by name in the CSV are resolved to their id, so a typo is
+   caught before the hierarchy is uploaded.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+from collections import Counter
+from typing import Iterable, Optional, Sequence
+
+from qradarzoldaxnetwork import NetworkTable
+from qradarzoldaxvalidator import ERROR, WARNING, InvalidValue, ValidationReport
+
+# Name shown for domain 0, whose name is empty in QRadar; also accepted in the CSV
+DEFAULT_DOMAIN_NAME = "DEFAULT_DOMAIN"
+
+
+class DomainIndex:
+    """
+    QRadar domains by id and by name.
+
+    Attributes:
+    -----------
+    domains : list
+        Domain objects as returned by QRadar.
+    names : dict
+        Domain id -> name (DEFAULT_DOMAIN_NAME for domain 0).
+    ids : dict
+        Domain name -> id.
+    """
+
+    def __init__(self, domains: Iterable[dict]):
+        self.domains = list(domains)
+        self.names = {}
+        self.ids = {}
+        for domain in self.domains:
+            domain_id = domain.get("id")
+            if type(domain_id) is not int:
+                continue
+            name = DEFAULT_DOMAIN_NAME if domain_id == 0 else str(domain.get("name") or "").strip()
+            self.names[domain_id] = name or str(domain_id)
+            if name:
+                self.ids.setdefault(name, domain_id)
+        self.ids.setdefault(DEFAULT_DOMAIN_NAME, 0)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, domain_id) -> bool:
+        return domain_id in self.names
+
+    def name(self, domain_id) -> str:
+        """Name of a domain, the id itself for an unknown domain."""
+        return self.names.get(domain_id, str(domain_id))
+
+    def resolve(self, value) -> int:
+        """
+        Id of a domain given by id or by name.
+
+        :raises InvalidValue: If no domain has this id or name.
+        """
+        if type(value) is int:
+            if value in self.names:
+                return value
+            raise InvalidValue(f"unknown domain id, known domains: {self.describe()}")
+        domain_id = self.ids.get(str(value).strip())
+        if domain_id is None:
+            raise InvalidValue(f"unknown domain name, known domains: {self.describe()}")
+        return domain_id
+
+    def describe(self, limit: int = 10) -> str:
+        """Short list of the domains ("0 DEFAULT_DOMAIN, 3 TenantA..."), for messages."""
+        items = [f"{domain_id} {name}" for domain_id, name in sorted(self.names.items())[:limit]]
+        if len(self.names) > limit:
+            items.append(f"... {len(self.names) - limit} more")
+        return ", ".join(items) or "none"
+
+
+def check_domains(table: NetworkTable, rows: Sequence[int], index: Optional[DomainIndex],
+                  report: ValidationReport, unresolved: str = WARNING) -> Counter:
+    """
+    Check the domain of every network, and replace domain names by their id in the table.
+
+    Integer ids are checked against the index with one pass over the distinct ids of
+    the domain_ids column; only the networks of an unknown id, or given by name, are
+    looked at one by one. The rules are unknown_domain_id, unknown_domain_name, and
+    unresolved_domain_name for a name when there is no index.
+
+    :param table: Validated networks.
+    :param rows: Row number in the CSV file of each network of the table.
+    :param index: Domains of the console, None if they are not available (offline validation, or
+                  they could not be fetched): ids are then not checked, and names are not resolved.
+    :param report: Report collecting the issues.
+    :param unresolved: Severity of a name when there is no index: WARNING offline, where the
+                       import would resolve it, ERROR for an import, which cannot send a name.
+    :return: Number of networks per domain id.
+    """
+    domain_ids = table.domain_ids
+    # Networks whose domain_id is not an integer of the column (a name)
+    named = [position for position in table.irregular_positions()
+             if not isinstance(table.value(position, "domain_id"), int)]
+    for position in named:
+        value = table.value(position, "domain_id")
+        if index is None:
+            report.add(rows[position], "domain_id", str(value), "unresolved_domain_name",
+                       "domain name not checked, the domain list of QRadar is not available", unresolved)
+            continue
+        try:
+            table.set_value(position, "domain_id", index.resolve(value))
+        except InvalidValue as e:
+            report.add(rows[position], "domain_id", str(value), "unknown_domain_name", str(e), ERROR)
+
+    if index is not None:
+        unknown = {domain_id for domain_id in set(domain_ids) if domain_id not in index}
+        if unknown:
+            unresolved = set(named)
+            for position, domain_id in enumerate(domain_ids):
+                if domain_id in unknown and position not in unresolved:
+                    report.add(rows[position], "domain_id", str(domain_id), "unknown_domain_id",
+                               f"unknown domain id, known domains: {index.describe()}", ERROR)
+    return Counter(domain_ids)
+
+
+def format_domain_counts(counts: Counter, index: Optional[DomainIndex] = None, limit: int = 10) -> str:
+    """One line with the number of networks per domain, largest first."""
+    items = [f"{index.name(domain_id) if index is not None else domain_id} ({domain_id}): {count}"
+             for domain_id, count in counts.most_common(limit)]
+    if len(counts) > limit:
+        items.append(f"{len(counts) - limit} more domains")
+    return "Networks per domain: " + ", ".join(items)
@@ -0,0 +1,193 @@
+"""
+   qradarzoldaxfilter.py
+
+   Description: Selection of the networks and columns of an export. The
+   predicates QRadar can evaluate (domain, country, group subtree) are sent as
+   the "filter" query parameter and the needed columns as "fields", so the
+   console only serializes and sends what the export keeps. Every predicate is
+   also checked locally: the result is exact whatever the console evaluated,
+   and the export still works, filtered locally, when the console rejects the
+   filter.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Optional
+
+from qradarzoldaxnetindex import network_range
+from qradarzoldaxvalidator import CSV_COLUMNS, InvalidValue, parse_country_code, parse_group
+
+# Statuses of a console rejecting the filter or fields parameter
+FILTER_REJECTED_STATUS = (400, 422)
+
+
+def _quoted(value: str) -> str:
+    return f'"{value}"'
+
+
+def _comparison(field: str, values: list) -> str:
+    """field = value, or field in (values) for several values."""
+    if len(values) == 1:
+        return f"{field} = {values[0]}"
+    return f"{field} in ({', '.join(map(str, values))})"
+
+
+class ExportFilter:
+    """
+    Networks and columns kept by an export.
+
+    Attributes:
+    -----------
+    domain_ids : list
+        Domains kept (any domain if empty).
+    group_prefixes : list
+        Groups kept with their subgroups: "EMEA" keeps EMEA, EMEA.Paris, EMEA.Paris.DMZ...
+    countries : list
+        Country codes kept.
+    cidr_within : list
+        IPv4 CIDRs: a network is kept if it lies inside one of them.
+    columns : list
+        CSV columns written, in CSV_COLUMNS order by default.
+    """
+
+    def __init__(self, domain_ids: Optional[List[int]] = None, group_prefixes: Optional[List[str]] = None,
+                 countries: Optional[List[str]] = None, cidr_within: Optional[List[str]] = None,
+                 columns: Optional[List[str]] = None):
+        """
+        :param domain_ids: Domain ids to keep.
+        :param group_prefixes: Group subtrees to keep.
+        :param countries: Two-letter country codes to keep.
+        :param cidr_within: IPv4 CIDRs; networks inside one of them are kept.
+        :param columns: Columns to write (names of CSV_COLUMNS).
+        :raises ValueError: If a value is malformed.
+        """
+        try:
+            self.domain_ids = sorted(set(int(domain_id) for domain_id in domain_ids or ()))
+            self.group_prefixes = sorted(set(parse_group(prefix.rstrip('.')) for prefix in group_prefixes or ()))
+            self.countries = sorted(set(parse_country_code(country.upper()) for country in countries or ()))
+            self.cidr_within = sorted(set(cidr.strip() for cidr in cidr_within or ()))
+            self._ranges = [network_range(cidr) for cidr in self.cidr_within]
+        except InvalidValue as e:
+            raise ValueError(f"invalid export filter: {e}") from None
+        columns = [column.strip() for column in columns or () if column.strip()]
+        unknown = [column for column in columns if column not in CSV_COLUMNS]
+        if unknown:
+            raise ValueError(f"unknown column(s) {', '.join(unknown)}, expected some of {', '.join(CSV_COLUMNS)}")
+        self.columns = columns or list(CSV_COLUMNS)
+
+    def with_columns(self, columns: List[str]) -> "ExportFilter":
+        """Same networks, other columns."""
+        selected = ExportFilter.__new__(ExportFilter)
+        selected.__dict__.update(self.__dict__)
+        selected.columns = list(columns)
+        return selected
+
+    @property
+    def selects_rows(self) -> bool:
+        """True if some networks may be left out."""
+        return bool(self.domain_ids or self.group_prefixes or self.countries or self.cidr_within)
+
+    @property
+    def selects_columns(self) -> bool:
+        return self.columns != CSV_COLUMNS
+
+    def fields(self) -> List[str]:
+        """API fields the export needs: its columns and the fields checked locally."""
+        needed = set(self.columns)
+        needed.update(field for field, active in (("domain_id", self.domain_ids), ("group", self.group_prefixes),
+                                                  ("country_code", self.countries), ("cidr", self.cidr_within))
+                      if active)
+        return [field for field in CSV_COLUMNS if field in needed]
+
+    def api_filter(self) -> str:
+        """
+        QRadar filter expression of the predicates the API can evaluate, "" if none.
+
+        The group subtree is sent as group = "EMEA" or group LIKE "EMEA.%": "_" is a LIKE
+        wildcard and may be allowed in group names, so the console may return a few more
+        networks, which the local check drops. CIDR containment has no API operator.
+        """
+        terms = []
+        if self.domain_ids:
+            terms.append(_comparison("domain_id", self.domain_ids))
+        if self.countries:
+            terms.append(_comparison("country_code", [_quoted(country) for country in self.countries]))
+        if self.group_prefixes:
+            subtrees = " or ".join(f"group = {_quoted(prefix)} or group LIKE {_quoted(prefix + '.%')}"
+                                   for prefix in self.group_prefixes)
+            terms.append(f"({subtrees})" if terms else subtrees)
+        return " and ".join(terms)
+
+    def query_params(self) -> dict:
+        """filter and fields query parameters of the networks GET (empty if everything is exported)."""
+        params = {}
+        api_filter = self.api_filter()
+        if api_filter:
+            params["filter"] = api_filter
+        fields = self.fields()
+        if fields != CSV_COLUMNS:
+            params["fields"] = ",".join(fields)
+        return params
+
+    def _in_groups(self, group) -> bool:
+        return any(group == prefix or (group.startswith(prefix) and group[len(prefix):len(prefix) + 1] == ".")
+                   for prefix in self.group_prefixes) if isinstance(group, str) else False
+
+    def _in_ranges(self, cidr) -> bool:
+        try:
+            start, end = network_range(cidr)
+        except (InvalidValue, TypeError):
+            # Not an IPv4 network: never inside an IPv4 range
+            return False
+        return any(first <= start and end <= last for first, last in self._ranges)
+
+    def matches(self, entry) -> bool:
+        """
+        Check a network against every predicate.
+
+        :param entry: API dict or Network.
+        :return: True if the export keeps it.
+        """
+        get = entry.get
+        if self.domain_ids and get("domain_id") not in self.domain_ids:
+            return False
+        if self.countries and get("country_code") not in self.countries:
+            return False
+        if self.group_prefixes and not self._in_groups(get("group")):
+            return False
+        if self.cidr_within and not self._in_ranges(get("cidr")):
+            return False
+        return True
+
+    def apply(self, entries: Iterable) -> Iterator:
+        """Networks of `entries` kept by the filter."""
+        return filter(self.matches, entries) if self.selects_rows else iter(entries)
+
+    def project(self, rows: Iterable[tuple]) -> Iterator[tuple]:
+        """Keep the selected columns of CSV rows (tuples in CSV_COLUMNS order)."""
+        if not self.selects_columns:
+            return iter(rows)
+        getter = itemgetter(*(CSV_COLUMNS.index(column) for column in self.columns))
+        if len(self.columns) == 1:
+            return ((value,) for value in map(getter, rows))
+        return map(getter, rows)
+
+    def describe(self) -> str:
+        """Short description of the filter, for messages."""
+        parts = (("domain", self.domain_ids), ("group", self.group_prefixes), ("country", self.countries),
+                 ("within", self.cidr_within), ("columns", self.columns if self.selects_columns else ()))
+        return "; ".join(f"{name} {','.join(map(str, values))}" for name, values in parts if values) or "everything"
@@ -0,0 +1,284 @@
+"""
+   qradarzoldaxgroups.py
+
+   Description: Group tree of a Network Hierarchy. QRadar groups are dotted
+   paths (EMEA.France.Paris); the tree has one node per path component, and
+   every node holds the statistics of its whole subtree: number of networks,
+   IPv4 addresses covered (nested and overlapping networks counted once), and
+   networks per domain and per country. The tree is built from a NetworkTable
+   with counters over its columns and one sweep of the sorted ranges, and it
+   keeps the positions of the networks ordered by group, so that the networks
+   of a subtree are one slice: exporting EMEA.France reads only its networks.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from qradarzoldaxdomains import DomainIndex
+from qradarzoldaxnetindex import sorted_ranges
+from qradarzoldaxnetwork import NetworkTable
+
+# Domains and countries shown on each line of the tree report
+TOP_COUNT = 3
+
+
+class GroupNode:
+    """
+    One component of a group path, with the statistics of its subtree.
+
+    Attributes:
+    -----------
+    name : str
+        Last component of the path ("Paris"), "" for the root.
+    path : str
+        Group path ("EMEA.France.Paris"), "" for the root.
+    depth : int
+        Number of components, 0 for the root.
+    children : dict
+        Component -> child GroupNode.
+    own_networks : int
+        Networks whose group is exactly this path.
+    networks : int
+        Networks of the subtree.
+    addresses : int
+        IPv4 addresses covered by the networks of the subtree, each address counted once.
+    domains, countries : Counter
+        Networks of the subtree per domain_id and per country_code ("" when missing).
+    start, stop : int
+        Slice of GroupTree.order holding the positions of the networks of the subtree.
+    """
+
+    def __init__(self, components: Tuple[str, ...]):
+        self.name = components[-1] if components else ""
+        self.path = ".".join(components)
+        self.depth = len(components)
+        self.children: Dict[str, "GroupNode"] = {}
+        self.own_networks = 0
+        self.networks = 0
+        self.addresses = 0
+        self.domains = Counter()
+        self.countries = Counter()
+        self.start = 0
+        self.stop = 0
+
+    def __repr__(self) -> str:
+        return f"GroupNode({self.path!r}, networks={self.networks}, addresses={self.addresses})"
+
+
+def group_components(group) -> Tuple[str, ...]:
+    """Components of a group path; a network without a group belongs to the root."""
+    return tuple(group.split(".")) if isinstance(group, str) and group else ()
+
+
+class GroupTree:
+    """
+    Prefix tree of the groups of a NetworkTable.
+
+    Attributes:
+    -----------
+    table : NetworkTable
+        The networks.
+    root : GroupNode
+        Node of the whole hierarchy.
+    nodes : dict
+        Tuple of components -> GroupNode, for every group path and every prefix of one.
+    order : array
+        Positions of the networks in the table, ordered by group path (components compared
+        one by one) and then by position: the networks of any subtree are contiguous.
+    """
+
+    def __init__(self, table: NetworkTable):
+        self.table = table
+        self.root = GroupNode(())
+        self.nodes: Dict[Tuple[str, ...], GroupNode] = {(): self.root}
+        self.order = array('L')
+
+    def __len__(self) -> int:
+        """Number of groups (nodes), the root excluded."""
+        return len(self.nodes) - 1
+
+    def _node(self, components: Tuple[str, ...]) -> GroupNode:
+        node = self.nodes.get(components)
+        if node is None:
+            node = self.nodes[components] = GroupNode(components)
+            self._node(components[:-1]).children[components[-1]] = node
+        return node
+
+    def _chain(self, components: Tuple[str, ...]) -> List[GroupNode]:
+        """Node of a path and its ancestors, deepest first, root last."""
+        return [self._node(components[:length]) for length in range(len(components), -1, -1)]
+
+    @classmethod
+    def build(cls, table: NetworkTable) -> "GroupTree":
+        """
+        Build the tree of a table.
+
+        The counts come from Counters over the group, domain and country columns, so
+        the work per network is done in C; the statistics are then added to the nodes
+        once per distinct group. The addresses are counted with one sweep of the ranges
+        sorted by start: each node keeps the last address covered so far, and a range
+        adds only what lies beyond it. A range already covered in its own group is
+        covered in every ancestor, so the walk up the tree stops there.
+
+        :param table: Networks fetched from QRadar (fetch_network_hierarchy) or validated from a CSV file.
+        :return: The GroupTree (the table is not modified).
+        """
+        tree = cls(table)
+        strings = table.strings
+        groups = list(map(strings.__getitem__, table.groups))
+        domains = list(table.domain_ids)
+        countries = list(map(strings.__getitem__, table.country_codes))
+        for position in table.irregular_positions():
+            group = table.value(position, "group")
+            groups[position] = group if isinstance(group, str) else ""
+            domains[position] = table.value(position, "domain_id")
+            country = table.value(position, "country_code")
+            countries[position] = country if isinstance(country, str) else ""
+
+        own = Counter(groups)
+        paths = sorted(own, key=group_components)
+        chains = [tree._chain(group_components(group)) for group in paths]
+        rank = {group: position for position, group in enumerate(paths)}
+        ranks = list(map(rank.__getitem__, groups))
+        tree.order = array('L', sorted(range(len(table)), key=ranks.__getitem__))
+
+        offset = 0
+        for group, chain in zip(paths, chains):
+            count = own[group]
+            chain[0].own_networks = count
+            for node in chain:
+                if not node.networks:
+                    node.start = offset
+                node.networks += count
+                node.stop = offset + count
+            offset += count
+        for (group, domain_id), count in Counter(zip(groups, domains)).items():
+            for node in chains[rank[group]]:
+                node.domains[domain_id] += count
+        for (group, country), count in Counter(zip(groups, countries)).items():
+            for node in chains[rank[group]]:
+                node.countries[country] += count
+
+        # Union of the ranges of each subtree, swept in start order, with nodes numbered for speed
+        nodes = list(tree.nodes.values())
+        number = {id(node): index for index, node in enumerate(nodes)}
+        chain_numbers = [[number[id(node)] for node in chain] for chain in chains]
+        marks, covered = [-1] * len(nodes), [0] * len(nodes)
+        prefixes = table.prefixes
+        ipv4 = None if -1 not in prefixes else [position for position in range(len(table)) if prefixes[position] >= 0]
+        for start, end, position in sorted_ranges(table, ipv4):
+            for index in chain_numbers[ranks[position]]:
+                mark = marks[index]
+                if end <= mark:
+                    break
+                covered[index] += end - (start if start > mark else mark + 1) + 1
+                marks[index] = end
+        for node, addresses in zip(nodes, covered):
+            node.addresses = addresses
+        return tree
+
+    def find(self, path: str) -> Optional[GroupNode]:
+        """Node of a group path ("" for the root), None if no network is in that subtree."""
+        return self.nodes.get(group_components(path.rstrip(".")) if path else ())
+
+    def positions(self, node: GroupNode) -> List[int]:
+        """Positions of the networks of a subtree, in table order (only the subtree is read)."""
+        return sorted(self.order[node.start:node.stop])
+
+    def select(self, paths: Iterable[str]) -> List[int]:
+        """Positions of the networks of several subtrees (e.g. the group prefixes of an ExportFilter), in table order."""
+        slices = sorted((node.start, node.stop) for node in map(self.find, paths) if node is not None)
+        selected = []
+        end = 0
+        for start, stop in slices:
+            # Nested subtrees are slices of each other
+            if stop > end:
+                selected.extend(self.order[max(start, end):stop])
+                end = stop
+        return sorted(selected)
+
+    def iter_subtree(self, node: GroupNode) -> Iterator[dict]:
+        """Yield the networks of a subtree as API network objects, in table order."""
+        api_entry = self.table.api_entry
+        for position in self.positions(node):
+            yield api_entry(position)
+
+    def iter_nodes(self, node: Optional[GroupNode] = None, depth: Optional[int] = None) -> Iterator[GroupNode]:
+        """Yield a node and its descendants depth first, children by name, down to `depth` levels below it."""
+        node = self.root if node is None else node
+        limit = None if depth is None else node.depth + depth
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            yield current
+            if limit is None or current.depth < limit:
+                stack.extend(current.children[name] for name in sorted(current.children, reverse=True))
+
+    def to_dict(self, node: Optional[GroupNode] = None, depth: Optional[int] = None) -> dict:
+        """Statistics of a subtree as a JSON-serializable dict, with its children down to `depth` levels."""
+        node = self.root if node is None else node
+        result = {
+            "group": node.path,
+            "networks": node.networks,
+            "own_networks": node.own_networks,
+            "addresses": node.addresses,
+            "domains": {str(domain_id): count for domain_id, count in node.domains.most_common()},
+            "countries": {country: count for country, count in node.countries.most_common()},
+        }
+        if depth is None or depth > 0:
+            result["children"] = [self.to_dict(node.children[name], None if depth is None else depth - 1)
+                                  for name in sorted(node.children)]
+        return result
+
+    def format_tree(self, node: Optional[GroupNode] = None, depth: Optional[int] = None,
+                    domains: Optional[DomainIndex] = None) -> List[str]:
+        """
+        Lines of the tree report: one line per node, indented by depth, with its statistics.
+
+        :param node: Node at the top of the report, defaults to the root.
+        :param depth: Levels shown below it, None for all.
+        :param domains: Domains of the console, to show their names.
+        """
+        node = self.root if node is None else node
+        labels = []
+        for current in self.iter_nodes(node, depth):
+            label = current.path if current is node else current.name
+            if not current.depth:
+                label = "(all)"
+            elif not label:
+                # Empty component, e.g. in "A..B"
+                label = '""'
+            labels.append(("  " * (current.depth - node.depth) + label, current))
+        width = max(len(label) for label, _ in labels)
+        return [f"{label:<{width}}  {format_node(current, domains)}" for label, current in labels]
+
+
+def format_node(node: GroupNode, domains: Optional[DomainIndex] = None, top: int = TOP_COUNT) -> str:
+    """Statistics of one node on one line: networks, addresses, main domains and countries."""
+
+    def breakdown(counts: Counter, label) -> str:
+        items = [f"{label(key)} {count}" for key, count in counts.most_common(top)]
+        if len(counts) > top:
+            items.append(f"+{len(counts) - top}")
+        return ", ".join(items)
+
+    domain_label = (lambda domain_id: domains.name(domain_id)) if domains is not None else str
+    return (f"{node.networks:>8} networks {node.addresses:>12} addresses  "
+            f"domains: {breakdown(node.domains, domain_label)}  "
+            f"countries: {breakdown(node.countries, lambda country: country or 'N/A')}")
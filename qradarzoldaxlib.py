@@ -5,6 +5,10 @@
    It offers tools for reading configuration files, preparing headers, making GET and PUT requests,
    and fetching application IDs.
 
+   Importing it is cheap: config.txt is read on first use (get_config), error.log is
+   only created when an error is logged, and requests / urllib3 are imported when
+   the first connection to QRadar is made.
+
    Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
 
    Licensed under the Apache License, Version 2.0 (the "License");
@@ -22,25 +26,143 @@
 """
 
 
-import requests
 import json
-import urllib3
 import logging
 import os
+import random
+import sys
+import threading
+import time
+import re
+import codecs
+import zlib
+import qradarzoldaxcache
+import qradarzoldaxmetrics
+from datetime import datetime, timezone
 from typing import Union
 from typing import Optional
+from typing import Iterable, Iterator
 
 # Constants for Default Configuration Values
 DEFAULT_VERSION = "15.0"
 DEFAULT_ACCEPT = "application/json"
 CONFIG_FILE = "config.txt"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 300.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+
+# Size of the chunks read from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = ' \t\n\r'
+JSON_DELIMITERS = JSON_WHITESPACE + ',]'
+
+# Size of the chunks of streamed request bodies, and gzip level of compressed ones
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_GZIP_LEVEL = 6
+UPLOAD_COMPRESSIONS = ("off", "gzip", "auto")
+
+# QRadar answers ranged list requests with "Content-Range: items 0-49/1234"
+CONTENT_RANGE_PATTERN = re.compile(r'^items\s+(?:\d+-\d+|\*)/(\d+)$')
+
+class BackgroundLogHandler(logging.Handler):
+    """
+    Logging handler that hands the records to a background thread, which writes them to a file handler.
+
+    Logging an error then costs a queue put instead of a write to error.log, and the
+    thread writes the records queued meanwhile with one write and one flush. It is
+    started on the first record and drained at exit (or with flush()). In a child
+    process (multiprocessing workers, which exit without running atexit), records are
+    written directly.
+    """
+
+    # Most records written by one write()
+    BATCH_SIZE = 1000
+
+    def __init__(self, target: logging.FileHandler):
+        super().__init__()
+        self.target = target
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        import atexit
+        import queue
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="nhsuite-log", daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+        atexit.register(self.close)
+
+    def emit(self, record: logging.LogRecord):
+        multiprocessing = sys.modules.get("multiprocessing")
+        if multiprocessing is not None and multiprocessing.parent_process() is not None:
+            self.target.handle(record)
+            return
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        # Resolve what may change before the record is written by the thread
+        if record.args:
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        self._queue.put_nowait(record)
+
+    def _run(self):
+        import queue
+        records_queue, target = self._queue, self.target
+        running = True
+        while running:
+            records = [records_queue.get()]
+            try:
+                while len(records) < self.BATCH_SIZE:
+                    records.append(records_queue.get_nowait())
+            except queue.Empty:
+                pass
+            if records[-1] is None:
+                # Sentinel of close()
+                running = False
+            lines = "".join(target.format(record) + target.terminator
+                            for record in records if record is not None and target.filter(record))
+            try:
+                if lines:
+                    with target.lock:
+                        if target.stream is None:
+                            target.stream = target._open()
+                        target.stream.write(lines)
+                        target.stream.flush()
+            except Exception:
+                self.handleError(records[0])
+            finally:
+                for _ in records:
+                    records_queue.task_done()
 
-# Desactivate warning ssl
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    def flush(self):
+        """Wait until every queued record is written."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
 
-# Set up logging
+    def close(self):
+        if self._thread is not None and self._pid == os.getpid():
+            thread, self._thread = self._thread, None
+            self._queue.put_nowait(None)
+            thread.join()
+        self.target.close()
+        super().close()
+
+
+# Set up logging (error.log is opened on the first logged error, and written by a background thread)
 LOG_FILENAME = 'error.log'
-logging.basicConfig(filename=LOG_FILENAME, level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+_log_handler = logging.FileHandler(LOG_FILENAME, delay=True)
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+logging.basicConfig(level=logging.ERROR, handlers=[BackgroundLogHandler(_log_handler)])
 logger = logging.getLogger()
 
 def read_config(filename: str = CONFIG_FILE) -> dict:
@@ -80,55 +202,495 @@ def read_config(filename: str = CONFIG_FILE) -> dict:
         print(f"Unexpected error occurred while reading {filename} : {e}")
     return {}
 
-config = {**read_config()}
+_config = None
+_config_lock = threading.Lock()
+
+def get_config() -> dict:
+    """
+    Configuration read from config.txt, read on the first call and shared afterwards.
+    :return: The configuration (empty dict if config.txt is missing or invalid, see read_config)
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = {**read_config()}
+    return _config
+
+def set_config(conf: Optional[dict]):
+    """
+    Replace the shared configuration (e.g. one built by a wrapper), None to read config.txt again on next use.
+    :param conf: Configuration to use as if read from config.txt
+    """
+    global _config
+    with _config_lock:
+        _config = conf
+
+def __getattr__(name: str):
+    # qradarzoldaxlib.config stays available, read on first access
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def get_qradar_headers() -> dict:
+def get_qradar_headers(conf: Optional[dict] = None) -> dict:
     """
     Prepare headers for QRadar HTTP request.
+    :param conf: Configuration to use, defaults to the one read from config.txt
     :return: dict containing headers
     """
+    conf = get_config() if conf is None else conf
     return {
-        "SEC": config['auth'],
-        "Version": config.get('Version', "15.0"),
-        "Accept": config.get('Accept', "application/json")
+        "SEC": conf['auth'],
+        "Version": conf.get('Version', "15.0"),
+        "Accept": conf.get('Accept', "application/json")
     }
 
-def get_verify_option() -> Union[bool, str]:
+def get_verify_option(conf: Optional[dict] = None) -> Union[bool, str]:
     """
     Returns the appropriate value for the 'verify' parameter in requests.
     This could be a boolean (True/False) or a string path to a custom certificate.
+    :param conf: Configuration to use, defaults to the one read from config.txt
     """
+    conf = get_config() if conf is None else conf
     # If verify_ssl is explicitly set to False, return False immediately.
-    if config.get('verify_ssl') == False:
+    if conf.get('verify_ssl') == False:
         return False
 
     # If verify_ssl is set to True and ssl_cert_path exists in the config and isn't None or empty string, return its value.
-    if config.get('verify_ssl') == 'True' and config.get('ssl_cert_path') != 'None':
-        return config['ssl_cert_path']
+    if conf.get('verify_ssl') == 'True' and conf.get('ssl_cert_path') != 'None':
+        return conf['ssl_cert_path']
 
     # In all other cases, return False.
     return False
 
-def make_request(url: str, method: str = "GET", params: Optional[dict] = None) -> dict:
+def _config_number(conf: dict, name: str, default: float, cast=float):
+    """
+    Read a numeric option from the configuration, falling back to the default.
+    Values may be given as JSON numbers or as strings (e.g. "10").
+    """
+    value = conf.get(name, default)
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        logger.error(f"Invalid value {value!r} for {name} in {CONFIG_FILE}, using default {default}")
+        return cast(default)
+
+def _retry_after_seconds(response) -> Optional[float]:
+    """
+    Parse the Retry-After header of a response (delay in seconds or HTTP date).
+    :param response: requests.Response received from QRadar
+    :return: Number of seconds to wait, or None if the header is absent or invalid
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class QRadarTransport:
+    """
+    Shared HTTP transport to a QRadar console.
+
+    A single requests.Session keeps TLS connections alive between calls, the
+    QRadar headers and verify option are computed once, and requests answered
+    with 429/502/503/504 (or failing at connection level, TLS errors excepted) are retried with
+    exponential backoff and full jitter, honoring the Retry-After header.
+
+    GET responses of the endpoints listed in the cache TTLs are served from the
+    on-disk response cache while fresh (see qradarzoldaxcache), and a successful
+    PUT invalidates the cached responses of the API section it wrote to.
+
+    Options read from config.txt (all optional):
+    - pool_size: number of keep-alive connections kept per host (default 10)
+    - connect_timeout / read_timeout: timeouts in seconds (default 10 / 300)
+    - max_retries: retries after the first attempt (default 3)
+    - backoff_factor / backoff_max: backoff base and cap in seconds (default 0.5 / 30)
+    - max_concurrency: requests in flight at the same time to this console (default pool_size)
+    - cache: "off" disables the response cache (default on)
+    - cache_dir / cache_max_mb / cache_ttl: cache location, size bound, and
+      endpoint path -> seconds overrides of the default TTLs
+    - upload_compression: "gzip" sends PUT bodies gzip-encoded, "auto" tries
+      gzip and falls back to plain bodies if the console rejects it, "off" (default)
+    """
+
+    RETRY_STATUS = (429, 502, 503, 504)
+
+    def __init__(self, conf: Optional[dict] = None):
+        conf = get_config() if conf is None else conf
+        self.pool_size = _config_number(conf, 'pool_size', DEFAULT_POOL_SIZE, int)
+        self.timeout = (_config_number(conf, 'connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                        _config_number(conf, 'read_timeout', DEFAULT_READ_TIMEOUT))
+        self.max_retries = max(0, _config_number(conf, 'max_retries', DEFAULT_MAX_RETRIES, int))
+        self.backoff_factor = _config_number(conf, 'backoff_factor', DEFAULT_BACKOFF_FACTOR)
+        self.backoff_max = _config_number(conf, 'backoff_max', DEFAULT_BACKOFF_MAX)
+        # Limits the load put on one console, whatever the number of threads using the transport
+        self.slots = threading.BoundedSemaphore(max(1, _config_number(conf, 'max_concurrency', self.pool_size, int)))
+
+        import requests
+        import urllib3
+        # Desactivate warning ssl
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(get_qradar_headers(conf))
+        # Passed on each request: a session-level verify would be overridden by REQUESTS_CA_BUNDLE
+        self.verify = get_verify_option(conf)
+        self.cache = _build_cache(conf)
+        self.upload_compression = str(conf.get('upload_compression', 'off')).lower()
+        if self.upload_compression not in UPLOAD_COMPRESSIONS:
+            logger.error(f"upload_compression must be one of {', '.join(UPLOAD_COMPRESSIONS)}, using off")
+            self.upload_compression = "off"
+        # With "auto": None until a compressed upload was accepted (True) or rejected (False)
+        self.accepts_gzip = None
+
+    def _backoff(self, attempt: int, response=None) -> float:
+        """Delay before the next attempt: Retry-After if given, else capped exponential backoff with full jitter."""
+        if response is not None:
+            retry_after = _retry_after_seconds(response)
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def request(self, url: str, method: str = "GET", params: Optional[dict] = None, data=None,
+                headers: Optional[dict] = None, stream: bool = False, fresh: bool = False):
+        """
+        Send a request through the pooled session, retrying transient failures.
+        GET responses of cached endpoints are served from the response cache while fresh.
+        :param url: URL to make the request to
+        :param method: HTTP method ("GET" or "PUT")
+        :param params: Query string parameters
+        :param data: Request body, or a callable returning a fresh body (e.g. a generator of bytes) for each attempt
+        :param headers: Extra headers for this request only
+        :param stream: Do not read the body before returning
+        :param fresh: Always ask QRadar (the response still refreshes the cache)
+        :return: requests.Response (raise_for_status already applied)
+        """
+        cache = self.cache
+        if method != "GET" or cache is None or not cache.ttl(url):
+            response = self._send(url, method, params, data, headers, stream)
+            if method != "GET" and cache is not None:
+                cache.invalidate(url)
+            return response
+
+        key = cache.key(url, params, {**self.session.headers, **(headers or {})})
+        meta = None if fresh else cache.lookup(key)
+        if meta is not None and meta["age"] < cache.ttl(url):
+            return cache.open_response(key, meta)
+
+        conditional = cache.validators(meta) if meta is not None else {}
+        response = self._send(url, method, params, data, {**(headers or {}), **conditional}, stream)
+        if conditional and response.status_code == 304:
+            response.close()
+            cache.touch(key, meta)
+            return cache.open_response(key, meta)
+        return cache.store(key, response)
+
+    def _send(self, url: str, method: str, params: Optional[dict], data, headers: Optional[dict], stream: bool):
+        """Send one request, retrying transient failures (see request)."""
+        import requests
+        attempt = 0
+        while True:
+            try:
+                # A streamed body is consumed by the attempt: callables rebuild it for each retry
+                body = data() if callable(data) else data
+                if body is not None and qradarzoldaxmetrics.enabled():
+                    if isinstance(body, (bytes, str)):
+                        qradarzoldaxmetrics.count("http.bytes_sent", len(body.encode('utf-8') if isinstance(body, str) else body))
+                    else:
+                        body = qradarzoldaxmetrics.counted_bytes(body, "http.bytes_sent")
+                with self.slots, qradarzoldaxmetrics.phase("http.request"):
+                    response = self.session.request(method, url, params=params, data=body, headers=headers,
+                                                    verify=self.verify, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                qradarzoldaxmetrics.count("http.errors")
+                # SSLError is a ConnectionError, but a bad certificate does not get better with retries
+                if isinstance(e, requests.exceptions.SSLError) or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.error(f"Request to {url} failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+            else:
+                qradarzoldaxmetrics.count(f"http.status.{response.status_code}")
+                if not stream and qradarzoldaxmetrics.enabled():
+                    qradarzoldaxmetrics.count("http.bytes_received", len(response.content))
+                if response.status_code not in self.RETRY_STATUS or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+                delay = self._backoff(attempt, response)
+                response.close()
+                logger.error(f"QRadar answered {response.status_code} for {url}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+            qradarzoldaxmetrics.count("http.retries")
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+
+def parse_content_range(value: Optional[str]) -> Optional[int]:
+    """
+    Extract the total number of items from a QRadar Content-Range header.
+    :param value: Header value, e.g. "items 0-49/1234"
+    :return: Total number of items, or None if the header is absent or has no total
+    """
+    if not value:
+        return None
+    match = CONTENT_RANGE_PATTERN.match(value.strip())
+    if not match:
+        return None
+    return int(match.group(1))
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator:
     """
-    Make a request (GET/PUT) to the specified URL.
+    Incrementally decode a JSON array received in chunks, yielding its items one by one.
+
+    Only the undecoded tail of the body is kept in memory, so a list endpoint
+    can be consumed with memory bounded by the size of its largest item.
+
+    :param chunks: Iterable of raw body chunks (e.g. response.iter_content()).
+    :return: Iterator over the decoded array items.
+    :raises ValueError: If the body is not a JSON array, is truncated, or has data after the array.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer, pos = "", 0
+    started = finished = exhausted = False
+
+    while True:
+        # Skip whitespace and separators up to the next item
+        while pos < len(buffer) and not finished:
+            char = buffer[pos]
+            if char in JSON_WHITESPACE:
+                pos += 1
+            elif not started:
+                if char != '[':
+                    raise ValueError(f"Unexpected data format received: {buffer[pos:pos + 200]}")
+                started = True
+                pos += 1
+            elif char == ',':
+                pos += 1
+            elif char == ']':
+                finished = True
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if exhausted:
+                        raise
+                    break  # item split across chunks, read more
+                if not exhausted and not isinstance(item, (dict, list, str)) \
+                        and (end == len(buffer) or buffer[end] not in JSON_DELIMITERS):
+                    break  # a number or literal may continue in the next chunk
+                pos = end
+                yield item
+
+        if finished:
+            # Read the body to its end (so a cached copy is complete), only whitespace may follow
+            tail = buffer[pos + 1:]
+            for chunk in chunks:
+                tail += utf8.decode(chunk)
+                if tail.strip(JSON_WHITESPACE):
+                    break
+                tail = ""
+            tail += utf8.decode(b"", final=True)
+            if tail.strip(JSON_WHITESPACE):
+                raise ValueError(f"Unexpected data after the JSON array: {tail.strip()[:200]}")
+            return
+        if exhausted:
+            raise ValueError("Truncated JSON array in response")
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            tail = utf8.decode(b"", final=True)
+        else:
+            tail = utf8.decode(chunk)
+        buffer = buffer[pos:] + tail
+        pos = 0
+
+def encode_json_array(items: Iterable, compress: bool = False, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Incrementally encode items as a JSON array, yielding body chunks of about chunk_size bytes.
+
+    Only one chunk is held at a time, so a request body built from a generator of
+    items never exists as a whole in memory.
+
+    :param items: Iterable of JSON-serializable items.
+    :param compress: Gzip-compress the chunks (for "Content-Encoding: gzip").
+    :param chunk_size: Size of the uncompressed chunks.
+    :return: Iterator over the body chunks.
+    """
+    compressor = zlib.compressobj(UPLOAD_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    encode = json.JSONEncoder().encode
+    parts, size, separator = ["["], 1, ""
+    for item in items:
+        text = separator + encode(item)
+        separator = ", "
+        parts.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            data = "".join(parts).encode('utf-8')
+            parts, size = [], 0
+            if compressor is not None:
+                data = compressor.compress(data)
+                if not data:
+                    continue
+            yield data
+    parts.append("]")
+    data = "".join(parts).encode('utf-8')
+    yield compressor.compress(data) + compressor.flush() if compressor is not None else data
+
+def send_json_array(url: str, items_factory, transport: QRadarTransport) -> int:
+    """
+    PUT a JSON array streamed from a generator of items, without building the body in memory.
+
+    The body is sent with chunked transfer encoding, gzip-encoded according to the
+    upload_compression option of the console. QRadar's answer (the list of staged
+    items) is decoded incrementally and only counted.
+
+    :param url: URL to make the request to
+    :param items_factory: Callable returning a new iterable of the items, called for each attempt
+        (an exception raised by the iterable aborts the upload, so nothing is staged)
+    :param transport: Transport of the console
+    :return: Number of items in QRadar's answer
+    :raises: requests.RequestException if the request fails, or the exception raised by the items
+    """
+    import requests
+    compress = transport.upload_compression == "gzip" or \
+        (transport.upload_compression == "auto" and transport.accepts_gzip is not False)
+
+    def body() -> Iterator[bytes]:
+        items = qradarzoldaxmetrics.timed(items_factory(), "upload.items")
+        return qradarzoldaxmetrics.timed(encode_json_array(items, compress), "json.encode", count_items=False)
+
+    while True:
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        try:
+            with qradarzoldaxmetrics.phase("upload") as timer:
+                response = transport.request(url, "PUT", data=body, headers=headers, stream=True)
+                with response:
+                    chunks = qradarzoldaxmetrics.counted_bytes(response.iter_content(STREAM_CHUNK_SIZE), "http.bytes_received")
+                    count = sum(1 for _ in iter_json_array(chunks))
+                timer.items = count
+            if compress and transport.upload_compression == "auto":
+                transport.accepts_gzip = True
+            return count
+
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if compress and transport.upload_compression == "auto" and not transport.accepts_gzip and status in (400, 415):
+                logger.error(f"QRadar answered {status} to a gzip-encoded body, sending it uncompressed")
+                transport.accepts_gzip = False
+                compress = False
+                continue
+            raise
+
+def put_json_array(url: str, items_factory, conf: Optional[dict] = None,
+                   transport: Optional[QRadarTransport] = None) -> Optional[int]:
+    """
+    PUT a JSON array streamed from a generator of items (see send_json_array), reporting errors.
+
+    :param url: URL to make the request to
+    :param items_factory: Callable returning a new iterable of the items, called for each attempt
+    :param conf: Configuration of the console, defaults to the one read from config.txt
+    :param transport: Transport to use instead of the shared transport of the console
+    :return: Number of items in QRadar's answer, None on error
+    """
+    import requests
+    try:
+        return send_json_array(url, items_factory, get_transport(conf) if transport is None else transport)
+    except requests.RequestException as e:
+        logger.error(f"Error occurred during request: {e}")
+        print(f"Error occurred during request: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"An unexpected error occurred: {e}")
+        print(f"An unexpected error occurred: {e}")
+        return None
+
+def _build_cache(conf: dict) -> Optional[qradarzoldaxcache.ResponseCache]:
+    """
+    Create the response cache from the configuration and the command-line options.
+    :return: ResponseCache, or None if caching is disabled
+    """
+    if not _cache_options["enabled"] or str(conf.get('cache', 'on')).lower() == "off":
+        return None
+    ttls = dict(qradarzoldaxcache.DEFAULT_CACHE_TTLS)
+    overrides = conf.get('cache_ttl', {})
+    if isinstance(overrides, dict):
+        ttls.update((path.rstrip('/'), _config_number(overrides, path, 0, int)) for path in overrides)
+    else:
+        logger.error(f"Invalid value {overrides!r} for cache_ttl in {CONFIG_FILE}, using the default TTLs")
+    max_mb = _config_number(conf, 'cache_max_mb', qradarzoldaxcache.DEFAULT_CACHE_MAX_MB)
+    return qradarzoldaxcache.ResponseCache(conf.get('cache_dir', qradarzoldaxcache.DEFAULT_CACHE_DIR),
+                                           int(max_mb * 1024 * 1024), ttls, refresh=_cache_options["refresh"])
+
+# Set from the command line (--no-cache / --refresh) before the transport is created
+_cache_options = {"enabled": True, "refresh": False}
+
+def configure_cache(enabled: bool = True, refresh: bool = False):
+    """
+    Set the response cache mode of the transport created by get_transport().
+    :param enabled: False to send every request to QRadar without caching
+    :param refresh: True to ignore cached responses (fresh responses are still cached)
+    """
+    _cache_options["enabled"] = enabled
+    _cache_options["refresh"] = refresh
+
+# One transport per console, keyed by (ip_QRadar, auth)
+_transports = {}
+_transport_lock = threading.Lock()
+
+def get_transport(conf: Optional[dict] = None) -> QRadarTransport:
+    """
+    Return the shared transport of a console, creating it on first use.
+    :param conf: Configuration of the console, defaults to the one read from config.txt
+    """
+    conf = get_config() if conf is None else conf
+    with _transport_lock:
+        key = (conf.get('ip_QRadar'), conf.get('auth'))
+        transport = _transports.get(key)
+        if transport is None:
+            transport = _transports[key] = QRadarTransport(conf)
+        return transport
+
+def make_request(url: str, method: str = "GET", params: Optional[dict] = None, conf: Optional[dict] = None,
+                 fresh: bool = False, transport: Optional[QRadarTransport] = None) -> dict:
+    """
+    Make a request (GET/PUT) to the specified URL through the shared transport.
     :param url: URL to make the request to
     :param method: HTTP method ("GET" or "PUT")
-    :param params: Parameters to be sent with the request
+    :param params: Parameters to be sent with the request (query string for GET, body for PUT)
+    :param conf: Configuration of the console, defaults to the one read from config.txt
+    :param fresh: For a GET, ask QRadar even if the response is in the response cache
+    :param transport: Transport to use instead of the shared transport of the console
     :return: JSON response as a dict if successful, empty dict otherwise
     """
+    import requests
     if method not in ["GET", "PUT"]:
         logger.error(f"Unsupported HTTP method: {method}")
         return {}
 
-    verify_option = get_verify_option()
     try:
+        transport = get_transport(conf) if transport is None else transport
         if method == "GET":
-            response = requests.get(url, headers=get_qradar_headers(), params=params, verify=verify_option)
+            response = transport.request(url, "GET", params=params, fresh=fresh)
         else:
-            response = requests.put(url, headers=get_qradar_headers(), data=params, verify=verify_option)
+            response = transport.request(url, "PUT", data=params)
 
-        response.raise_for_status()
         return response.json()
 
     except (requests.RequestException, requests.exceptions.HTTPError) as e:
@@ -140,14 +702,16 @@ def make_request(url: str, method: str = "GET", params: Optional[dict] = None) -
         print(f"An unexpected error occurred: {e}")
         return {}
 
-def get_app_id(app_name: str = "QRadar Use Case Manager") -> str:
+def get_app_id(app_name: str = "QRadar Use Case Manager", conf: Optional[dict] = None) -> str:
     """
     Fetch the application ID for a given app name from QRadar.
     :param app_name: Name of the app to fetch the ID for
+    :param conf: Configuration of the console, defaults to the one read from config.txt
     :return: Application ID as a string
     """
-    url = f"https://{config['ip_QRadar']}/api/gui_app_framework/application_definitions"
-    apps = make_request(url)
+    conf = get_config() if conf is None else conf
+    url = f"https://{conf['ip_QRadar']}/api/gui_app_framework/application_definitions"
+    apps = make_request(url, conf=conf)
     # Add a condition to prevent potential infinite loop
     if not isinstance(apps, list):
         return ""
@@ -157,10 +721,12 @@ def get_app_id(app_name: str = "QRadar Use Case Manager") -> str:
             return app.get("application_definition_id", "")
     return ""
 
-def get_system_info() -> dict:
+def get_system_info(conf: Optional[dict] = None) -> dict:
     """
     Fetch the system information from the `/api/system/about` API endpoint in QRadar.
 
+    :param conf: Configuration of the console, defaults to the one read from config.txt
+
     :return: JSON response as a dict containing system information if successful,
              empty dict otherwise.
 
@@ -175,14 +741,22 @@ def get_system_info() -> dict:
       "external_version": "7.5.0"
     }
     """
-    url = f"https://{config['ip_QRadar']}/api/system/about"
-    return make_request(url)
-
-def print_qradar_version():
-    """Retrieve and print QRadar system information."""
-    system_info = get_system_info()
-    print(f"QRadar System Information: {config['ip_QRadar']}")
-    print(f"release_name: {system_info.get('release_name', 'N/A')}")
-    print(f"build_version: {system_info.get('build_version', 'N/A')}")
-    print(f"fips_enabled: {system_info.get('fips_enabled', 'N/A')}")
-    print(f"external_version: {system_info.get('external_version', 'N/A')}")
+    conf = get_config() if conf is None else conf
+    url = f"https://{conf['ip_QRadar']}/api/system/about"
+    return make_request(url, conf=conf)
+
+def print_qradar_version(conf: Optional[dict] = None, file=None) -> dict:
+    """
+    Retrieve and print QRadar system information.
+    :param conf: Configuration of the console, defaults to the one read from config.txt
+    :param file: Stream to print to, defaults to stdout
+    :return: The system information (empty dict on error)
+    """
+    conf = get_config() if conf is None else conf
+    system_info = get_system_info(conf)
+    print(f"QRadar System Information: {conf['ip_QRadar']}", file=file)
+    print(f"release_name: {system_info.get('release_name', 'N/A')}", file=file)
+    print(f"build_version: {system_info.get('build_version', 'N/A')}", file=file)
+    print(f"fips_enabled: {system_info.get('fips_enabled', 'N/A')}", file=file)
+    print(f"external_version: {system_info.get('external_version', 'N/A')}", file=file)
+    return system_info
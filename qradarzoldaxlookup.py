@@ -0,0 +1,364 @@
+"""
+   qradarzoldaxlookup.py
+
+   Description: Bulk IP to network lookup with longest-prefix match.
+   The Network Hierarchy (from QRadar or from an exported CSV) is flattened once
+   into sorted, disjoint integer ranges, each owned by the most specific network
+   covering it. A lookup is then a binary search (bisect) on an array of range
+   starts. Built indexes are cached on disk so repeated runs do not rebuild them.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import csv
+import hashlib
+import os
+import pickle
+import socket
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_right
+from itertools import islice, repeat
+from operator import rshift
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from qradarzoldaxnetindex import network_range
+from qradarzoldaxvalidator import CSV_COLUMNS, InvalidValue
+
+# Bump when the pickled index layout changes
+INDEX_FORMAT = 1
+DEFAULT_CACHE_DIR = ".nhsuite_cache"
+# Indexes built from the live hierarchy are rebuilt after this many seconds
+DEFAULT_INDEX_TTL = 3600
+
+MAX_ADDRESS = 0xFFFFFFFF
+# Segments are bucketed by /16 to narrow the binary searches
+BUCKET_SHIFT = 16
+BUCKETS = 1 << (32 - BUCKET_SHIFT)
+
+LOOKUP_COLUMNS = ["ip", "group", "name", "cidr", "domain_id", "country_code"]
+NOT_FOUND = ("N/A",) * (len(LOOKUP_COLUMNS) - 1)
+
+_inet_pton = socket.inet_pton
+_AF_INET = socket.AF_INET
+
+
+def ip_to_int(ip: str) -> int:
+    """
+    Convert a dotted IPv4 address to an integer.
+
+    :raises OSError: If the string is not a dotted-quad IPv4 address.
+    """
+    return int.from_bytes(_inet_pton(_AF_INET, ip), 'big')
+
+
+class LookupIndex:
+    """
+    Longest-prefix-match index over a Network Hierarchy.
+
+    The whole IPv4 space is cut into contiguous segments (starts[i] to starts[i + 1] - 1),
+    each owned by the most specific network covering it, or by no network (-1).
+    A /16 bucket table narrows each binary search to the few segments of the
+    address's /16, and batches are resolved with map() chains so that the
+    per-address work stays in C.
+
+    Attributes:
+    -----------
+    starts : array
+        First address of each segment, sorted; starts[0] is 0.
+    owners : array
+        Index in `networks` of the owner of each segment, -1 when no network covers it.
+    networks : list
+        (group, name, cidr, domain_id, country_code) for each network.
+    skipped : int
+        Entries ignored while building (no valid IPv4 CIDR).
+    """
+
+    def __init__(self, starts: array, owners: array, networks: List[tuple], skipped: int = 0):
+        self.starts = starts
+        self.owners = owners
+        self.networks = networks
+        self.skipped = skipped
+        self._build_buckets()
+        self._segment_rows = None
+
+    @classmethod
+    def build(cls, entries: Iterable[dict]) -> "LookupIndex":
+        """
+        Build the index from network entries (API format or exported CSV rows).
+
+        Networks are sorted by (start, widest first) and swept with a stack of open
+        networks; each time the innermost open network changes, the range covered so
+        far is emitted with its owner, so nested networks split their parents.
+        """
+        networks, ranges = [], []
+        skipped = 0
+        for entry in entries:
+            try:
+                start, end = network_range(str(entry.get("cidr") or "").strip())
+            except InvalidValue:
+                skipped += 1
+                continue
+            ranges.append((start, -end, len(networks)))
+            networks.append(tuple(_field(entry.get(key)) for key in LOOKUP_COLUMNS[1:]))
+        ranges.sort()
+
+        starts, owners = array('I'), array('i')
+
+        def emit(first, last, owner):
+            if first <= last and not (owners and owners[-1] == owner):
+                starts.append(first)
+                owners.append(owner)
+
+        stack: List[Tuple[int, int]] = []  # (end, owner) of the open networks, innermost last
+        cursor = 0
+        for start, negative_end, owner in ranges:
+            while stack and stack[-1][0] < start:
+                end, top = stack.pop()
+                emit(cursor, end, top)
+                cursor = end + 1
+            emit(cursor, start - 1, stack[-1][1] if stack else -1)
+            cursor = start
+            stack.append((-negative_end, owner))
+        while stack:
+            end, top = stack.pop()
+            emit(cursor, end, top)
+            cursor = end + 1
+        emit(cursor, MAX_ADDRESS, -1)
+
+        return cls(starts, owners, networks, skipped)
+
+    def _build_buckets(self):
+        """For each /16, the slice of segments to search: [bucket_lo[k], bucket_hi[k])."""
+        starts, count = self.starts, len(self.starts)
+        self.bucket_lo = array('I', bytes(4 * BUCKETS))
+        self.bucket_hi = array('I', bytes(4 * BUCKETS))
+        lo = hi = 0
+        for bucket in range(BUCKETS):
+            first, last = bucket << BUCKET_SHIFT, ((bucket + 1) << BUCKET_SHIFT) - 1
+            while lo < count and starts[lo] <= first:
+                lo += 1
+            while hi < count and starts[hi] <= last:
+                hi += 1
+            self.bucket_lo[bucket], self.bucket_hi[bucket] = lo, hi
+
+    def __len__(self) -> int:
+        return len(self.networks)
+
+    def lookup(self, ip: str) -> Optional[tuple]:
+        """
+        Find the most specific network containing an IPv4 address.
+
+        :return: (group, name, cidr, domain_id, country_code), or None if no network matches.
+        :raises OSError: If the address is not a valid IPv4 address.
+        """
+        address = ip_to_int(ip)
+        bucket = address >> BUCKET_SHIFT
+        owner = self.owners[bisect_right(self.starts, address, self.bucket_lo[bucket], self.bucket_hi[bucket]) - 1]
+        return None if owner < 0 else self.networks[owner]
+
+    def lookup_many(self, ips: List[str]) -> List[Optional[tuple]]:
+        """Look up a batch of addresses; invalid or unmatched addresses give None."""
+        results = []
+        for ip in ips:
+            try:
+                results.append(self.lookup(ip))
+            except (OSError, ValueError):
+                results.append(None)
+        return results
+
+    def format_batch(self, ips: List[str]) -> str:
+        """
+        Look up a batch of addresses and return the CSV lines "ip,group,name,cidr,domain_id,country_code".
+
+        Every step (parsing, bucket, binary search, row formatting) is a map() over the
+        batch, with no Python code run per address. If the batch holds an invalid
+        address, it is resolved address by address instead.
+        """
+        if self._segment_rows is None:
+            rows = list(map(_csv_suffix, self.networks))
+            not_found = _csv_suffix(NOT_FOUND)
+            # Shifted by one so that the bisect_right result indexes it directly
+            self._segment_rows = [not_found] + [rows[owner] if owner >= 0 else not_found for owner in self.owners]
+        try:
+            addresses = list(map(int.from_bytes, map(_inet_pton, repeat(_AF_INET), ips), repeat('big')))
+        except (OSError, ValueError):
+            not_found = _csv_suffix(NOT_FOUND)
+            return "".join(_csv_prefix(ip) + (_csv_suffix(network) if network else not_found)
+                           for ip, network in zip(ips, self.lookup_many(ips)))
+        buckets = list(map(rshift, addresses, repeat(BUCKET_SHIFT)))
+        positions = map(bisect_right, repeat(self.starts), addresses,
+                        map(self.bucket_lo.__getitem__, buckets), map(self.bucket_hi.__getitem__, buckets))
+        return "".join(map(str.__add__, ips, map(self._segment_rows.__getitem__, positions)))
+
+    # Disk cache
+
+    def save(self, path: str, source_key: str):
+        """Write the index to `path` atomically, tagged with the key of its source (directory created private)."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        state = {"format": INDEX_FORMAT, "source": source_key, "created": time.time(),
+                 "starts": self.starts, "owners": self.owners,
+                 "networks": self.networks, "skipped": self.skipped}
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".lookup-")
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str, source_key: str, max_age: Optional[float] = None) -> Optional["LookupIndex"]:
+        """
+        Load a cached index if it matches the source key and is not older than max_age seconds.
+
+        The file is unpickled only if it and its directory belong to the current user and
+        are not writable by others: the cache directory is relative to the working directory.
+
+        :return: The index, or None if there is no usable cache.
+        """
+        try:
+            with open(path, 'rb') as file:
+                if not (_private(os.fstat(file.fileno())) and _private(os.stat(os.path.dirname(os.path.abspath(path))))):
+                    return None
+                state = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return None
+        if not isinstance(state, dict) or state.get("format") != INDEX_FORMAT or state.get("source") != source_key:
+            return None
+        if max_age is not None and time.time() - state.get("created", 0) > max_age:
+            return None
+        return cls(state["starts"], state["owners"], state["networks"], state.get("skipped", 0))
+
+
+def _private(status: os.stat_result) -> bool:
+    """True if a file belongs to the current user and only they can write it (always True without uids)."""
+    if not hasattr(os, "getuid"):
+        return True
+    return status.st_uid == os.getuid() and not status.st_mode & 0o022
+
+
+class _Echo:
+    """File-like object whose write() returns its argument, so csv.writer.writerow() returns the line."""
+
+    @staticmethod
+    def write(line: str) -> str:
+        return line
+
+
+# Formats CSV lines with the csv module quoting rules
+_csv_writer = csv.writer(_Echo(), lineterminator="\n")
+_csv_line = _csv_writer.writerow
+
+
+def _csv_suffix(network: tuple) -> str:
+    """',group,name,cidr,domain_id,country_code\\n' for a network."""
+    return "," + _csv_line(network)
+
+
+def _csv_prefix(ip: str) -> str:
+    """The input address as first CSV field (quoted if needed)."""
+    return _csv_line((ip,))[:-1]
+
+
+def _field(value) -> str:
+    """Lookup output value: 'N/A' for missing values, as in the CSV export."""
+    return 'N/A' if value is None or value == "" else str(value)
+
+
+def iter_csv_networks(csv_filename: str) -> Iterator[dict]:
+    """
+    Read the networks of an exported Network Hierarchy CSV, without validation.
+
+    :raises ValueError: If the header is not the Network Hierarchy header.
+    """
+    with open(csv_filename, 'r', newline='', encoding='utf-8') as csv_file:
+        reader = csv.DictReader(csv_file)
+        if reader.fieldnames != CSV_COLUMNS:
+            raise ValueError(f"Header is not correct, must be {','.join(CSV_COLUMNS)}.")
+        yield from reader
+
+
+def csv_source_key(csv_filename: str) -> str:
+    """Cache key of a CSV source: its path, size and modification time."""
+    stat = os.stat(csv_filename)
+    return f"csv:{os.path.abspath(csv_filename)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def cache_path(source_key: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """Path of the cached index for a source key."""
+    digest = hashlib.sha256(source_key.encode('utf-8')).hexdigest()[:24]
+    return os.path.join(cache_dir, f"lookup-{digest}.idx")
+
+
+def load_or_build(source_key: str, entries_factory, max_age: Optional[float] = None,
+                  refresh: bool = False, cache_dir: str = DEFAULT_CACHE_DIR) -> Tuple[LookupIndex, bool]:
+    """
+    Return the cached index for a source, or build it and cache it.
+
+    :param source_key: Identifies the source (see csv_source_key), stored in the cache.
+    :param entries_factory: Callable returning the network entries, only called on a cache miss.
+    :param max_age: Maximum age in seconds of a cached index, None for no limit.
+    :param refresh: Ignore the cache and rebuild.
+    :return: Tuple (index, True if it came from the cache).
+    """
+    path = cache_path(source_key, cache_dir)
+    if not refresh:
+        index = LookupIndex.load(path, source_key, max_age)
+        if index is not None:
+            return index, True
+    index = LookupIndex.build(entries_factory())
+    index.save(path, source_key)
+    return index, False
+
+
+def run_lookups(index: LookupIndex, input_stream: TextIO, output_stream: TextIO, batch_size: int = 65536) -> dict:
+    """
+    Look up every address read from input_stream (one per line) and write CSV results.
+
+    :return: Statistics: lookups, not_found, seconds.
+    """
+    output_stream.write(_csv_line(LOOKUP_COLUMNS))
+    not_found = _csv_suffix(NOT_FOUND)
+    stats = {"lookups": 0, "not_found": 0}
+    start = time.perf_counter()
+    while True:
+        chunk = list(islice(input_stream, batch_size))
+        if not chunk:
+            break
+        # A chunk of blank lines is skipped, not taken for the end of the input
+        batch = [ip for ip in map(str.strip, chunk) if ip]
+        if not batch:
+            continue
+        lines = index.format_batch(batch)
+        output_stream.write(lines)
+        stats["lookups"] += len(batch)
+        stats["not_found"] += lines.count(not_found)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def print_stats(stats: dict, index: LookupIndex, cached: bool, stream: TextIO = sys.stderr):
+    """Print lookup statistics (to stderr, so that stdout stays machine-readable)."""
+    rate = stats["lookups"] / stats["seconds"] if stats["seconds"] else 0
+    origin = "cached index" if cached else "index built"
+    print(f"{stats['lookups']} lookups ({stats['lookups'] - stats['not_found']} found, {stats['not_found']} not found) "
+          f"in {stats['seconds']}s ({rate:,.0f}/s), {origin}: {len(index)} networks, "
+          f"{len(index.starts)} segments", file=stream)
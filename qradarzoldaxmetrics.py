@@ -0,0 +1,352 @@
+"""
+   qradarzoldaxmetrics.py
+
+   Description: Lightweight timing and counting instrumentation of NHSuite
+   (--profile / --metrics-out). Phases (HTTP requests, body reads, JSON decode,
+   CSV writing, validation, upload, ...) are timed with nested timers: each phase
+   reports its total time and its self time (total minus the phases it waited on),
+   so the time of a streamed export is split between network, decoding and
+   writing. Counters record HTTP statuses, bytes transferred and rows processed.
+   While instrumentation is disabled (the default) every helper returns at once.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional
+
+PROMETHEUS_PREFIX = "nhsuite"
+_METRIC_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+
+_registry = None
+
+
+class PhaseStats:
+    """Accumulated measurements of one phase."""
+
+    __slots__ = ("calls", "seconds", "self_seconds", "items")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.items = 0
+
+
+class Registry:
+    """
+    Phases and counters of one run.
+
+    Every thread keeps its own stack of running phases: when a phase ends, its
+    duration is added to the child time of the phase below it, which gives the
+    self time of each phase. Phases running in worker threads (paged fetch) are
+    added up, so their totals can exceed the wall-clock time.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.clock_start = time.perf_counter()
+        self.phases = {}
+        self.counters = Counter()
+        self.order = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, name: str, elapsed: float, child: float, items: int):
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = PhaseStats()
+                self.order.append(name)
+            stats.calls += 1
+            stats.seconds += elapsed
+            stats.self_seconds += elapsed - child
+            stats.items += items
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def timed(self, iterable: Iterable, name: str, count_items: bool = True) -> Iterator:
+        """Yield the items of iterable, timing the whole iteration as one call of phase `name`."""
+        iterator = iter(iterable)
+        clock = time.perf_counter
+        items = 0
+        elapsed = child = 0.0
+        try:
+            while True:
+                # Looked up at each step: the iterator may be consumed by another thread
+                stack = self._stack()
+                frame = [0.0]
+                stack.append(frame)
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    step = clock() - start
+                    stack.pop()
+                    if stack:
+                        stack[-1][0] += step
+                    elapsed += step
+                    child += frame[0]
+                items += 1
+                yield item
+        finally:
+            self._record(name, elapsed, child, items if count_items else 0)
+
+
+class _Phase:
+    """Context manager timing a block as one call of a phase; set `items` to report rows."""
+
+    __slots__ = ("registry", "name", "items", "frame", "start")
+
+    def __init__(self, registry: Registry, name: str):
+        self.registry = registry
+        self.name = name
+        self.items = 0
+
+    def __enter__(self) -> "_Phase":
+        self.frame = [0.0]
+        self.registry._stack().append(self.frame)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = self.registry._stack()
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        self.registry._record(self.name, elapsed, self.frame[0], self.items)
+        return False
+
+
+class _NullPhase:
+    """Phase used while instrumentation is disabled: does nothing."""
+
+    __slots__ = ("items",)
+
+    def __init__(self):
+        self.items = 0
+
+    def __enter__(self) -> "_NullPhase":
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def enable() -> Registry:
+    """Start collecting metrics (a new, empty registry)."""
+    global _registry
+    _registry = Registry()
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def enabled() -> bool:
+    return _registry is not None
+
+
+def phase(name: str):
+    """
+    Time a block of code as one call of phase `name`.
+
+    >>> with phase("validate") as timer:
+    ...     timer.items = len(rows)
+    """
+    registry = _registry
+    return _NULL_PHASE if registry is None else _Phase(registry, name)
+
+
+def timed(iterable: Iterable, name: str, count_items: bool = True) -> Iterable:
+    """
+    Time the steps of an iterator (e.g. a streamed decode) as phase `name`; iterable itself when disabled.
+
+    :param count_items: Report the yielded items as the items of the phase (False for body chunks).
+    """
+    registry = _registry
+    return iterable if registry is None else registry.timed(iterable, name, count_items)
+
+
+def count(name: str, value: float = 1):
+    """Add value to counter `name`."""
+    registry = _registry
+    if registry is not None:
+        registry.count(name, value)
+
+
+def counted_bytes(chunks: Iterable[bytes], name: str) -> Iterable[bytes]:
+    """Add the size of each chunk to counter `name` while passing the chunks on; chunks itself when disabled."""
+    registry = _registry
+    if registry is None:
+        return chunks
+
+    def counting():
+        for chunk in chunks:
+            registry.count(name, len(chunk))
+            yield chunk
+    return counting()
+
+
+def snapshot() -> dict:
+    """Metrics collected so far, as a JSON-serializable dict (empty when disabled)."""
+    registry = _registry
+    if registry is None:
+        return {}
+    with registry._lock:
+        phases = {
+            name: {
+                "calls": stats.calls,
+                "seconds": round(stats.seconds, 6),
+                "self_seconds": round(stats.self_seconds, 6),
+                "items": stats.items,
+                "items_per_second": round(stats.items / stats.seconds, 1) if stats.items and stats.seconds else None,
+            }
+            for name, stats in ((name, registry.phases[name]) for name in registry.order)
+        }
+        counters = dict(sorted(registry.counters.items()))
+    return {
+        "started": registry.started,
+        "seconds": round(time.perf_counter() - registry.clock_start, 6),
+        "phases": phases,
+        "counters": counters,
+    }
+
+
+def format_table(data: dict) -> List[str]:
+    """Human-readable lines of a snapshot, for --profile."""
+    if not data:
+        return []
+    headers = ("phase", "calls", "total s", "self s", "items", "items/s")
+    rows = [(name, str(p["calls"]), f"{p['seconds']:.3f}", f"{p['self_seconds']:.3f}",
+             str(p["items"] or ""), f"{p['items_per_second']:.0f}" if p["items_per_second"] else "")
+            for name, p in data["phases"].items()]
+    widths = [max(len(value) for value in column) for column in zip(headers, *rows)]
+    lines = [f"Profile ({data['seconds']:.3f}s wall clock, self = total minus nested phases)"]
+    for row in (headers, *rows):
+        lines.append("  ".join(value.rjust(width) if position else value.ljust(width)
+                               for position, (value, width) in enumerate(zip(row, widths))).rstrip())
+    if data["counters"]:
+        lines.append("")
+        name_width = max(len(name) for name in data["counters"])
+        for name, value in data["counters"].items():
+            lines.append(f"{name.ljust(name_width)}  {int(value) if float(value).is_integer() else value}")
+    return lines
+
+
+def print_profile(file=None):
+    """Print the profile table (to stderr by default, stdout may carry data)."""
+    for line in format_table(snapshot()):
+        print(line, file=sys.stderr if file is None else file)
+
+
+def _metric_name(name: str) -> str:
+    return _METRIC_NAME_CHARS.sub("_", name)
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(data: dict, labels: Optional[dict] = None) -> str:
+    """Snapshot in the Prometheus text exposition format (node_exporter textfile collector)."""
+    base = dict(labels or {})
+
+    def label_text(extra: dict) -> str:
+        merged = {**base, **extra}
+        if not merged:
+            return ""
+        return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in merged.items()) + "}"
+
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples: list):
+        if not samples:
+            return
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} {kind}")
+        for extra, value in samples:
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}{label_text(extra)} {value!r}")
+
+    phases = data.get("phases", {})
+    metric("run_seconds", "gauge", "Wall-clock duration of the run.", [({}, data.get("seconds", 0))])
+    metric("run_timestamp_seconds", "gauge", "Start time of the run (Unix time).", [({}, data.get("started", 0))])
+    metric("phase_seconds", "gauge", "Total time spent in each phase.",
+           [({"phase": name}, p["seconds"]) for name, p in phases.items()])
+    metric("phase_self_seconds", "gauge", "Time spent in each phase, excluding nested phases.",
+           [({"phase": name}, p["self_seconds"]) for name, p in phases.items()])
+    metric("phase_calls", "gauge", "Number of calls of each phase (one per iteration for streamed phases).",
+           [({"phase": name}, p["calls"]) for name, p in phases.items()])
+    metric("phase_items", "gauge", "Items (rows, networks) processed by each phase.",
+           [({"phase": name}, p["items"]) for name, p in phases.items() if p["items"]])
+
+    statuses = [({"code": name.rsplit(".", 1)[1]}, value)
+                for name, value in data.get("counters", {}).items() if name.startswith("http.status.")]
+    metric("http_responses", "gauge", "HTTP responses received, by status code.", statuses)
+    for name, value in data.get("counters", {}).items():
+        if not name.startswith("http.status."):
+            metric(_metric_name(name), "gauge", f"Counter {name} of the run.", [({}, value)])
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(filename: str, labels: Optional[dict] = None):
+    """
+    Write the metrics of the run to a file, atomically (safe for textfile collectors).
+
+    A file name ending in ".prom" gets the Prometheus text format, any other gets JSON.
+
+    :param filename: Output file.
+    :param labels: Labels added to every Prometheus sample, and stored in the JSON.
+    """
+    data = snapshot()
+    if filename.endswith(".prom"):
+        content = format_prometheus(data, labels)
+    else:
+        content = json.dumps({**data, "labels": labels or {}}, indent=2)
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
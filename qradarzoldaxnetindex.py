@@ -0,0 +1,145 @@
+"""
+   qradarzoldaxnetindex.py
+
+   Description: Integer range index over Network Hierarchy CIDRs.
+   The [start, end] integer range of each network of a NetworkTable is read from
+   its address columns, and the ranges are sorted once by (start, widest first). One sweep with a stack of enclosing ranges then finds
+   identical CIDRs and, for each network, its closest enclosing network, in
+   O(n log n) overall instead of comparing every pair of networks.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from qradarzoldaxnetwork import NetworkTable
+from qradarzoldaxvalidator import WARNING, ValidationReport, cidr_to_int
+
+
+def network_range(cidr: str) -> Tuple[int, int]:
+    """
+    Convert an IPv4 CIDR into its integer address range.
+
+    :param cidr: CIDR string, e.g. "10.0.0.0/8".
+    :return: Tuple (first address, last address) as integers.
+    """
+    address, prefix = cidr_to_int(cidr)
+    return address, address | ((1 << (32 - prefix)) - 1)
+
+
+def sorted_ranges(table: NetworkTable, positions: Optional[Sequence[int]] = None) -> Iterator[Tuple[int, int, int]]:
+    """
+    Sort the networks of a table by range for a sweep: start ascending, then widest first.
+
+    The ranges are computed from the address and prefix columns of the table, no CIDR
+    is parsed. For the same start, a shorter prefix is a wider network, so the sort key
+    is simply (address, prefix), packed into one integer. Equal ranges keep table order.
+
+    :param table: Networks with a valid IPv4 "cidr".
+    :param positions: Networks of the table to sort (default: all), e.g. only the IPv4 ones.
+    :return: Iterator of (start, end, position) where position is the index in `table`.
+    """
+    addresses, prefixes = table.addresses, table.prefixes
+    if positions is None:
+        keys = [(address << 6) | prefix for address, prefix in zip(addresses, prefixes)]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+    else:
+        keys = {position: (addresses[position] << 6) | prefixes[position] for position in positions}
+        order = sorted(positions, key=keys.__getitem__)
+    del keys
+    for position in order:
+        start = addresses[position]
+        yield start, start | ((1 << (32 - prefixes[position])) - 1), position
+
+
+def iter_parents(ranges: Iterable[Tuple[int, int, int]]) -> Iterator[Tuple[int, int]]:
+    """
+    Sweep sorted ranges and yield, for each nested network, its closest enclosing network.
+
+    CIDR ranges never partially overlap: two networks are either disjoint or one
+    contains the other, so a stack of the currently open ranges is enough.
+    Identical ranges are yielded too: the second one has the first as parent.
+
+    :param ranges: Output of sorted_ranges().
+    :return: Iterator of (position, parent position).
+    """
+    stack: List[Tuple[int, int]] = []
+    for start, end, position in ranges:
+        while stack and stack[-1][0] < start:
+            stack.pop()
+        if stack:
+            yield position, stack[-1][1]
+        stack.append((end, position))
+
+
+def iter_duplicate_ids(table: NetworkTable) -> Iterator[Tuple[int, int]]:
+    """
+    Yield (position, first position) for each network whose id is already used by an earlier network.
+
+    The positions are sorted by id (a stable sort keeps equal ids in table order), so
+    no dict of every id is built. The pairs come out ordered by id, not by position.
+    """
+    ids = table.ids
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    first = None
+    for previous, position in zip(order, islice(order, 1, None)):
+        if ids[position] == ids[previous]:
+            first = previous if first is None else first
+            yield position, first
+        else:
+            first = None
+
+
+def check_conflicts(table: NetworkTable, rows: Sequence[int], report: ValidationReport) -> None:
+    """
+    Find duplicate ids, duplicate CIDRs and nested CIDRs, and record them in the report.
+
+    - duplicate_id is an error, and so is duplicate_cidr, the same CIDR twice in one
+      domain. The same CIDR in different domains is allowed (multi-tenant hierarchies).
+    - nested_same_group is a warning: the network lies inside another network of the
+      same group, which is usually redundant. A network inside a network of another
+      group is how a hierarchy is built (the more specific network wins) and is not reported.
+
+    :param table: Validated networks (integer ids, IPv4 CIDRs).
+    :param rows: Row number in the CSV file of each network of the table.
+    :param report: Report collecting the issues.
+    """
+    for position, first in sorted(iter_duplicate_ids(table)):
+        report.add(rows[position], "id", str(table.ids[position]), "duplicate_id",
+                   f"id already used at row {rows[first]}")
+
+    addresses, prefixes, groups = table.addresses, table.prefixes, table.groups
+    # Networks with the same range, by first network of the range (sorted_ranges keeps them in table order)
+    same_range = {}
+    for position, parent in iter_parents(sorted_ranges(table)):
+        if addresses[position] == addresses[parent] and prefixes[position] == prefixes[parent]:
+            same_range.setdefault(parent, [parent]).append(position)
+            same_range[position] = same_range[parent]
+        elif groups[position] == groups[parent]:
+            report.add(rows[position], "cidr", table.cidr(position), "nested_same_group",
+                       f"inside {table.cidr(parent)} of the same group at row {rows[parent]}", WARNING)
+
+    for first, positions in same_range.items():
+        if first != positions[0]:
+            continue
+        by_domain = {}
+        for position in positions:
+            original = by_domain.setdefault(table.value(position, "domain_id"), position)
+            if original != position:
+                report.add(rows[position], "cidr", table.cidr(position), "duplicate_cidr",
+                           f"same CIDR in the same domain as row {rows[original]} "
+                           f"({table.value(original, 'group')}.{table.value(original, 'name')})")
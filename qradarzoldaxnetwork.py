@@ -0,0 +1,549 @@
+"""
+   qradarzoldaxnetwork.py
+
+   Description: Compact in-memory model of Network Hierarchy entries.
+   Network is one entry with __slots__ instead of a dict; NetworkTable stores a
+   whole hierarchy by columns: ids, domain ids, addresses, prefix lengths and
+   coordinates in typed arrays, group names and country codes as indexes into
+   one table of interned strings. CIDRs are parsed once when a network is added,
+   so range computations read integers instead of parsing strings again.
+   Conversion from and to the API JSON objects is lossless: values that do not
+   fit their column (IPv6 CIDR, other location types, unknown fields) are kept
+   as they are on the side.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import hashlib
+from array import array
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+from qradarzoldaxvalidator import InvalidValue, cidr_to_int
+
+# Fields of a network object of /api/config/network_hierarchy/networks, in CSV column order
+API_FIELDS = ("id", "group", "name", "cidr", "description", "domain_id", "location", "country_code")
+_FIELD_BITS = {name: 1 << position for position, name in enumerate(API_FIELDS)}
+_ALL_FIELDS = (1 << len(API_FIELDS)) - 1
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+_ABSENT = object()
+_NAN = float("nan")
+_get_fields = itemgetter(*API_FIELDS)
+
+
+def _is_int64(value) -> bool:
+    return type(value) is int and _INT64_MIN <= value <= _INT64_MAX
+
+
+def _point(location) -> Optional[Tuple[float, float]]:
+    """(longitude, latitude) of a GeoJSON point stored as-is by the API, None for any other location."""
+    if type(location) is dict and len(location) == 2 and location.get("type") == "Point":
+        coordinates = location.get("coordinates")
+        if type(coordinates) is list and len(coordinates) == 2 and \
+                type(coordinates[0]) is float and type(coordinates[1]) is float:
+            return coordinates[0], coordinates[1]
+    return None
+
+
+def format_cidr(address: int, prefix: int) -> str:
+    """Dotted CIDR notation of an IPv4 network address and prefix length."""
+    return f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}/{prefix}"
+
+
+class Network:
+    """
+    One Network Hierarchy entry.
+
+    Attributes are the API fields (None when the entry has no such field) and
+    `extra`, a dict of the fields unknown to NHSuite or None. Network also answers
+    get() and [] like the API dict, so code written for dicts accepts it.
+    """
+
+    __slots__ = API_FIELDS + ("extra", "_present")
+
+    def __init__(self, id: Optional[int] = None, group: Optional[str] = None, name: Optional[str] = None,
+                 cidr: Optional[str] = None, description: Optional[str] = None, domain_id: Optional[int] = None,
+                 location: Optional[dict] = None, country_code: Optional[str] = None, extra: Optional[dict] = None):
+        self.id = id
+        self.group = group
+        self.name = name
+        self.cidr = cidr
+        self.description = description
+        self.domain_id = domain_id
+        self.location = location
+        self.country_code = country_code
+        self.extra = extra or None
+        present = 0
+        for field, bit in _FIELD_BITS.items():
+            if getattr(self, field) is not None:
+                present |= bit
+        self._present = present
+
+    @classmethod
+    def from_api(cls, entry: dict) -> "Network":
+        """Build a Network from an API network object (or a validated CSV row)."""
+        network = cls.__new__(cls)
+        present = 0
+        for field, bit in _FIELD_BITS.items():
+            value = entry.get(field, _ABSENT)
+            if value is _ABSENT:
+                value = None
+            else:
+                present |= bit
+            setattr(network, field, value)
+        network._present = present
+        network.extra = None
+        if len(entry) > bin(present).count("1"):
+            network.extra = {key: value for key, value in entry.items() if key not in _FIELD_BITS}
+        return network
+
+    def to_api(self) -> dict:
+        """The API network object, with the same fields and values as the one it was built from."""
+        present = self._present
+        entry = {field: getattr(self, field) for field, bit in _FIELD_BITS.items() if present & bit}
+        if self.extra:
+            entry.update(self.extra)
+        return entry
+
+    def address_range(self) -> Tuple[int, int]:
+        """
+        First and last address of the network, as integers.
+
+        :raises InvalidValue: If the CIDR is not a valid IPv4 network.
+        """
+        address, prefix = cidr_to_int(str(self.cidr))
+        return address, address | ((1 << (32 - prefix)) - 1)
+
+    def get(self, key: str, default=None):
+        bit = _FIELD_BITS.get(key)
+        if bit is None:
+            return (self.extra or {}).get(key, default)
+        return getattr(self, key) if self._present & bit else default
+
+    def __getitem__(self, key: str):
+        value = self.get(key, _ABSENT)
+        if value is _ABSENT:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _ABSENT) is not _ABSENT
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Network):
+            return NotImplemented
+        return self.to_api() == other.to_api()
+
+    def __repr__(self) -> str:
+        return f"Network({self.to_api()!r})"
+
+
+class NetworkTable:
+    """
+    Network Hierarchy stored by columns, in insertion order.
+
+    A table of a million networks takes a fraction of the memory of a list of
+    API dicts: integers live in typed arrays, repeated strings (groups, country
+    codes) are stored once, and only names and descriptions keep one string per
+    network. Networks are appended from API dicts or Network objects, and read
+    back as Network objects (iteration, indexing) or API dicts (iter_api).
+
+    Attributes:
+    -----------
+    ids, domain_ids : array
+        Signed 64-bit integer columns.
+    addresses, prefixes : array
+        IPv4 network address and prefix length of each CIDR (prefix -1 when the CIDR is not IPv4).
+    groups, country_codes : array
+        Indexes in `strings`, the interned strings of the table.
+    names, descriptions : list
+        One string per network.
+    longitudes, latitudes : array
+        Coordinates of "Point" locations (NaN when the network has no point location).
+    """
+
+    def __init__(self, entries: Optional[Iterable[Union[dict, Network]]] = None):
+        self.ids = array('q')
+        self.groups = array('I')
+        self.names = []
+        self.addresses = array('I')
+        self.prefixes = array('b')
+        self.descriptions = []
+        self.domain_ids = array('q')
+        self.longitudes = array('d')
+        self.latitudes = array('d')
+        self.country_codes = array('I')
+        self.strings = [""]
+        self._string_index = {"": 0}
+        # Fields present in each entry (bit per API_FIELDS position)
+        self._present = array('B')
+        # position -> {field: value} for values kept outside the columns, and unknown fields
+        self._overflow = {}
+        if entries is not None:
+            self.extend(entries)
+
+    @classmethod
+    def from_api(cls, entries: Iterable[Union[dict, Network]]) -> "NetworkTable":
+        """Build a table from API network objects, consuming them one by one (e.g. from a streamed decode)."""
+        return cls(entries)
+
+    def _intern(self, value: str) -> int:
+        index = self._string_index.get(value)
+        if index is None:
+            index = self._string_index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def append(self, entry: Union[dict, Network]):
+        """Add one network (API dict or Network) at the end of the table."""
+        if isinstance(entry, Network):
+            entry = entry.to_api()
+        if type(entry) is dict and len(entry) == len(API_FIELDS):
+            # Usual case: every field present, with the type of its column
+            try:
+                id, group, name, cidr, description, domain_id, location, country_code = _get_fields(entry)
+                if type(id) is int and type(domain_id) is int and _INT64_MIN <= id <= _INT64_MAX \
+                        and _INT64_MIN <= domain_id <= _INT64_MAX and type(group) is str and type(name) is str \
+                        and type(description) is str and type(country_code) is str and type(cidr) is str:
+                    point = _point(location)
+                    if point is not None:
+                        address, prefix = cidr_to_int(cidr)
+                        self._append_columns(id, group, name, address, prefix, description, domain_id, point,
+                                             country_code)
+                        return
+            except (KeyError, InvalidValue):
+                pass
+        self._append_entry(entry)
+
+    def _append_columns(self, id: int, group: str, name: str, address: int, prefix: int, description: str,
+                        domain_id: int, point: Tuple[float, float], country_code: str):
+        string_index = self._string_index
+        group_index = string_index.get(group)
+        if group_index is None:
+            group_index = self._intern(group)
+        country_index = string_index.get(country_code)
+        if country_index is None:
+            country_index = self._intern(country_code)
+        self.ids.append(id)
+        self.groups.append(group_index)
+        self.names.append(name)
+        self.addresses.append(address)
+        self.prefixes.append(prefix)
+        self.descriptions.append(description)
+        self.domain_ids.append(domain_id)
+        self.longitudes.append(point[0])
+        self.latitudes.append(point[1])
+        self.country_codes.append(country_index)
+        self._present.append(_ALL_FIELDS)
+
+    def _append_entry(self, entry: dict):
+        """append() of any entry: missing fields, values that do not fit their column, unknown fields."""
+        get = entry.get
+        position = len(self._present)
+        overflow = {}
+        present = 0
+
+        value = get("id", _ABSENT)
+        if value is not _ABSENT:
+            present |= 1
+        if _is_int64(value):
+            self.ids.append(value)
+        else:
+            self.ids.append(0)
+            if value is not _ABSENT:
+                overflow["id"] = value
+
+        value = get("group", _ABSENT)
+        if value is not _ABSENT:
+            present |= 2
+        if type(value) is str:
+            self.groups.append(self._intern(value))
+        else:
+            self.groups.append(0)
+            if value is not _ABSENT:
+                overflow["group"] = value
+
+        value = get("name", _ABSENT)
+        if value is not _ABSENT:
+            present |= 4
+        if type(value) is str:
+            self.names.append(value)
+        else:
+            self.names.append("")
+            if value is not _ABSENT:
+                overflow["name"] = value
+
+        value = get("cidr", _ABSENT)
+        if value is not _ABSENT:
+            present |= 8
+        address, prefix = 0, -1
+        if type(value) is str:
+            try:
+                address, prefix = cidr_to_int(value)
+            except InvalidValue:
+                pass
+        self.addresses.append(address)
+        self.prefixes.append(prefix)
+        if prefix < 0 and value is not _ABSENT:
+            overflow["cidr"] = value
+
+        value = get("description", _ABSENT)
+        if value is not _ABSENT:
+            present |= 16
+        if type(value) is str:
+            self.descriptions.append(value)
+        else:
+            self.descriptions.append("")
+            if value is not _ABSENT:
+                overflow["description"] = value
+
+        value = get("domain_id", _ABSENT)
+        if value is not _ABSENT:
+            present |= 32
+        if _is_int64(value):
+            self.domain_ids.append(value)
+        else:
+            self.domain_ids.append(0)
+            if value is not _ABSENT:
+                overflow["domain_id"] = value
+
+        value = get("location", _ABSENT)
+        if value is not _ABSENT:
+            present |= 64
+        point = _point(value)
+        if point is None:
+            self.longitudes.append(_NAN)
+            self.latitudes.append(_NAN)
+            if value is not _ABSENT:
+                overflow["location"] = value
+        else:
+            self.longitudes.append(point[0])
+            self.latitudes.append(point[1])
+
+        value = get("country_code", _ABSENT)
+        if value is not _ABSENT:
+            present |= 128
+        if type(value) is str:
+            self.country_codes.append(self._intern(value))
+        else:
+            self.country_codes.append(0)
+            if value is not _ABSENT:
+                overflow["country_code"] = value
+
+        self._present.append(present)
+        if len(entry) > bin(present).count("1"):
+            for key, value in entry.items():
+                if key not in _FIELD_BITS:
+                    overflow[key] = value
+        if overflow:
+            self._overflow[position] = overflow
+
+    def extend(self, entries: Iterable[Union[dict, Network]]):
+        """Add networks at the end of the table; another NetworkTable is appended column by column."""
+        if isinstance(entries, NetworkTable):
+            self._extend_table(entries)
+            return
+        append = self.append
+        for entry in entries:
+            append(entry)
+
+    def _extend_table(self, other: "NetworkTable"):
+        offset = len(self)
+        # Indexes of the other table's strings in this table
+        mapping = [self._intern(value) for value in other.strings]
+        if mapping == list(range(len(mapping))):
+            groups, country_codes = other.groups, other.country_codes
+        else:
+            groups = array('I', map(mapping.__getitem__, other.groups))
+            country_codes = array('I', map(mapping.__getitem__, other.country_codes))
+        self.ids.extend(other.ids)
+        self.groups.extend(groups)
+        self.names.extend(other.names)
+        self.addresses.extend(other.addresses)
+        self.prefixes.extend(other.prefixes)
+        self.descriptions.extend(other.descriptions)
+        self.domain_ids.extend(other.domain_ids)
+        self.longitudes.extend(other.longitudes)
+        self.latitudes.extend(other.latitudes)
+        self.country_codes.extend(country_codes)
+        self._present.extend(other._present)
+        for position, overflow in other._overflow.items():
+            self._overflow[position + offset] = dict(overflow)
+
+    def __len__(self) -> int:
+        return len(self._present)
+
+    def _column_value(self, position: int, field: str):
+        if field == "id":
+            return self.ids[position]
+        if field == "group":
+            return self.strings[self.groups[position]]
+        if field == "name":
+            return self.names[position]
+        if field == "cidr":
+            return format_cidr(self.addresses[position], self.prefixes[position])
+        if field == "description":
+            return self.descriptions[position]
+        if field == "domain_id":
+            return self.domain_ids[position]
+        if field == "location":
+            return {"type": "Point", "coordinates": [self.longitudes[position], self.latitudes[position]]}
+        return self.strings[self.country_codes[position]]
+
+    def value(self, position: int, field: str, default=None):
+        """Value of one field of the network at `position`, default when that network has no such field."""
+        overflow = self._overflow.get(position)
+        if overflow is not None and field in overflow:
+            return overflow[field]
+        bit = _FIELD_BITS.get(field)
+        if bit is None or not self._present[position] & bit:
+            return default
+        return self._column_value(position, field)
+
+    def irregular_positions(self) -> Iterator[int]:
+        """Positions of the networks not entirely stored in the columns (missing fields, overflow values), ascending."""
+        overflow = self._overflow
+        for position, present in enumerate(self._present):
+            if present != _ALL_FIELDS or position in overflow:
+                yield position
+
+    def set_value(self, position: int, field: str, value):
+        """Replace one API field of the network at `position` (e.g. a domain name by its id)."""
+        bit = _FIELD_BITS.get(field)
+        overflow = self._overflow.get(position)
+        if overflow is not None:
+            overflow.pop(field, None)
+            if not overflow:
+                del self._overflow[position]
+        if bit is None:
+            self._overflow.setdefault(position, {})[field] = value
+            return
+        self._present[position] |= bit
+        fits = True
+        if field in ("id", "domain_id"):
+            fits = _is_int64(value)
+            (self.ids if field == "id" else self.domain_ids)[position] = value if fits else 0
+        elif field in ("group", "country_code"):
+            fits = type(value) is str
+            (self.groups if field == "group" else self.country_codes)[position] = self._intern(value) if fits else 0
+        elif field in ("name", "description"):
+            fits = type(value) is str
+            (self.names if field == "name" else self.descriptions)[position] = value if fits else ""
+        elif field == "cidr":
+            address, prefix = 0, -1
+            if type(value) is str:
+                try:
+                    address, prefix = cidr_to_int(value)
+                except InvalidValue:
+                    pass
+            fits = prefix >= 0
+            self.addresses[position], self.prefixes[position] = address, prefix
+        else:
+            point = _point(value)
+            fits = point is not None
+            self.longitudes[position], self.latitudes[position] = point if fits else (_NAN, _NAN)
+        if not fits:
+            self._overflow.setdefault(position, {})[field] = value
+
+    def digest(self) -> bytes:
+        """
+        Digest of the whole table, from the bytes of its columns (no per-network work in Python).
+
+        Two tables built from the same networks in the same order have the same digest; a
+        different order gives a different digest even if the networks are the same.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for column in (self.ids, self.groups, self.addresses, self.prefixes, self.domain_ids,
+                       self.longitudes, self.latitudes, self.country_codes, self._present):
+            digest.update(column.tobytes())
+        for strings in (self.strings, self.names, self.descriptions):
+            # Lengths first, so that the concatenation cannot be read two ways
+            digest.update(array('Q', map(len, strings)).tobytes())
+            digest.update("".join(strings).encode('utf-8', 'surrogatepass'))
+        if self._overflow:
+            digest.update(repr(sorted(self._overflow.items())).encode('utf-8', 'surrogatepass'))
+        return digest.digest()
+
+    def cidr(self, position: int) -> str:
+        return self.value(position, "cidr")
+
+    def address_range(self, position: int) -> Tuple[int, int]:
+        """
+        First and last address of the network at `position`, as integers, without parsing its CIDR.
+
+        :raises InvalidValue: If the network has no valid IPv4 CIDR.
+        """
+        prefix = self.prefixes[position]
+        if prefix < 0:
+            raise InvalidValue("must be an IPv4 network in CIDR notation (a.b.c.d/n)")
+        address = self.addresses[position]
+        return address, address | ((1 << (32 - prefix)) - 1)
+
+    def api_entry(self, position: int) -> dict:
+        """API network object of the network at `position`."""
+        present = self._present[position]
+        overflow = self._overflow.get(position)
+        entry = {}
+        for field, bit in _FIELD_BITS.items():
+            if present & bit:
+                entry[field] = overflow[field] if overflow is not None and field in overflow \
+                    else self._column_value(position, field)
+        if overflow is not None:
+            for key, value in overflow.items():
+                if key not in _FIELD_BITS:
+                    entry[key] = value
+        return entry
+
+    def iter_api(self) -> Iterator[dict]:
+        """
+        Yield the API network objects in table order (e.g. as the items of a PUT body).
+
+        Networks with every field in its column, the usual case, are rebuilt from the
+        columns in one step; the others go through api_entry().
+        """
+        strings, overflow = self.strings, self._overflow
+        columns = zip(range(len(self)), self._present, self.ids, self.groups, self.names, self.addresses,
+                      self.prefixes, self.descriptions, self.domain_ids, self.longitudes, self.latitudes,
+                      self.country_codes)
+        for position, present, id, group, name, address, prefix, description, domain_id, \
+                longitude, latitude, country_code in columns:
+            if present != _ALL_FIELDS or position in overflow:
+                yield self.api_entry(position)
+                continue
+            yield {
+                "id": id,
+                "group": strings[group],
+                "name": name,
+                "cidr": format_cidr(address, prefix),
+                "description": description,
+                "domain_id": domain_id,
+                "location": {"type": "Point", "coordinates": [longitude, latitude]},
+                "country_code": strings[country_code],
+            }
+
+    def to_api(self) -> list:
+        """All the API network objects, as a list."""
+        return list(self.iter_api())
+
+    def __getitem__(self, position: int) -> Network:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("network table index out of range")
+        return Network.from_api(self.api_entry(position))
+
+    def __iter__(self) -> Iterator[Network]:
+        return map(Network.from_api, self.iter_api())
@@ -0,0 +1,310 @@
+"""
+   qradarzoldaxoptimize.py
+
+   Description: CIDR consolidation of a Network Hierarchy. Networks are swept
+   once in range order (see qradarzoldaxnetindex) and the entries that a
+   longest-prefix match never needs are dropped:
+   - duplicates: same CIDR and same attributes as an earlier network;
+   - shadowed: every address of the network is inside more specific networks,
+     so it never wins a lookup;
+   - redundant: the network lies inside a network with the same attributes;
+   - merged: adjacent sibling networks with the same attributes that form a
+     supernet (two /24 into a /23, four into a /22...) are replaced by it.
+   The attributes are the group, domain_id and country_code: every IP address
+   keeps the same group, domain and country after the optimization, which
+   verify_mapping() checks by sweeping both hierarchies like the lookup index.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+from array import array
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from qradarzoldaxlookup import MAX_ADDRESS
+from qradarzoldaxnetindex import sorted_ranges
+from qradarzoldaxnetwork import NetworkTable, format_cidr
+
+# Fields that must be equal for networks to be merged or dropped
+KEY_FIELDS = ("group", "domain_id", "country_code")
+
+# Status of each network of the table
+KEPT, DUPLICATE, SHADOWED, REDUNDANT, MERGED = range(5)
+REASONS = {DUPLICATE: "duplicate", SHADOWED: "shadowed", REDUNDANT: "redundant", MERGED: "merged"}
+
+
+class OptimizationResult:
+    """
+    Networks dropped and supernets created by optimize_table().
+
+    Attributes:
+    -----------
+    table : NetworkTable
+        The original hierarchy.
+    status : array
+        KEPT, DUPLICATE, SHADOWED, REDUNDANT or MERGED for each network of the table.
+    related : array
+        For each dropped network, the network that replaces it in lookups (-1 if none):
+        the first duplicate, the enclosing network, or the first network of the supernet.
+    supernets : dict
+        Position of the first network of each supernet -> (address, prefix) of the supernet.
+    skipped : int
+        Networks left as they are because their CIDR is not IPv4.
+    """
+
+    def __init__(self, table: NetworkTable):
+        self.table = table
+        self.status = array('b', bytes(len(table)))
+        self.related = array('q', [-1]) * len(table)
+        self.supernets = {}
+        self.skipped = 0
+
+    @property
+    def counts(self) -> Counter:
+        """Number of networks dropped per reason."""
+        counts = Counter(self.status)
+        return Counter({REASONS[status]: count for status, count in counts.items() if status != KEPT})
+
+    @property
+    def removed(self) -> int:
+        """Reduction of the number of entries."""
+        return len(self.status) - self.status.count(KEPT)
+
+    def __len__(self) -> int:
+        """Number of networks of the optimized hierarchy."""
+        return len(self.table) - self.removed
+
+    def iter_api(self) -> Iterator[dict]:
+        """
+        Yield the optimized hierarchy as API network objects, in the order of the table.
+
+        A supernet takes the place, id, name and other fields of its first network.
+        """
+        status, supernets = self.status, self.supernets
+        for position, entry in enumerate(self.table.iter_api()):
+            if status[position] != KEPT:
+                continue
+            supernet = supernets.get(position)
+            if supernet is not None:
+                entry["cidr"] = format_cidr(*supernet)
+            yield entry
+
+    def iter_changes(self) -> Iterator[str]:
+        """Describe each dropped network and each supernet, in the order of the table."""
+        table, status, related, supernets = self.table, self.status, self.related, self.supernets
+
+        def label(position: int) -> str:
+            return f"id {table.value(position, 'id')} {table.cidr(position)} ({table.value(position, 'group')})"
+
+        for position in range(len(table)):
+            reason = status[position]
+            if reason == DUPLICATE:
+                yield f"{label(position)}: duplicate of id {table.value(related[position], 'id')}"
+            elif reason == SHADOWED:
+                yield f"{label(position)}: shadowed, every address is in a more specific network"
+            elif reason == REDUNDANT:
+                yield f"{label(position)}: redundant inside {label(related[position])}"
+            elif reason == MERGED:
+                yield f"{label(position)}: merged into {format_cidr(*supernets[related[position]])}"
+            elif position in supernets:
+                yield f"{label(position)}: widened to supernet {format_cidr(*supernets[position])}"
+
+    def summary(self) -> str:
+        before, after = len(self.table), len(self)
+        percent = 100.0 * (before - after) / before if before else 0.0
+        counts = self.counts
+        details = ", ".join(f"{counts[reason]} {reason}" for reason in REASONS.values() if counts[reason])
+        return (f"{before} networks -> {after} ({before - after} fewer, {percent:.1f}%)"
+                + (f": {details}, {len(self.supernets)} supernets" if details else ""))
+
+    def print_summary(self, limit: int = 20):
+        """Print the summary and the first `limit` changes."""
+        print(f"Optimization: {self.summary()}")
+        for count, change in enumerate(self.iter_changes()):
+            if count == limit:
+                print(f"  ... {self.removed + len(self.supernets) - limit} more changes")
+                break
+            print(f"  {change}")
+        if self.skipped:
+            print(f"  {self.skipped} non-IPv4 networks left as they are")
+
+
+def attribute_keys(table: NetworkTable) -> list:
+    """(group, domain_id, country_code) of each network of the table."""
+    strings = table.strings
+    keys = list(zip(map(strings.__getitem__, table.groups), table.domain_ids,
+                    map(strings.__getitem__, table.country_codes)))
+    for position in table.irregular_positions():
+        keys[position] = tuple(table.value(position, field) for field in KEY_FIELDS)
+    return keys
+
+
+def optimize_table(table: NetworkTable) -> OptimizationResult:
+    """
+    Find the networks that can be dropped or merged without changing any IP-to-attributes mapping.
+
+    One sweep of the ranges sorted by (start, widest first) gives each network its closest
+    enclosing network and the size of the space its direct children cover. A second pass
+    in the same order decides duplicates, shadowed and redundant networks against the
+    closest enclosing network that is kept, and groups the kept networks by (kept parent,
+    attributes). Each group is then collapsed like a CIDR aggregation: two adjacent, aligned
+    blocks of the same size become their supernet, as long as the supernet is smaller than
+    the parent. O(n log n) for the sort, linear afterwards.
+
+    :param table: Hierarchy to optimize (fetched, or validated from a CSV file).
+    :return: OptimizationResult (the table is not modified).
+    """
+    result = OptimizationResult(table)
+    status, related = result.status, result.related
+    count = len(table)
+    addresses, prefixes = table.addresses, table.prefixes
+    positions = [position for position in range(count) if prefixes[position] >= 0]
+    result.skipped = count - len(positions)
+    keys = attribute_keys(table)
+
+    # Sweep: closest enclosing network and space covered by the direct children
+    order = array('q')
+    parents = array('q', [-1]) * count
+    covered = [0] * count
+    stack = []  # (end, position) of the open networks, innermost last
+    for start, end, position in sorted_ranges(table, positions):
+        while stack and stack[-1][0] < start:
+            stack.pop()
+        order.append(position)
+        if stack:
+            parent = stack[-1][1]
+            parents[position] = parent
+            if addresses[parent] == start and prefixes[parent] == prefixes[position]:
+                if keys[parent] == keys[position]:
+                    status[position], related[position] = DUPLICATE, parent
+                    continue
+                # Same CIDR, other attributes: kept as it is, the validator reports it
+            else:
+                covered[parent] += end - start + 1
+        stack.append((end, position))
+
+    # Shadowed and redundant networks, against the closest kept enclosing network
+    kept_parents = array('q', [-1]) * count
+    groups = {}
+    for position in order:
+        if status[position] == DUPLICATE:
+            # Stands for its first occurrence as the parent of later networks
+            first = related[position]
+            kept_parents[position] = first if status[first] == KEPT else kept_parents[first]
+            continue
+        parent = parents[position]
+        if parent >= 0 and status[parent] != KEPT:
+            parent = kept_parents[parent]
+        kept_parents[position] = parent
+        if covered[position] == 1 << (32 - prefixes[position]):
+            status[position] = SHADOWED
+        elif parent >= 0 and keys[parent] == keys[position]:
+            status[position], related[position] = REDUNDANT, parent
+        else:
+            groups.setdefault((parent, keys[position]), []).append(position)
+
+    # Supernets of adjacent siblings with the same attributes
+    for (parent, _), members in groups.items():
+        if len(members) < 2:
+            continue
+        widest = prefixes[parent] + 1 if parent >= 0 else 0
+        blocks = []  # [address, prefix, member positions]
+        for position in members:
+            blocks.append([addresses[position], prefixes[position], [position]])
+            while len(blocks) > 1:
+                low, high = blocks[-2], blocks[-1]
+                prefix = low[1]
+                if prefix != high[1] or prefix <= widest or low[0] & (1 << (32 - prefix)) \
+                        or high[0] != low[0] + (1 << (32 - prefix)):
+                    break
+                blocks.pop()
+                low[1] = prefix - 1
+                low[2].extend(high[2])
+        for address, prefix, merged in blocks:
+            if len(merged) > 1:
+                first = min(merged)
+                result.supernets[first] = (address, prefix)
+                for position in merged:
+                    if position != first:
+                        status[position], related[position] = MERGED, first
+    return result
+
+
+def mapping_segments(ranges: Iterable[Tuple[int, int, int]], keys: list) -> List[tuple]:
+    """
+    The IPv4 space cut into segments of constant attributes, as a longest-prefix match sees it.
+
+    Same sweep as LookupIndex.build(): for equal ranges the last network wins.
+
+    :param ranges: (start, end, position) of the networks.
+    :param keys: Attributes of each position (see attribute_keys).
+    :return: List of (first address, attributes or None when no network covers it).
+    """
+    segments = []
+
+    def emit(first, last, owner):
+        value = keys[owner] if owner >= 0 else None
+        if first <= last and not (segments and segments[-1][1] == value):
+            segments.append((first, value))
+
+    stack = []  # (end, position) of the open networks, innermost last
+    cursor = 0
+    for start, negative_end, position in sorted((start, -end, position) for start, end, position in ranges):
+        while stack and stack[-1][0] < start:
+            end, top = stack.pop()
+            emit(cursor, end, top)
+            cursor = end + 1
+        emit(cursor, start - 1, stack[-1][1] if stack else -1)
+        cursor = start
+        stack.append((-negative_end, position))
+    while stack:
+        end, top = stack.pop()
+        emit(cursor, end, top)
+        cursor = end + 1
+    emit(cursor, MAX_ADDRESS, -1)
+    return segments
+
+
+def verify_mapping(result: OptimizationResult) -> Optional[str]:
+    """
+    Check that every IPv4 address has the same attributes in the original and the optimized hierarchy.
+
+    :return: None if they match, otherwise a description of the first difference.
+    """
+    table, status, supernets = result.table, result.status, result.supernets
+    keys = attribute_keys(table)
+    positions = [position for position in range(len(table)) if table.prefixes[position] >= 0]
+
+    def ranges(optimized: bool) -> Iterator[Tuple[int, int, int]]:
+        for position in positions:
+            if optimized and status[position] != KEPT:
+                continue
+            supernet = supernets.get(position) if optimized else None
+            if supernet is None:
+                start, end = table.address_range(position)
+            else:
+                start, end = supernet[0], supernet[0] | ((1 << (32 - supernet[1])) - 1)
+            yield start, end, position
+
+    before = mapping_segments(ranges(False), keys)
+    after = mapping_segments(ranges(True), keys)
+    for (start, value), (other_start, other_value) in zip(before, after):
+        if start != other_start or value != other_value:
+            return (f"mapping differs from {format_cidr(min(start, other_start), 32)}: "
+                    f"{value} before, {other_value} after")
+    if len(before) != len(after):
+        return f"mapping differs: {len(before)} segments before, {len(after)} after"
+    return None
@@ -0,0 +1,187 @@
+"""
+   qradarzoldaxparallel.py
+
+   Description: Parallel validation of large Network Hierarchy CSV files.
+   The file is cut into byte ranges that end on a record boundary (a newline
+   outside any quoted field), and a pool of processes parses and validates the
+   ranges. Each worker returns its valid networks as a NetworkTable with their
+   row numbers, and its issues; the results are merged in file order, so the
+   networks, the row numbers and the report are the same as with the sequential
+   validation, whatever the number of workers.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import csv
+import io
+import mmap
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import List, Optional, Tuple
+
+from qradarzoldaxnetwork import NetworkTable
+from qradarzoldaxvalidator import RowValidator, ValidationReport, validate_csv
+
+# Chunks per worker: smaller chunks balance the load when rows have uneven sizes
+CHUNKS_PER_WORKER = 4
+# Files smaller than this are validated in the calling process
+MIN_CHUNK_BYTES = 1024 * 1024
+
+# Line added after each chunk: it is read as a row of its own only if the chunk ends outside a quoted field
+_SENTINEL_LINE = "\uffff\n"
+_SENTINEL_FIELDS = ["\uffff"]
+
+
+def resolve_workers(workers: Optional[int]) -> int:
+    """Number of worker processes for --workers N (0 or None: one per CPU)."""
+    if not workers or workers < 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _line_breaks(data: bytes) -> int:
+    """Lines in data as counted by csv.reader: "\\r\\n", "\\n" and a lone "\\r" each end one line."""
+    return data.count(b"\n") + data.count(b"\r") - data.count(b"\r\n")
+
+
+def csv_chunks(csv_filename: str, count: int, start: int) -> List[Tuple[int, int, int]]:
+    """
+    Cut a CSV file into about `count` byte ranges ending on a record boundary.
+
+    A newline ends a record when the number of quote characters since the previous
+    boundary is even: quotes inside a quoted field are doubled, so an odd count means
+    the newline is part of a quoted value. A quote in an unquoted value could mislead
+    this rule; the workers detect it (see validate_chunk) and the caller falls back
+    to the sequential validation.
+
+    :param csv_filename: Path of the CSV file.
+    :param count: Number of chunks wanted.
+    :param start: Offset of the first data record (after the header).
+    :return: List of (start offset, end offset, lines before start), in file order.
+    """
+    with open(csv_filename, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= start:
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            target = max(1, (size - start) // max(1, count))
+            lines = _line_breaks(data[:start])
+            chunks = []
+            while start < size:
+                end = data.find(b"\n", min(size, start + target))
+                quotes = data[start:end].count(b'"') if end >= 0 else 0
+                while end >= 0 and quotes % 2:
+                    following = data.find(b"\n", end + 1)
+                    if following >= 0:
+                        quotes += data[end:following].count(b'"')
+                    end = following
+                end = size if end < 0 else end + 1
+                chunks.append((start, end, lines))
+                lines += _line_breaks(data[start:end])
+                start = end
+    return chunks
+
+
+def validate_chunk(task: Tuple[str, int, int, int]) -> tuple:
+    """
+    Parse and validate one byte range of a CSV file (run in a worker process).
+
+    :param task: (CSV file name, start offset, end offset, lines before start).
+    :return: (aligned, table, rows, issues, rows checked). aligned is False when the
+             range does not end on a record boundary: its results must not be used.
+    """
+    csv_filename, start, end, line_offset = task
+    with open(csv_filename, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+    report = ValidationReport(csv_filename)
+    table, rows = NetworkTable(), array('L')
+    validate, append, add_row = RowValidator().validate, table.append, rows.append
+    reader = csv.reader(chain(io.StringIO(text, newline=''), [_SENTINEL_LINE]))
+    aligned = False
+    for fields in reader:
+        if fields == _SENTINEL_FIELDS:
+            aligned = next(reader, None) is None
+            break
+        if not fields:
+            # Blank line, skipped as in validate_rows
+            continue
+        row = reader.line_num + line_offset
+        network = validate(fields, row, report)
+        if network is not None:
+            add_row(row)
+            append(network)
+    return aligned, table, rows, report.issues, report.rows_checked
+
+
+def _validate_sequential(csv_filename: str, report: ValidationReport) -> Tuple[NetworkTable, array]:
+    table, rows = NetworkTable(), array('L')
+    append, add_row = table.append, rows.append
+    for row, network in validate_csv(csv_filename, report, numbered=True):
+        add_row(row)
+        append(network)
+    return table, rows
+
+
+def validate_csv_table(csv_filename: str, report: ValidationReport, workers: int = 1) -> Tuple[NetworkTable, array]:
+    """
+    Validate a Network Hierarchy CSV file into a NetworkTable, with `workers` processes.
+
+    The header is checked in the calling process. With more than one worker and a file
+    big enough, the data records are validated by chunks in a process pool; otherwise,
+    or if a chunk boundary turns out to fall inside a quoted field, row by row.
+
+    :param csv_filename: Path of the CSV file.
+    :param report: Report collecting the issues.
+    :param workers: Worker processes, 1 to validate in the calling process.
+    :return: (table of the valid networks, row number of each one), in file order.
+    """
+    size = os.path.getsize(csv_filename)
+    chunk_count = min(workers * CHUNKS_PER_WORKER, size // MIN_CHUNK_BYTES)
+    if workers <= 1 or chunk_count <= 1:
+        return _validate_sequential(csv_filename, report)
+
+    validator = RowValidator()
+    with open(csv_filename, 'r', newline='', encoding='utf-8') as csv_file:
+        reader = csv.reader(csv_file)
+        header_ok = validator.check_header(next(reader, None), report)
+        # A valid header has no quoted newline: it is the first line of the file
+        header_lines = reader.line_num
+    if not header_ok:
+        return NetworkTable(), array('L')
+    with open(csv_filename, 'rb') as file:
+        first_line = file.readline()
+    if header_lines != 1 or not first_line.endswith(b"\n"):
+        return _validate_sequential(csv_filename, report)
+
+    tasks = [(csv_filename, start, end, lines)
+             for start, end, lines in csv_chunks(csv_filename, chunk_count, len(first_line))]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(validate_chunk, tasks))
+    if not all(aligned for aligned, *_ in results):
+        # A quote inside an unquoted value misled csv_chunks: the header is valid, only the rows are checked again
+        return _validate_sequential(csv_filename, report)
+
+    table, rows = NetworkTable(), array('L')
+    for _, chunk_table, chunk_rows, issues, rows_checked in results:
+        table.extend(chunk_table)
+        rows.extend(chunk_rows)
+        for issue in issues:
+            report.add(*issue)
+        report.rows_checked += rows_checked
+    return table, rows
@@ -0,0 +1,444 @@
+"""
+   qradarzoldaxservice.py
+
+   Description: Resident service mode (--serve). One process keeps the pooled
+   connection to QRadar and an in-memory copy of the Network Hierarchy (a
+   NetworkTable and its LookupIndex) and of the domains, refreshed in the
+   background, and answers lookup, export, domain and status requests over
+   localhost HTTP or a Unix socket. Each refresh builds a new immutable
+   snapshot and swaps it in with a single assignment: readers never wait for
+   a refresh, and a refresh that fails leaves the current snapshot in place.
+
+   Endpoints:
+   - GET  /lookup?ip=A&ip=B   JSON list of the networks of the addresses
+   - POST /lookup             body: IPs one per line, CSV result as with --lookup
+   - GET  /networks           CSV export, with the domain_id, group_prefix, country,
+                              cidr_within and columns parameters of the export filter
+   - GET  /tree?group=G       JSON statistics of the group subtree (depth=N levels)
+   - GET  /domains            JSON list of the domains
+   - GET  /status             JSON state of the service (size, age, refreshes, errors)
+   - POST /refresh            start a refresh now
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import csv
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+import qradarzoldaxlib
+from qradarzoldaxclass import QRadarNetworkHierarchy
+from qradarzoldaxdomains import DomainIndex
+from qradarzoldaxfilter import ExportFilter
+from qradarzoldaxgroups import GroupTree
+from qradarzoldaxlookup import LOOKUP_COLUMNS, NOT_FOUND, LookupIndex
+from qradarzoldaxnetwork import NetworkTable
+
+DEFAULT_LISTEN = "127.0.0.1:8600"
+# Seconds between two background refreshes (config 'serve_refresh')
+DEFAULT_REFRESH_INTERVAL = 300
+# Size of the chunks of a streamed CSV response
+CHUNK_SIZE = 65536
+# Largest POST /lookup body accepted
+MAX_BODY = 64 * 1024 * 1024
+
+
+class HierarchySnapshot:
+    """
+    The hierarchy and domains of the console at one point in time, never modified once built.
+
+    Attributes:
+    -----------
+    table : NetworkTable
+        The networks, for exports.
+    index : LookupIndex
+        Longest-prefix-match index of the networks, for lookups.
+    groups : GroupTree
+        Group tree of the networks, for the statistics and the exports of a group subtree.
+    domains : DomainIndex
+        Domains of the console, None if they could not be fetched.
+    fetched_at : float
+        time.time() at the end of the fetch.
+    seconds : float
+        Duration of the fetch and of the index build.
+    """
+
+    def __init__(self, table: NetworkTable, domains: Optional[DomainIndex], seconds: float = 0.0):
+        self.table = table
+        self.index = LookupIndex.build(iter(table))
+        self.groups = GroupTree.build(table)
+        self.domains = domains
+        self.fetched_at = time.time()
+        self.seconds = seconds
+
+
+class HierarchyService:
+    """
+    In-memory copy of a console, kept up to date by a background thread.
+
+    Readers use `snapshot` as it is when they start; refresh() builds the next snapshot
+    aside and replaces the reference, so lookups keep running during a refresh.
+
+    Attributes:
+    -----------
+    qradar_nh : QRadarNetworkHierarchy
+        Console the hierarchy is fetched from (its transport keeps the connection pool).
+    interval : float
+        Seconds between two background refreshes.
+    snapshot : HierarchySnapshot
+        Current state, None before the first refresh.
+    refreshes : int
+        Successful refreshes.
+    failures : int
+        Failed refreshes.
+    last_error : str
+        Error of the last failed refresh, None after a success.
+    """
+
+    def __init__(self, qradar_nh: QRadarNetworkHierarchy, interval: Optional[float] = None):
+        self.qradar_nh = qradar_nh
+        self.interval = float(qradar_nh.config.get('serve_refresh', DEFAULT_REFRESH_INTERVAL)) if interval is None else interval
+        self.snapshot = None
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+        self._refreshing = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def refreshing(self) -> bool:
+        return self._refreshing.locked()
+
+    def refresh(self) -> bool:
+        """
+        Fetch the hierarchy and the domains, and replace the snapshot.
+
+        The hierarchy is asked to QRadar (fresh=True): with a cached copy, the request is
+        conditional, and an unchanged hierarchy costs a 304 instead of a full body.
+
+        :return: True if the snapshot was replaced, False if the refresh failed or another one is running.
+        """
+        if not self._refreshing.acquire(blocking=False):
+            return False
+        try:
+            start = time.perf_counter()
+            table = NetworkTable.from_api(self.qradar_nh.iter_network_hierarchy(fresh=True))
+            domains = self.qradar_nh.domain_index(refresh=True)
+            if domains is None and self.snapshot is not None:
+                # Keep the domains of the previous snapshot rather than none
+                domains = self.snapshot.domains
+            self.snapshot = HierarchySnapshot(table, domains, time.perf_counter() - start)
+            self.refreshes += 1
+            self.last_error = None
+            qradarzoldaxlib.logger.info(f"Service refresh: {len(table)} networks in {self.snapshot.seconds:.2f}s")
+            return True
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            qradarzoldaxlib.logger.error(f"Service refresh failed, keeping the previous hierarchy: {e}")
+            return False
+        finally:
+            self._refreshing.release()
+
+    def request_refresh(self):
+        """Wake the background thread for a refresh now."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.refresh()
+
+    def start(self) -> "HierarchyService":
+        """Start the background refreshes (the first refresh should be done by the caller)."""
+        self._thread = threading.Thread(target=self._run, name="nhsuite-refresh", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def status(self) -> dict:
+        snapshot = self.snapshot
+        status = {"console": self.qradar_nh.config.get('ip_QRadar', ''), "refreshing": self.refreshing,
+                  "refresh_interval": self.interval, "refreshes": self.refreshes, "failures": self.failures,
+                  "last_error": self.last_error}
+        if snapshot is not None:
+            status.update({"networks": len(snapshot.table), "segments": len(snapshot.index.starts),
+                           "groups": len(snapshot.groups),
+                           "domains": len(snapshot.domains) if snapshot.domains is not None else None,
+                           "fetched_at": round(snapshot.fetched_at, 3),
+                           "age": round(time.time() - snapshot.fetched_at, 3),
+                           "refresh_seconds": round(snapshot.seconds, 3)})
+        return status
+
+
+def lookup_json(index: LookupIndex, ips: list) -> list:
+    """Networks of some addresses as dicts of the --lookup columns ('N/A' when not found or invalid)."""
+    return [dict(zip(LOOKUP_COLUMNS, (ip,) + (network or NOT_FOUND)))
+            for ip, network in zip(ips, index.lookup_many(ips))]
+
+
+class _ChunkedWriter:
+    """File-like object sending what is written as HTTP/1.1 chunks of about CHUNK_SIZE bytes."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.parts = []
+        self.size = 0
+
+    def write(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            data = "".join(self.parts).encode('utf-8')
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.parts, self.size = [], 0
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Request handler; the data lives in the HierarchyService of the server."""
+
+    # Keep-alive: a client reusing its connection pays no handshake per request
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes: without TCP_NODELAY, Nagle and delayed ACKs add ~40 ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def service(self) -> HierarchyService:
+        return self.server.service
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, body):
+        self._send(status, json.dumps(body).encode('utf-8'), "application/json")
+
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {"error": message})
+
+    def _snapshot(self) -> Optional[HierarchySnapshot]:
+        snapshot = self.service.snapshot
+        if snapshot is None:
+            self._send_error(503, "the hierarchy has not been fetched yet")
+        return snapshot
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/status":
+            return self._send_json(200, self.service.status())
+        if url.path not in ("/lookup", "/networks", "/domains", "/tree"):
+            return self._send_error(404, f"unknown path {url.path}")
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return
+        if url.path == "/lookup":
+            ips = [ip.strip() for ip in query.get("ip", ())]
+            if not ips:
+                return self._send_error(400, "missing ip parameter")
+            return self._send_json(200, lookup_json(snapshot.index, ips))
+        if url.path == "/domains":
+            if snapshot.domains is None:
+                return self._send_error(503, "the domains could not be fetched")
+            return self._send_json(200, snapshot.domains.domains)
+        if url.path == "/tree":
+            return self._get_tree(snapshot, query)
+        self._get_networks(snapshot, query)
+
+    def _get_tree(self, snapshot: HierarchySnapshot, query: dict):
+        group = query.get("group", [""])[0].strip()
+        try:
+            depth = int(query["depth"][0]) if "depth" in query else None
+        except ValueError:
+            return self._send_error(400, "depth must be an integer")
+        node = snapshot.groups.find(group)
+        if node is None:
+            return self._send_error(404, f"no network in group {group}")
+        self._send_json(200, snapshot.groups.to_dict(node, depth))
+
+    def _get_networks(self, snapshot: HierarchySnapshot, query: dict):
+        try:
+            columns = [column for value in query.get("columns", ()) for column in value.split(",")]
+            export_filter = ExportFilter(query.get("domain_id"), query.get("group_prefix"), query.get("country"),
+                                         query.get("cidr_within"), columns)
+        except ValueError as e:
+            return self._send_error(400, str(e))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        output = _ChunkedWriter(self.wfile)
+        writer = csv.writer(output, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(export_filter.columns)
+        entries = snapshot.table
+        if export_filter.group_prefixes:
+            # Only the networks of the subtrees are read, the other predicates are checked on them
+            entries = map(snapshot.table.__getitem__, snapshot.groups.select(export_filter.group_prefixes))
+        writer.writerows(export_filter.project(map(QRadarNetworkHierarchy.network_to_csv_row,
+                                                   export_filter.apply(entries))))
+        output.close()
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == "/refresh":
+            self.service.request_refresh()
+            return self._send_json(202, {"refresh": "requested", "refreshing": self.service.refreshing})
+        if path != "/lookup":
+            return self._send_error(404, f"unknown path {path}")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            return self._send_error(413, f"body larger than {MAX_BODY} bytes")
+        body = self.rfile.read(length).decode('utf-8', errors='replace')
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return
+        ips = [ip for ip in map(str.strip, body.splitlines()) if ip]
+        lines = ",".join(LOOKUP_COLUMNS) + "\n" + (snapshot.index.format_batch(ips) if ips else "")
+        self._send(200, lines.encode('utf-8'), "text/csv; charset=utf-8")
+
+
+class UnixServiceHandler(ServiceHandler):
+    # No Nagle on Unix sockets (and no TCP option to set)
+    disable_nagle_algorithm = False
+
+
+class ServiceHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # A client closing its connection early has nothing to report
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class ServiceUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+    handle_error = ServiceHTTPServer.handle_error
+
+
+def is_unix_socket(listen: str) -> bool:
+    """True if a --serve address is a Unix socket path (unix:PATH, or any value with a '/')."""
+    return listen.startswith("unix:") or "/" in listen
+
+
+def make_server(service: HierarchyService, listen: str = DEFAULT_LISTEN):
+    """
+    Create the server of a service, listening on host:port or on a Unix socket.
+
+    The Unix socket is created readable and writable by its owner and group only.
+
+    :raises ValueError: If the address is malformed.
+    :raises OSError: If the address cannot be bound.
+    """
+    if is_unix_socket(listen):
+        path = listen[len("unix:"):] if listen.startswith("unix:") else listen
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise OSError(f"{path} exists and is not a socket")
+            # Left by a previous run, unless a server still answers on it
+            with socket.socket(socket.AF_UNIX) as probe:
+                if probe.connect_ex(path) == 0:
+                    raise OSError(f"{path} is already served by another process")
+            os.remove(path)
+        server = ServiceUnixServer(path, UnixServiceHandler)
+        os.chmod(path, 0o660)
+    else:
+        host, _, port = listen.rpartition(":")
+        if not port.isdigit():
+            raise ValueError(f"invalid listen address {listen!r}, expected HOST:PORT or a socket path")
+        server = ServiceHTTPServer((host or "127.0.0.1", int(port)), ServiceHandler)
+    server.service = service
+    return server
+
+
+def server_address(server) -> str:
+    """Address of a server, for messages."""
+    if isinstance(server.server_address, str):
+        return f"unix:{server.server_address}"
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def serve(qradar_nh: QRadarNetworkHierarchy, listen: str = DEFAULT_LISTEN, interval: Optional[float] = None):
+    """
+    Fetch the hierarchy, then answer requests until interrupted (Ctrl-C or SIGTERM).
+
+    :param qradar_nh: Console to serve.
+    :param listen: host:port, or a Unix socket path.
+    :param interval: Seconds between refreshes (config 'serve_refresh', default 300).
+    :raises RuntimeError: If the first fetch fails.
+    """
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    service = HierarchyService(qradar_nh, interval)
+    # Bound first: a busy address fails before the fetch
+    server = make_server(service, listen)
+    if not service.refresh():
+        server.server_close()
+        raise RuntimeError(f"could not fetch the hierarchy: {service.last_error}")
+    service.start()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, terminate)
+    status = service.status()
+    print(f"Serving {status['networks']} networks of {status['console']} on {server_address(server)}, "
+          f"refreshed every {service.interval:g}s (Ctrl-C to stop)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+            os.remove(server.server_address)
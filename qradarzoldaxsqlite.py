@@ -0,0 +1,246 @@
+"""
+   qradarzoldaxsqlite.py
+
+   Description: Export of the Network Hierarchy to an indexed SQLite database,
+   and queries on it without contacting QRadar. Each network is one row of the
+   "networks" table, with its address range as integers (start_address,
+   end_address) for containment queries, and indexes on group, domain_id,
+   country_code and the range. The rows are inserted in bulk in a single
+   transaction, the indexes are created afterwards, and the database replaces
+   the target file only once it is complete.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from qradarzoldaxfilter import ExportFilter
+from qradarzoldaxlookup import ip_to_int
+from qradarzoldaxnetindex import network_range
+from qradarzoldaxvalidator import CSV_COLUMNS, InvalidValue, cidr_to_int
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+# Bump when the schema changes
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE networks (
+    id INTEGER,
+    "group" TEXT,
+    name TEXT,
+    cidr TEXT,
+    description TEXT,
+    domain_id INTEGER,
+    latitude REAL,
+    longitude REAL,
+    country_code TEXT,
+    start_address INTEGER,
+    end_address INTEGER,
+    prefix INTEGER
+);
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT);
+"""
+INDEXES = """
+CREATE INDEX networks_group ON networks ("group");
+CREATE INDEX networks_domain_id ON networks (domain_id);
+CREATE INDEX networks_country_code ON networks (country_code);
+CREATE INDEX networks_range ON networks (start_address, end_address);
+CREATE INDEX networks_id ON networks (id);
+"""
+INSERT = "INSERT INTO networks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+# SQL expression of each CSV column; location is rebuilt as "latitude,longitude" like the CSV export
+COLUMN_SQL = {
+    "id": "id", "group": '"group"', "name": "name", "cidr": "cidr", "description": "description",
+    "domain_id": "domain_id", "country_code": "country_code",
+    "location": "CASE WHEN latitude IS NULL THEN 'N/A' ELSE latitude || ',' || longitude END",
+}
+
+
+def is_sqlite_file(filename: str) -> bool:
+    """True if an export to `filename` should be a SQLite database (.db, .sqlite, .sqlite3)."""
+    return os.path.splitext(filename)[1].lower() in SQLITE_EXTENSIONS
+
+
+def network_to_sqlite_row(entry) -> tuple:
+    """
+    Convert a network entry (API dict or Network) into a row of the networks table.
+
+    Missing fields are NULL; so are the address columns of a CIDR that is not IPv4.
+    """
+    get = entry.get
+    location = get("location")
+    latitude = longitude = None
+    if isinstance(location, dict) and location.get("type") == "Point" and len(location.get("coordinates") or ()) == 2:
+        # GeoJSON order: longitude first
+        longitude, latitude = location["coordinates"]
+    cidr = get("cidr")
+    start = end = prefix = None
+    try:
+        start, prefix = cidr_to_int(str(cidr).strip())
+        end = start | ((1 << (32 - prefix)) - 1)
+    except InvalidValue:
+        pass
+    return (get("id"), get("group"), get("name"), cidr, get("description"), get("domain_id"),
+            latitude, longitude, get("country_code"), start, end, prefix)
+
+
+def _execute_script(connection: sqlite3.Connection, script: str):
+    """Run the statements of a script inside the current transaction (executescript() would commit it)."""
+    for statement in script.split(";"):
+        if statement.strip():
+            connection.execute(statement)
+
+
+def write_database(filename: str, entries: Iterable, metadata: Optional[dict] = None) -> int:
+    """
+    Write networks to a new SQLite database, replacing `filename` once it is complete.
+
+    :param filename: Path of the database.
+    :param entries: Networks (API dicts or Network objects), consumed once.
+    :param metadata: Extra key/values stored in the metadata table (e.g. the source console).
+    :return: Number of networks written.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    descriptor, temporary = tempfile.mkstemp(prefix=".nhsuite-", suffix=".db", dir=directory)
+    os.close(descriptor)
+    try:
+        connection = sqlite3.connect(temporary, isolation_level=None)
+        try:
+            # A half-written file is thrown away, so no journal is needed
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute("BEGIN")
+            _execute_script(connection, SCHEMA)
+            connection.executemany(INSERT, map(network_to_sqlite_row, entries))
+            count = connection.execute("SELECT count(*) FROM networks").fetchone()[0]
+            # Building the indexes once is faster than updating them on every insert
+            _execute_script(connection, INDEXES)
+            values = {"schema_version": SCHEMA_VERSION, "exported_at": datetime.now().isoformat(timespec="seconds"),
+                      "networks": count, **(metadata or {})}
+            connection.executemany("INSERT INTO metadata VALUES (?, ?)",
+                                   ((key, str(value)) for key, value in values.items()))
+            connection.execute("COMMIT")
+            connection.execute("ANALYZE")
+        finally:
+            connection.close()
+        # Readable like the CSV export (mkstemp creates the file for its owner only)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return count
+
+
+def connect_read_only(filename: str) -> sqlite3.Connection:
+    """
+    Open an exported database for reading.
+
+    :raises FileNotFoundError: If the file does not exist.
+    :raises sqlite3.DatabaseError: If it is not an NHSuite database.
+    """
+    if not os.path.isfile(filename):
+        raise FileNotFoundError(f"{filename} not found")
+    connection = sqlite3.connect(f"{Path(filename).absolute().as_uri()}?mode=ro", uri=True)
+    try:
+        connection.execute("SELECT start_address, end_address FROM networks LIMIT 0")
+    except sqlite3.DatabaseError:
+        connection.close()
+        raise sqlite3.DatabaseError(f"{filename} is not a network hierarchy database exported by NHSuite")
+    return connection
+
+
+def filter_clause(export_filter: Optional[ExportFilter], contains: Optional[List[str]] = None) -> Tuple[str, list]:
+    """
+    WHERE clause (with its parameters) of the networks selected by a filter and containing some IPs.
+
+    Group subtrees are range conditions on "group" (EMEA.Paris... sorts between "EMEA." and
+    "EMEA/"), so they use the index and stay case-sensitive, unlike LIKE.
+
+    :param export_filter: Domains, groups, countries and CIDR ranges to keep.
+    :param contains: IPv4 addresses, a network is kept if it contains one of them.
+    :raises ValueError: If an address is not a valid IPv4 address.
+    """
+    terms, params = [], []
+
+    def any_of(conditions: list):
+        terms.append(conditions[0] if len(conditions) == 1 else f"({' OR '.join(conditions)})")
+
+    if export_filter is not None:
+        if export_filter.domain_ids:
+            terms.append(f"domain_id IN ({', '.join('?' * len(export_filter.domain_ids))})")
+            params.extend(export_filter.domain_ids)
+        if export_filter.countries:
+            terms.append(f"country_code IN ({', '.join('?' * len(export_filter.countries))})")
+            params.extend(export_filter.countries)
+        if export_filter.group_prefixes:
+            any_of(['("group" = ? OR ("group" >= ? AND "group" < ?))'] * len(export_filter.group_prefixes))
+            for prefix in export_filter.group_prefixes:
+                params.extend((prefix, prefix + ".", prefix + "/"))
+        if export_filter.cidr_within:
+            any_of(["(start_address >= ? AND end_address <= ?)"] * len(export_filter.cidr_within))
+            for cidr in export_filter.cidr_within:
+                params.extend(network_range(cidr))
+    if contains:
+        # A network containing an address starts at the address masked by its prefix: 33
+        # possible starts, each one an index lookup, instead of a scan of start_address <= address
+        conditions = []
+        for ip in contains:
+            try:
+                address = ip_to_int(ip.strip())
+            except OSError:
+                raise ValueError(f"invalid IPv4 address {ip!r}") from None
+            starts = sorted({address & ~((1 << (32 - prefix)) - 1) & 0xFFFFFFFF for prefix in range(33)})
+            conditions.append(f"(start_address IN ({', '.join('?' * len(starts))}) AND end_address >= ?)")
+            params.extend(starts)
+            params.append(address)
+        any_of(conditions)
+    return (f" WHERE {' AND '.join(terms)}" if terms else ""), params
+
+
+def query_networks(connection: sqlite3.Connection, export_filter: Optional[ExportFilter] = None,
+                   contains: Optional[List[str]] = None) -> Tuple[List[str], Iterator[tuple]]:
+    """
+    Select networks of an exported database, as rows of the CSV export.
+
+    With `contains`, the most specific networks come first; otherwise the rows are in
+    export order.
+
+    :return: Tuple (column names, iterator of rows).
+    """
+    columns = export_filter.columns if export_filter is not None else list(CSV_COLUMNS)
+    where, params = filter_clause(export_filter, contains)
+    order = "prefix DESC, rowid" if contains else "rowid"
+    cursor = connection.execute(f"SELECT {', '.join(COLUMN_SQL[column] for column in columns)} "
+                                f"FROM networks{where} ORDER BY {order}", params)
+    return columns, iter(cursor)
+
+
+def run_sql(connection: sqlite3.Connection, statement: str) -> Tuple[List[str], Iterator[tuple]]:
+    """
+    Run an SQL statement on an exported database (opened read-only).
+
+    :return: Tuple (column names, iterator of rows).
+    """
+    cursor = connection.execute(statement)
+    return [description[0] for description in cursor.description or ()], iter(cursor)
@@ -0,0 +1,399 @@
+"""
+   qradarzoldaxvalidator.py
+
+   Description: Schema-driven validation of Network Hierarchy CSV rows.
+   All rules are compiled once at import; each row is validated and converted
+   to the QRadar API format in a single pass, and every problem is collected
+   in a ValidationReport with its row and column instead of being printed.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import csv
+import gc
+import json
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional
+
+# Network Hierarchy CSV header, used for export and expected on import
+CSV_COLUMNS = ["id", "group", "name", "cidr", "description", "domain_id", "location", "country_code"]
+
+# Severities: an error blocks the import, a warning drops the value and the import continues
+ERROR = "error"
+WARNING = "warning"
+
+# Compiled rules
+LOCATION_PATTERN = re.compile(r'^(-?\d+(\.\d+)?),\s*(-?\d+(\.\d+)?)$')
+COUNTRY_CODE_PATTERN = re.compile(r'^[A-Z]{2}$')
+GROUP_PATTERN = re.compile(r'^[A-Za-z0-9\.\-_]+$')
+NETWORK_NAME_PATTERN = re.compile(r'^[A-Za-z0-9\-_]+$')
+_OCTET = r'(25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+CIDR_PATTERN = re.compile(rf'^{_OCTET}\.{_OCTET}\.{_OCTET}\.{_OCTET}/(3[0-2]|[12]?\d)$')
+
+# Values meaning "no value" in optional columns, as written by the export
+EMPTY_VALUES = ("", "N/A")
+
+ValidationIssue = namedtuple("ValidationIssue", ["row", "column", "value", "rule", "message", "severity"])
+# Issues of one column and rule: count, message of the first one, first rows and distinct values
+IssueGroup = namedtuple("IssueGroup", ["severity", "column", "rule", "count", "message", "rows", "values"])
+
+# Rules reporting a value that is valid by itself: a conflict with another row (see
+# qradarzoldaxnetindex.check_conflicts), or a domain name that could not be checked
+VALID_VALUE_RULES = ("duplicate_id", "duplicate_cidr", "nested_same_group", "unresolved_domain_name")
+
+# Issues printed one by one before the summary by column and rule (config 'report_limit')
+DEFAULT_REPORT_LIMIT = 50
+# Rows and values kept as examples of each group of issues
+SAMPLE_SIZE = 5
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the cyclic garbage collector while building large lists of network objects.
+
+    Row dicts never form reference cycles, but allocating hundreds of thousands
+    of them triggers repeated full collections that double the validation time.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class InvalidValue(ValueError):
+    """Raised by a column parser when a value breaks its rule."""
+
+
+def parse_int(value: str) -> int:
+    """Convert an integer column (id)."""
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidValue("must be an integer") from None
+
+
+def parse_domain(value: str):
+    """
+    Convert the domain_id column: an integer id, or a domain name to resolve to its id.
+
+    Ids are checked and names resolved against the domains of QRadar (see check_domains);
+    a name is an error when the domains are not available.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    if not value:
+        raise InvalidValue("must be a domain id or a domain name")
+    return value
+
+
+def parse_text(value: str) -> str:
+    """Free text column (description), kept as is."""
+    return value
+
+
+def parse_group(value: str) -> str:
+    """Validate the group format. Allowed characters: Alphanumerics, ., -, _"""
+    if not GROUP_PATTERN.match(value):
+        raise InvalidValue("a group name may only contain letters, numbers, '.', '-', or '_'")
+    return value
+
+
+def parse_network_name(value: str) -> str:
+    """Validate the network name format. Allowed characters: Alphanumerics, -, _"""
+    if not NETWORK_NAME_PATTERN.match(value):
+        raise InvalidValue("a network name may only contain letters, numbers, '-', or '_'")
+    return value
+
+
+# A validated row is parsed again right away when it is added to a NetworkTable: keep the last results
+@lru_cache(maxsize=256)
+def cidr_to_int(cidr: str) -> tuple:
+    """
+    Parse an IPv4 CIDR with the compiled pattern.
+
+    :param cidr: CIDR string, e.g. "10.0.0.0/8".
+    :return: Tuple (network address as int, prefix length).
+    :raises InvalidValue: If the CIDR is malformed or has host bits set.
+    """
+    match = CIDR_PATTERN.match(cidr)
+    if not match:
+        raise InvalidValue("must be an IPv4 network in CIDR notation (a.b.c.d/n)")
+    a, b, c, d, prefix = match.groups()
+    address = (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+    prefix = int(prefix)
+    if address & ((1 << (32 - prefix)) - 1):
+        raise InvalidValue("has host bits set")
+    return address, prefix
+
+
+def parse_cidr(value: str) -> str:
+    """Validate an IPv4 CIDR."""
+    cidr_to_int(value)
+    return value
+
+
+def parse_location(value: str) -> dict:
+    """Convert "lat,long" into the API GeoJSON point (long first)."""
+    match = LOCATION_PATTERN.match(value)
+    if not match:
+        raise InvalidValue("must be 'latitude,longitude'")
+    lat, lon = float(match.group(1)), float(match.group(3))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise InvalidValue("latitude must be within [-90, 90] and longitude within [-180, 180]")
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def parse_country_code(value: str) -> str:
+    """Validate a two-letter country code."""
+    if not COUNTRY_CODE_PATTERN.match(value):
+        raise InvalidValue("must be a two-letter uppercase country code")
+    return value
+
+
+# Column schema: name, parser, severity when invalid, whether "" / "N/A" mean "no value", whether to strip
+Column = namedtuple("Column", ["name", "parse", "severity", "optional", "strip"])
+
+SCHEMA = (
+    Column("id", parse_int, ERROR, False, True),
+    Column("group", parse_group, ERROR, False, True),
+    Column("name", parse_network_name, ERROR, False, True),
+    Column("cidr", parse_cidr, ERROR, False, True),
+    Column("description", parse_text, ERROR, False, False),
+    Column("domain_id", parse_domain, ERROR, False, True),
+    Column("location", parse_location, WARNING, True, True),
+    Column("country_code", parse_country_code, WARNING, True, True),
+)
+
+
+class ValidationReport:
+    """
+    Collects the issues found while validating a Network Hierarchy CSV.
+
+    Attributes:
+    -----------
+    issues : list
+        ValidationIssue(row, column, value, rule, message, severity) in file order.
+    rows_checked : int
+        Number of data rows validated.
+    """
+
+    def __init__(self, source: str = ""):
+        self.source = source
+        self.issues: List[ValidationIssue] = []
+        self.rows_checked = 0
+        self.error_count = 0
+        self.warning_count = 0
+
+    def add(self, row: int, column: str, value: Optional[str], rule: str, message: str, severity: str = ERROR):
+        """Record one issue."""
+        self.issues.append(ValidationIssue(row, column, value, rule, message, severity))
+        if severity == ERROR:
+            self.error_count += 1
+        else:
+            self.warning_count += 1
+
+    @property
+    def has_errors(self) -> bool:
+        return self.error_count > 0
+
+    def summary(self) -> str:
+        """One-line summary of the validation."""
+        return (f"{self.source}: {self.rows_checked} rows checked, "
+                f"{self.error_count} error(s), {self.warning_count} warning(s)")
+
+    def format_issue(self, issue: ValidationIssue) -> str:
+        """Human-readable line for one issue."""
+        if issue.rule == "header":
+            return issue.message
+        consequence = "import blocked" if issue.severity == ERROR else "warning"
+        label = "value" if issue.rule in VALID_VALUE_RULES else "invalid value"
+        return (f"Row {issue.row}, column {issue.column}: {label} {issue.value!r} - "
+                f"{issue.message} ({consequence})")
+
+    def groups(self) -> List[IssueGroup]:
+        """
+        Issues aggregated by column and rule: errors first, then by decreasing count.
+
+        A file with a systematic problem (e.g. a group naming convention QRadar rejects)
+        gives one group of many issues instead of one line per row.
+        """
+        groups = {}
+        for issue in self.issues:
+            key = (issue.severity, issue.column, issue.rule)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = [0, issue.message, [], []]
+            group[0] += 1
+            if len(group[2]) < SAMPLE_SIZE:
+                group[2].append(issue.row)
+            if len(group[3]) < SAMPLE_SIZE and issue.value not in group[3]:
+                group[3].append(issue.value)
+        return sorted((IssueGroup(severity, column, rule, *group) for (severity, column, rule), group in groups.items()),
+                      key=lambda group: (group.severity != ERROR, -group.count))
+
+    @staticmethod
+    def format_group(group: IssueGroup) -> str:
+        """Human-readable line for a group of issues."""
+        rows = ", ".join(map(str, group.rows)) + (", ..." if group.count > len(group.rows) else "")
+        values = ", ".join(repr(value) for value in group.values)
+        return (f"{group.count} {group.severity}(s) in column {group.column} ({group.rule}): {group.message} - "
+                f"rows {rows}; values {values}")
+
+    def print_report(self, limit: int = DEFAULT_REPORT_LIMIT, logger=None):
+        """
+        Print the first `limit` issues, the issues by column and rule if some were left out, and the summary.
+
+        :param limit: Maximum number of issues printed one by one (0: only the groups).
+        :param logger: If given, the same lines are also logged as errors.
+        """
+        lines = [self.format_issue(issue) for issue in self.issues[:max(0, limit)]]
+        if len(self.issues) > limit:
+            if lines:
+                lines.append(f"... and {len(self.issues) - limit} more issue(s), by column and rule:")
+            lines.extend(map(self.format_group, self.groups()))
+        lines.append(self.summary())
+        print("\n".join(lines))
+        if logger is not None:
+            for line in lines:
+                logger.error(line)
+
+    def _header(self) -> dict:
+        return {
+            "source": self.source,
+            "rows_checked": self.rows_checked,
+            "errors": self.error_count,
+            "warnings": self.warning_count,
+            "groups": [group._asdict() for group in self.groups()],
+        }
+
+    def to_dict(self) -> dict:
+        """Report as a JSON-serializable dict."""
+        return {**self._header(), "issues": [issue._asdict() for issue in self.issues]}
+
+    def write_json(self, filename: str):
+        """
+        Write the report (to_dict() layout) to a JSON file.
+
+        The issues are written one by one, so a report of a million issues is never
+        built as one object in memory.
+        """
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(self._header())[:-1] + ', "issues": [')
+            for position, issue in enumerate(self.issues):
+                file.write(("," if position else "") + "\n" + json.dumps(issue._asdict()))
+            file.write("\n]}\n")
+
+
+class RowValidator:
+    """
+    Validates and converts Network Hierarchy CSV rows in one pass, following SCHEMA.
+    """
+
+    def __init__(self, schema: Iterable[Column] = SCHEMA):
+        self.schema = tuple(schema)
+        self.header = [column.name for column in self.schema]
+        self.width = len(self.schema)
+
+    def check_header(self, header: Optional[List[str]], report: ValidationReport) -> bool:
+        """Check the CSV header against the schema, recording an issue if it differs."""
+        if header != self.header:
+            report.add(1, "*", ",".join(header or []), "header",
+                       f"Header is not correct, must be {','.join(self.header)}.")
+            return False
+        return True
+
+    def validate(self, fields: List[str], row: int, report: ValidationReport) -> Optional[dict]:
+        """
+        Validate and convert one CSV row.
+
+        :param fields: Raw CSV fields, in header order.
+        :param row: Line number of the row in the file, for the report.
+        :param report: Report collecting the issues.
+        :return: Network object for the API, or None if the row has errors.
+        """
+        report.rows_checked += 1
+        if len(fields) != self.width:
+            report.add(row, "*", ",".join(fields), "field_count",
+                       f"expected {self.width} fields, found {len(fields)}")
+            return None
+
+        network_obj = {}
+        valid = True
+        for column, value in zip(self.schema, fields):
+            if column.strip:
+                value = value.strip()
+            if column.optional and value in EMPTY_VALUES:
+                continue
+            try:
+                network_obj[column.name] = column.parse(value)
+            except InvalidValue as e:
+                if column.severity == ERROR:
+                    report.add(row, column.name, value, column.name, str(e), ERROR)
+                    valid = False
+                else:
+                    report.add(row, column.name, value, column.name, f"{e}, value set to null", WARNING)
+        return network_obj if valid else None
+
+    def validate_rows(self, reader, report: ValidationReport, line_offset: int = 0, numbered: bool = False) -> Iterator:
+        """
+        Validate rows from a csv.reader (header already consumed), yielding valid network objects.
+
+        Blank lines are skipped, as csv.DictReader does.
+
+        :param reader: csv.reader over the file; its line_num gives the row numbers.
+        :param report: Report collecting the issues.
+        :param line_offset: Added to line_num when the reader starts inside the file.
+        :param numbered: Yield (row number, network object) tuples instead of network objects.
+        """
+        validate = self.validate
+        for fields in reader:
+            if not fields:
+                continue
+            row = reader.line_num + line_offset
+            network_obj = validate(fields, row, report)
+            if network_obj is not None:
+                yield (row, network_obj) if numbered else network_obj
+
+
+def validate_csv(csv_filename: str, report: Optional[ValidationReport] = None,
+                 validator: Optional[RowValidator] = None, numbered: bool = False) -> Iterator:
+    """
+    Validate a Network Hierarchy CSV file, yielding the valid network objects.
+
+    The header is checked first; on a wrong header nothing is yielded and the
+    issue is recorded in the report.
+
+    :param csv_filename: Path of the CSV file.
+    :param report: Report collecting the issues (a new one if not given).
+    :param validator: RowValidator to use.
+    :param numbered: Yield (row number, network object) tuples instead of network objects.
+    """
+    report = ValidationReport(csv_filename) if report is None else report
+    validator = RowValidator() if validator is None else validator
+    with open(csv_filename, 'r', newline='', encoding='utf-8') as csv_file:
+        reader = csv.reader(csv_file)
+        if not validator.check_header(next(reader, None), report):
+            return
+        yield from validator.validate_rows(reader, report, numbered=numbered)
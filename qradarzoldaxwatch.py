@@ -0,0 +1,231 @@
+"""
+   qradarzoldaxwatch.py
+
+   Description: Drift watch mode (--watch). The Network Hierarchy of one or
+   several consoles is polled at a fixed interval and compared with the
+   previous poll, so that edits made in the console UI show up without full
+   exports and external diffs. Each poll computes the digest of the whole
+   table from its columns: when it is unchanged, nothing else is done. When
+   it changed, the networks are hashed one by one (the canonical records of
+   qradarzoldaxdelta) and only the added, removed and modified networks are
+   written, one JSON object per line.
+
+   Copyright 2023 Pascal Weber (zoldax) / Abakus Sécurité
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+"""
+
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+import qradarzoldaxlib
+from qradarzoldaxclass import QRadarNetworkHierarchy
+from qradarzoldaxdelta import network_digest
+from qradarzoldaxnetwork import API_FIELDS, NetworkTable
+
+# Seconds between two polls (config 'watch_interval')
+DEFAULT_WATCH_INTERVAL = 60
+
+ADDED, REMOVED, MODIFIED = "added", "removed", "modified"
+
+
+class HierarchyState:
+    """
+    One poll of a console: the table, its digest, and the digest of each network (computed on demand).
+
+    Attributes:
+    -----------
+    table : NetworkTable
+        The networks of the poll.
+    digest : bytes
+        NetworkTable.digest() of the table.
+    polled_at : float
+        time.time() of the poll.
+    """
+
+    def __init__(self, table: NetworkTable, polled_at: Optional[float] = None):
+        self.table = table
+        self.digest = table.digest()
+        self.polled_at = time.time() if polled_at is None else polled_at
+        self._networks = None
+
+    @property
+    def networks(self) -> Dict[int, Tuple[bytes, int]]:
+        """Network id -> (digest of its canonical record, position in the table)."""
+        if self._networks is None:
+            self._networks = {entry["id"]: (network_digest(entry), position)
+                              for position, entry in enumerate(self.table.iter_api())}
+        return self._networks
+
+
+def changed_fields(previous: dict, current: dict) -> List[str]:
+    """API fields whose value differs between two versions of a network."""
+    return [field for field in API_FIELDS if previous.get(field) != current.get(field)]
+
+
+def iter_changes(previous: HierarchyState, current: HierarchyState) -> Iterator[dict]:
+    """
+    Added, removed and modified networks between two polls, keyed by network id.
+
+    A network is modified when its canonical record differs (see qradarzoldaxdelta):
+    a change of key order or of float formatting in the API answer is not a change.
+
+    :return: Events {"event", "id", "network", "previous", "fields"}, in the order of the current
+             table, then the removed networks in the order of the previous one.
+    """
+    if previous.digest == current.digest:
+        return
+    before, after = previous.networks, current.networks
+    for network_id, (digest, position) in after.items():
+        old = before.get(network_id)
+        if old is None:
+            yield {"event": ADDED, "id": network_id, "network": current.table.api_entry(position)}
+        elif old[0] != digest:
+            network, former = current.table.api_entry(position), previous.table.api_entry(old[1])
+            yield {"event": MODIFIED, "id": network_id, "network": network, "previous": former,
+                   "fields": changed_fields(former, network)}
+    for network_id, (_, position) in before.items():
+        if network_id not in after:
+            yield {"event": REMOVED, "id": network_id, "previous": previous.table.api_entry(position)}
+
+
+class Watcher:
+    """
+    Polls one console and writes the changes between two polls as JSON lines.
+
+    Attributes:
+    -----------
+    qradar_nh : QRadarNetworkHierarchy
+        Console polled.
+    name : str
+        Console name written in every event.
+    state : HierarchyState
+        Last successful poll, None before the first one.
+    polls, changes, failures : int
+        Counters of the polls, of the events written and of the failed polls.
+    """
+
+    def __init__(self, qradar_nh: QRadarNetworkHierarchy, name: Optional[str] = None):
+        self.qradar_nh = qradar_nh
+        self.name = name or qradar_nh.config.get('name') or qradar_nh.config.get('ip_QRadar', '')
+        self.state = None
+        self.polls = 0
+        self.changes = 0
+        self.failures = 0
+
+    def poll(self) -> Optional[List[dict]]:
+        """
+        Fetch the hierarchy and compare it with the previous poll.
+
+        The GET asks QRadar even when the response cache is on (a conditional request,
+        so an unchanged hierarchy can cost a 304). A failed fetch keeps the previous
+        state, so it is never reported as networks removed.
+
+        :return: The events (empty when nothing changed or on the first poll), None if the poll failed.
+        """
+        try:
+            table = NetworkTable.from_api(self.qradar_nh.iter_network_hierarchy(fresh=True))
+        except Exception as e:
+            self.failures += 1
+            qradarzoldaxlib.logger.error(f"[{self.name}] watch poll failed, keeping the previous state: {e}")
+            return None
+        current = HierarchyState(table)
+        previous, self.state = self.state, current
+        self.polls += 1
+        if previous is None:
+            return []
+        polled_at = datetime.fromtimestamp(current.polled_at, timezone.utc).isoformat(timespec="seconds")
+        events = []
+        for event in iter_changes(previous, current):
+            events.append({"time": polled_at, "console": self.name, **event})
+        self.changes += len(events)
+        return events
+
+
+def write_events(events: List[dict], stream: TextIO, lock: Optional[threading.Lock] = None):
+    """Write events as JSON lines, in one write so that lines of several consoles do not mix."""
+    if not events:
+        return
+    lines = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events)
+    if lock is None:
+        stream.write(lines)
+        stream.flush()
+        return
+    with lock:
+        stream.write(lines)
+        stream.flush()
+
+
+def watch_console(watcher: Watcher, interval: float, stream: TextIO = sys.stdout, status: TextIO = sys.stderr,
+                  stop: Optional[threading.Event] = None, lock: Optional[threading.Lock] = None,
+                  polls: Optional[int] = None):
+    """
+    Poll a console every `interval` seconds, writing the changes to `stream` and one status line per poll to `status`.
+
+    :param stop: Event ending the loop (checked between polls).
+    :param polls: Number of polls before returning, None to run until stopped.
+    """
+    stop = threading.Event() if stop is None else stop
+    count = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        events = watcher.poll()
+        elapsed = time.perf_counter() - start
+        write_events(events or [], stream, lock)
+        if events is None:
+            line = "poll failed, see error.log"
+        elif watcher.polls == 1:
+            line = f"baseline of {len(watcher.state.table)} networks, digest {watcher.state.digest.hex()[:12]}"
+        elif events:
+            line = f"{len(events)} change(s), digest {watcher.state.digest.hex()[:12]}"
+        else:
+            line = "unchanged"
+        print(f"[{watcher.name}] {line} ({elapsed:.2f}s)", file=status, flush=True)
+        count += 1
+        if polls is not None and count >= polls:
+            break
+        # Interval between the starts of two polls, not after the end of the previous one
+        stop.wait(max(0.0, interval - (time.perf_counter() - start)))
+
+
+def watch(consoles: List[dict], interval: Optional[float] = None, page_size: Optional[int] = None,
+          fetch_workers: Optional[int] = None, stream: TextIO = sys.stdout, polls: Optional[int] = None):
+    """
+    Watch several consoles at once, one thread per console, until interrupted (Ctrl-C).
+
+    :param consoles: Console configurations (see qradarzoldaxconsoles.console_configs).
+    :param interval: Seconds between two polls of a console (config 'watch_interval', default 60).
+    :param polls: Number of polls of each console before returning, None to run until interrupted.
+    """
+    stop, lock = threading.Event(), threading.Lock()
+    threads = []
+    for conf in consoles:
+        qradar_nh = QRadarNetworkHierarchy(page_size=page_size, fetch_workers=fetch_workers, conf=conf)
+        seconds = float(conf.get('watch_interval', DEFAULT_WATCH_INTERVAL)) if interval is None else interval
+        thread = threading.Thread(target=watch_console, args=(Watcher(qradar_nh), seconds, stream),
+                                  kwargs={"stop": stop, "lock": lock, "polls": polls},
+                                  name=f"nhsuite-watch-{conf.get('name', '')}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    try:
+        for thread in threads:
+            # A timeout keeps the main thread responsive to Ctrl-C
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()